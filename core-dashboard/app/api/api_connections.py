@@ -7,6 +7,8 @@ from starlette.responses import RedirectResponse
 from app.services.auth import get_current_user
 from app.models.user import User
 from app.models.api_connections import ApiConnection, ApiConnectionCreate, ApiConnectionResponse
+from app.services.dashboard_cache import dashboard_cache
+from app.services.google_tokens import token_manager
 from database.db_setup import get_db
 from typing import Dict, Any, List
 import os
@@ -66,6 +68,8 @@ async def create_api_connection(
 
         db.commit()
         db.refresh(existing_connection)
+        token_manager.forget(existing_connection.id)
+        await dashboard_cache.invalidate(current_user.id)
         return existing_connection
 
     # Create new connection
@@ -77,6 +81,7 @@ async def create_api_connection(
     db.add(new_connection)
     db.commit()
     db.refresh(new_connection)
+    await dashboard_cache.invalidate(current_user.id)
 
     return new_connection
 
@@ -103,6 +108,8 @@ async def delete_api_connection(
 
     db.delete(connection)
     db.commit()
+    token_manager.forget(connection_id)
+    await dashboard_cache.invalidate(current_user.id)
 
     return None
 
@@ -257,6 +264,8 @@ async def google_fit_callback(
         connection.updated_at = datetime.now()
 
         db.commit()
+        token_manager.forget(connection.id)
+        await dashboard_cache.invalidate(connection.user_id)
 
         # Redirect user back to connections page with success information
         return RedirectResponse(url="/connections?auth_success=true")
@@ -1,14 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
-from sqlalchemy.orm import Session
-from typing import Annotated, List
-from datetime import datetime
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from typing import Annotated, List, Literal, Optional, Union
+from datetime import datetime, date, time as day_time
+import time
 
 from app.services.auth import get_current_user
-from app.services.ocr_client import parse_receipt_via_ocr_worker # FIX: Changed from 'services.ocr_client' to 'app.services.ocr_client'
+from app.services.ocr_client import check_upload_size, parse_receipt_via_ocr_worker # FIX: Changed from 'services.ocr_client' to 'app.services.ocr_client'
+from app.services.finance import (
+    compute_content_hash, compute_perceptual_hash, find_duplicate_receipt, find_similar_receipts, save_parsed_receipt,
+    create_transactions_batch,
+)
 from app.models.user import User
-from app.models.transaction import Transaction , TransactionCreate, TransactionResponse
-from app.models.receipt import Receipt, ReceiptItem
-from database.db_setup import get_db
+from app.models.transaction import (
+    Transaction , TransactionCreate, TransactionResponse, TransactionPage, StatementImportResult,
+    TransactionBatchCreate, TransactionBatchResponse,
+)
+from app.models.receipt import Receipt, ReceiptPage, ReceiptResponse, ProductMatch, PricePoint
+from app.models.spending import SpendingRollupResponse
+from app.models.reconciliation import ReceiptTransactionLink, ReceiptTransactionLinkResponse
+from app.services.pagination import before_cursor, date_sort_key, encode_cursor
+from app.services.product_search import search_products, price_history
+from app.services.reconciliation import reconcile, reconcile_new
+from app.services import exports
+from app.services.spending_rollups import apply_to_rollups, get_rollups
+from app.services.statement_import import StatementFormatError, detect_format, import_statement
+from database.db_setup import get_db, QueryCounter
 
 
 router = APIRouter(prefix="/finance")
@@ -28,99 +48,193 @@ async def create_transaction(
         user_id=current_user.id
     )
     db.add(new_transaction)
+    db.flush()
+    apply_to_rollups(db, current_user.id, [(new_transaction.date, "transaction", "", new_transaction.amount)])
     db.commit()
     db.refresh(new_transaction)
+    reconcile_new(db, current_user.id, transaction_ids=[new_transaction.id])
     return new_transaction
 
 
-@router.get("/transactions", response_model=List[TransactionResponse])
-async def get_transactions(
+@router.post("/transactions/batch", response_model=TransactionBatchResponse, status_code=status.HTTP_201_CREATED)
+async def create_transactions(
+    batch: TransactionBatchCreate,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Retrieves a list of all financial transactions for the logged-in user.
+    Creates up to 500 transactions in one database transaction.
+
+    Items carrying an `idempotency_key` that was already used are not
+    duplicated, so a client can safely replay a batch after a failure.
     """
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == current_user.id
-    ).order_by(Transaction.date.desc()).all()
-    
-    return transactions
+    try:
+        ids, created = create_transactions_batch(db, current_user.id, batch.transactions)
+    except IntegrityError:
+        # A concurrent replay inserted some of the same keys first; retry once against its rows
+        db.rollback()
+        ids, created = create_transactions_batch(db, current_user.id, batch.transactions)
+    if created:
+        reconcile_new(db, current_user.id, transaction_ids=ids)
+    return TransactionBatchResponse(ids=ids, created=created, replayed=len(ids) - created)
+
+
+@router.get("/transactions", response_model=Union[TransactionPage, List[TransactionResponse]])
+async def get_transactions(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of next_cursor from the previous page"),
+    date_from: Optional[date] = Query(None, description="First transaction date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Last transaction date (inclusive)"),
+    min_amount: Optional[float] = Query(None, description="Minimum amount (inclusive)"),
+    max_amount: Optional[float] = Query(None, description="Maximum amount (inclusive)"),
+    envelope: bool = Query(True, description="false returns a bare list, as before pagination; "
+                                               "the next cursor is then in the X-Next-Cursor header"),
+):
+    """
+    Retrieves one page of the logged-in user's transactions, newest first.
+
+    Pages are keyed on (date, id); pass `next_cursor` back as `cursor` while
+    `has_more` is true. `count` is the number of transactions on this page.
+    Transactions without a date come last.
+    """
+    sort_key = date_sort_key(Transaction.date)
+    query = db.query(Transaction).filter(Transaction.user_id == current_user.id)
+    if date_from:
+        query = query.filter(sort_key >= datetime.combine(date_from, day_time.min))
+    if date_to:
+        query = query.filter(sort_key <= datetime.combine(date_to, day_time.max), Transaction.date.is_not(None))
+    if min_amount is not None:
+        query = query.filter(Transaction.amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(Transaction.amount <= max_amount)
+    if cursor:
+        query = query.filter(before_cursor(sort_key, Transaction.id, cursor))
+
+    transactions = query.order_by(sort_key.desc(), Transaction.id.desc()).limit(limit + 1).all()
+
+    has_more = len(transactions) > limit
+    transactions = transactions[:limit]
+    next_cursor = encode_cursor(transactions[-1].date, transactions[-1].id) if has_more else None
+
+    if not envelope:
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return transactions
+
+    return TransactionPage(
+        items=transactions,
+        count=len(transactions),
+        has_more=has_more,
+        next_cursor=next_cursor,
+    )
+
+
+@router.post("/transactions/import", response_model=StatementImportResult, status_code=status.HTTP_201_CREATED)
+async def import_transactions(
+    file: Annotated[UploadFile, File()],
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    statement_format: Optional[Literal["csv", "mt940", "ofx"]] = Query(
+        None, alias="format", description="Defaults to detection by file extension"),
+    encoding: str = Query("utf-8-sig", description="Text encoding of the statement, e.g. cp1250"),
+):
+    """
+    Bulk-import transactions from a bank statement (CSV, MT940 or OFX).
+
+    Rows already imported from an earlier statement are skipped; rows that
+    fail validation are counted and the first few reported with line numbers.
+    """
+    statement_format = statement_format or detect_format(file.filename)
+    try:
+        report = await run_in_threadpool(import_statement, db, current_user.id, file.file, statement_format, encoding)
+    except (StatementFormatError, LookupError) as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        print(f"Error importing {statement_format} statement: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error importing statement: {e}"
+        )
+    if report["imported"]:
+        reconcile_new(db, current_user.id)
+    return report
+
+
+@router.get("/spending", response_model=List[SpendingRollupResponse])
+async def get_spending(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    period: Literal["day", "week", "month"] = Query("month"),
+    source: Optional[Literal["transaction", "receipt"]] = Query(None, description="Defaults to both"),
+    group_by: Literal["none", "store"] = Query("none", description="'store' splits receipt spending per store"),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+):
+    """
+    Aggregated spending per period, read from the pre-computed rollups.
+    Totals are signed sums of amounts; `entries` counts the underlying rows.
+    """
+    return get_rollups(db, current_user.id, period, source=source, by_store=group_by == "store",
+                       date_from=date_from, date_to=date_to)
 
 
 @router.post("/upload-receipt", status_code=status.HTTP_201_CREATED)
 async def upload_receipt(
-    file: Annotated[UploadFile, Depends()],
+    file: Annotated[UploadFile, File()],
+    response: Response,
     db: Annotated[Session, Depends(get_db)],
     current_user: Annotated[User, Depends(get_current_user)]
 ):
-    ocr_result = await parse_receipt_via_ocr_worker(file)
+    check_upload_size(file)  # Before hashing or decoding anything
+    # Skip OCR entirely for files this user has already uploaded
+    content_hash = await compute_content_hash(file)
+    existing_id = find_duplicate_receipt(db, current_user.id, content_hash)
+    if existing_id is not None:
+        response.status_code = status.HTTP_200_OK
+        return {"message": "Receipt was already uploaded.", "receipt_id": existing_id, "duplicate": True}
+    # Similar-looking receipts are saved anyway and only reported to the client
+    perceptual_hash = await compute_perceptual_hash(file)
+    similar_ids = find_similar_receipts(db, current_user.id, perceptual_hash)
 
-    parsed_data = ocr_result.get('parsed_data', {})
-    receipt_data = parsed_data.get("receipt_data", {})
-    items_data = parsed_data.get("items", [])
+    ocr_started = time.perf_counter()
+    ocr_result = await parse_receipt_via_ocr_worker(file)
+    ocr_ms = (time.perf_counter() - ocr_started) * 1000
 
     try:
-        final_parsed_data = ocr_result.get('parsed_data', {})
-
-        store_name = final_parsed_data.get("store", "Unknown Store")
-        total_amount = float(final_parsed_data.get("total") or 0.0) # Convert total to float, defaulting to 0.0 if None
-        items_data = final_parsed_data.get("items", [])
-
-        # Attempt to parse date, default to today if missing or invalid
-        date_str = final_parsed_data.get("date")
-        receipt_date = datetime.now().date()
-        if date_str:
-            try:
-                # Assuming date is returned in a standard format, e.g., YYYY-MM-DD
-                receipt_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            except ValueError:
-                # Attempt to extract date from raw_text or log error if needed
-                pass 
-        
-        new_receipt = Receipt(
-            user_id=current_user.id,
-            store_name=store_name,
-            total_amount=total_amount,
-            receipt_date=receipt_date,
+        db_started = time.perf_counter()
+        with QueryCounter(db) as counter:
+            receipt_id = save_parsed_receipt(
+                db, current_user.id, ocr_result.get('parsed_data', {}),
+                content_hash=content_hash, perceptual_hash=perceptual_hash,
+            )
+        db_ms = (time.perf_counter() - db_started) * 1000
+
+        response.headers["Server-Timing"] = (
+            f'ocr;dur={ocr_ms:.1f}, db;dur={db_ms:.1f};desc="{counter.count} round-trips"'
         )
-        
-        db.add(new_receipt)
-        db.flush() 
-        for item in items_data:
-            try:
-                # Safely convert strings from OCR data to floats
-                total_price_float = float(item.get("total_price", 0.0))
-                
-                # Unit price may not exist, default to total price or 0.0
-                unit_price_str = item.get("unit_price")
-                if unit_price_str:
-                     price_float = float(unit_price_str)
-                else:
-                     price_float = total_price_float # If unit price is missing, assume it's the same as total
-                
-                # Quantity defaults to 1.0
-                quantity_float = float(item.get("quantity", 1.0))
-                
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Failed to convert price/quantity for item {item.get('name')}: {e}")
-                total_price_float = 0.0
-                price_float = 0.0
-                quantity_float = 1.0
-                
-            new_item = ReceiptItem(
-                receipt_id=new_receipt.id,
-                name=item.get("name", "Unknown Item"),
-                quantity=quantity_float,
-                price=price_float, 
-                total_price=total_price_float,
+        reconcile_new(db, current_user.id, receipt_ids=[receipt_id])
+        result = {"message": "Receipt parsed and saved successfully!", "receipt_id": receipt_id}
+        if similar_ids:
+            result["possible_duplicates"] = similar_ids
+        return result
+
+    except IntegrityError as e:
+        # A concurrent upload of the same image won the unique (user_id, content_hash) index
+        db.rollback()
+        existing_id = find_duplicate_receipt(db, current_user.id, content_hash)
+        if existing_id is None:
+            print(f"FATAL ERROR saving parsed receipt data: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error saving data: {e}"
             )
-            db.add(new_item)
-            
-        db.commit()
-        db.refresh(new_receipt)
-        
-        return {"message": "Receipt parsed and saved successfully!", "receipt_id": new_receipt.id}
+        response.status_code = status.HTTP_200_OK
+        return {"message": "Receipt was already uploaded.", "receipt_id": existing_id, "duplicate": True}
         
     except Exception as e:
         db.rollback()
@@ -128,4 +242,157 @@ async def upload_receipt(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=f"Error saving data: {e}"
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/receipts", response_model=ReceiptPage)
+async def list_receipts(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    limit: int = Query(20, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of next_cursor from the previous page"),
+    store: Optional[str] = Query(None, description="Exact store name"),
+    date_from: Optional[date] = Query(None, description="First receipt date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Last receipt date (inclusive)"),
+    view: Literal["full", "summary"] = Query("full", description="'summary' omits receipt items"),
+):
+    """
+    Page through the user's receipts, newest first.
+
+    Uses keyset pagination on (receipt_date, id); receipts without a date
+    come last. In the full view, items for the whole page are loaded with
+    one batched query.
+    """
+    if view == "summary":
+        query = select(Receipt.id, Receipt.store_name, Receipt.receipt_date, Receipt.total_amount)
+    else:
+        query = select(Receipt).options(selectinload(Receipt.items))
+
+    sort_key = date_sort_key(Receipt.receipt_date)
+    query = query.where(Receipt.user_id == current_user.id)
+    if store:
+        query = query.where(Receipt.store_name == store)
+    if date_from:
+        query = query.where(sort_key >= datetime.combine(date_from, day_time.min))
+    if date_to:
+        query = query.where(sort_key <= datetime.combine(date_to, day_time.max), Receipt.receipt_date.is_not(None))
+    if cursor:
+        query = query.where(before_cursor(sort_key, Receipt.id, cursor))
+
+    query = query.order_by(sort_key.desc(), Receipt.id.desc()).limit(limit + 1)
+    result = db.execute(query)
+    rows = result.all() if view == "summary" else result.scalars().all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].receipt_date, rows[-1].id) if has_more else None
+
+    return ReceiptPage(
+        items=[ReceiptResponse.model_validate(row) for row in rows],
+        count=len(rows),
+        has_more=has_more,
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/products/search", response_model=List[ProductMatch])
+async def search_purchased_products(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    q: str = Query(..., min_length=1, max_length=255, description="Product name, OCR spelling tolerated"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Fuzzy search over the products on the user's receipts, ranked by
+    trigram word similarity.
+    """
+    return search_products(db, current_user.id, q, limit)
+
+
+@router.get("/products/price-history", response_model=List[PricePoint])
+async def get_product_price_history(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    name: str = Query(..., min_length=1, max_length=255, description="Product name as returned by /products/search"),
+    date_from: Optional[date] = Query(None, description="First receipt date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Last receipt date (inclusive)"),
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """
+    Price time series of one product: every purchase, oldest first.
+    """
+    return price_history(db, current_user.id, name, date_from, date_to, limit)
+
+
+@router.get("/reconciliation", response_model=List[ReceiptTransactionLinkResponse])
+async def list_reconciliation_links(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    min_confidence: float = Query(0.0, ge=0.0, le=1.0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Receipts matched to the bank transactions that paid for them, newest first.
+    """
+    return db.execute(
+        select(ReceiptTransactionLink)
+        .where(ReceiptTransactionLink.user_id == current_user.id,
+               ReceiptTransactionLink.confidence >= min_confidence)
+        .order_by(ReceiptTransactionLink.id.desc())
+        .limit(limit)
+    ).scalars().all()
+
+
+@router.post("/reconciliation", status_code=status.HTTP_201_CREATED)
+async def run_reconciliation(
+    db: Annotated[Session, Depends(get_db)],
+    current_user: Annotated[User, Depends(get_current_user)],
+):
+    """
+    Match all of the user's still unlinked receipts against their transactions.
+    """
+    created = reconcile(db, current_user.id)
+    db.commit()
+    return {"created": created}
+
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _export_response(batches, columns: list, export_format: str, name: str) -> StreamingResponse:
+    render = exports.to_csv if export_format == "csv" else exports.to_ndjson
+    return StreamingResponse(
+        render(batches, columns),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'},
+    )
+
+
+@router.get("/export/transactions")
+async def export_transactions(
+    current_user: Annotated[User, Depends(get_current_user)],
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    date_from: Optional[date] = Query(None, description="First transaction date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Last transaction date (inclusive)"),
+):
+    """
+    Stream all of the user's transactions as CSV or NDJSON, oldest first.
+    Rows are read from a server-side cursor, so memory use is constant.
+    """
+    batches = exports.transaction_rows(current_user.id, date_from, date_to)
+    return _export_response(batches, exports.TRANSACTION_COLUMNS, export_format, "transactions")
+
+
+@router.get("/export/receipt-items")
+async def export_receipt_items(
+    current_user: Annotated[User, Depends(get_current_user)],
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    date_from: Optional[date] = Query(None, description="First receipt date (inclusive)"),
+    date_to: Optional[date] = Query(None, description="Last receipt date (inclusive)"),
+):
+    """
+    Stream every receipt line item of the user, with its receipt's date and
+    store, as CSV or NDJSON.
+    """
+    batches = exports.receipt_item_rows(current_user.id, date_from, date_to)
+    return _export_response(batches, exports.RECEIPT_ITEM_COLUMNS, export_format, "receipt_items")
@@ -1,20 +1,57 @@
 # app/api/health.py
 from fastapi import APIRouter, Depends, Query, HTTPException
-from datetime import datetime, timedelta
-from app.services.health import GoogleFitServices
+from datetime import date, datetime, time, timedelta
+from app.services.dashboard_cache import dashboard_cache
+from app.services.health_store import get_dashboard_data as get_stored_dashboard_data
+from app.config import get_settings
+from app.services.health_sync import covered_since, has_synced, schedule_sync_if_stale, sync_user
 from app.services.auth import get_current_user
 from app.models.user import User # <-- Important import
+from database.db_setup import SessionLocal
+
+settings = get_settings()
 
 router = APIRouter(prefix="/health")
 
 @router.get("/dashboard")
 async def get_dashboard_data(
-    days: int = Query(7, description="Number of days"),
+    days: int = Query(7, ge=1, le=settings.HEALTH_DASHBOARD_MAX_DAYS, description="Number of days"),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Dashboard data served from the local health store, cached per (user, days).
+    The first request of a user syncs from Google Fit; later ones refresh
+    stale data in the background. A range reaching further back than the
+    store first backfills the missing windows.
+    """
+    async def compute():
+        # Own session: concurrent requests may share this computation
+        db = SessionLocal()
+        try:
+            if not has_synced(db, current_user.id):
+                try:
+                    await sync_user(current_user.id)
+                except Exception:
+                    if not has_synced(db, current_user.id):
+                        raise
+                    # Partially synced: serve what was stored
+            else:
+                schedule_sync_if_stale(db, current_user.id)
+            start = datetime.combine(date.today() - timedelta(days=days - 1), time())
+            covered = covered_since(db, current_user.id)
+            if covered is None or covered > start:
+                try:
+                    await sync_user(current_user.id, since=start)
+                except Exception as e:
+                    # Serve what is stored, uncached, so the next request resumes the backfill
+                    print(f"Could not backfill health data for user {current_user.id}: {getattr(e, 'detail', e)}")
+                    await dashboard_cache.invalidate(current_user.id)
+            return get_stored_dashboard_data(db, current_user.id, days)
+        finally:
+            db.close()
+
     try:
-        service = GoogleFitServices(user_id=current_user.id)
-        data = service.get_dashboard_data(days)
+        data = await dashboard_cache.get_or_compute(current_user.id, days, compute)
         return {
             "daily_stats": data["daily_stats"],
             "charts": data["charts"]
@@ -23,4 +60,4 @@ async def get_dashboard_data(
         raise e
     except Exception as e:
         print(f"Unexpected error in /api/health/dashboard: {e}") # Log error
-        raise HTTPException(status_code=500, detail="An internal server error occurred while fetching data.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="An internal server error occurred while fetching data.")
@@ -12,6 +12,57 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_ID: str = os.getenv("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_SECRET: str = os.getenv("GOOGLE_CLIENT_SECRET")
     APP_BASE_URL: str = os.getenv("APP_BASE_URL", "http://localhost:8002")
+
+    # OCR worker uploads
+    OCR_WORKER_URL: str = os.getenv("OCR_WORKER_URL", "http://ocr_worker:5000/process")
+    OCR_MAX_UPLOAD_BYTES: int = int(os.getenv("OCR_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+    OCR_UPLOAD_CHUNK_BYTES: int = int(os.getenv("OCR_UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+    OCR_DOWNSCALE_MAX_SIDE: int = int(os.getenv("OCR_DOWNSCALE_MAX_SIDE", "0"))  # 0 disables re-encoding
+    OCR_REQUEST_TIMEOUT_SECONDS: float = float(os.getenv("OCR_REQUEST_TIMEOUT_SECONDS", "60"))
+    OCR_MAX_CONNECTIONS: int = int(os.getenv("OCR_MAX_CONNECTIONS", "10"))  # Shared pool to the OCR worker
+
+    # Receipt deduplication (perceptual matches are only reported, never merged)
+    RECEIPT_PERCEPTUAL_DEDUP: bool = os.getenv("RECEIPT_PERCEPTUAL_DEDUP", "false").lower() == "true"
+    RECEIPT_PHASH_MAX_DISTANCE: int = int(os.getenv("RECEIPT_PHASH_MAX_DISTANCE", "4"))  # Hamming bits out of 64
+
+    # Canonical product catalog
+    PRODUCT_ALIAS_CACHE_SIZE: int = int(os.getenv("PRODUCT_ALIAS_CACHE_SIZE", "10000"))
+    PRODUCT_ALIAS_MATCH_THRESHOLD: float = float(os.getenv("PRODUCT_ALIAS_MATCH_THRESHOLD", "0.6"))
+
+    # Receipt-to-transaction reconciliation
+    RECONCILE_AMOUNT_TOLERANCE: float = float(os.getenv("RECONCILE_AMOUNT_TOLERANCE", "0.01"))
+    RECONCILE_DATE_WINDOW_DAYS: int = int(os.getenv("RECONCILE_DATE_WINDOW_DAYS", "3"))
+
+    # Google Fit API client (shared connection pool)
+    GOOGLE_FIT_TIMEOUT_SECONDS: float = float(os.getenv("GOOGLE_FIT_TIMEOUT_SECONDS", "20"))
+    GOOGLE_FIT_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("GOOGLE_FIT_CONNECT_TIMEOUT_SECONDS", "5"))
+    GOOGLE_FIT_MAX_CONNECTIONS: int = int(os.getenv("GOOGLE_FIT_MAX_CONNECTIONS", "20"))
+    GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS: int = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))  # Proactive refresh
+
+    # Local health store synced from Google Fit
+    # First sync of a user: the dashboard backfills longer ranges when they are first viewed
+    HEALTH_SYNC_INITIAL_DAYS: int = int(os.getenv("HEALTH_SYNC_INITIAL_DAYS", "7"))
+    HEALTH_SYNC_LOOKBACK_HOURS: int = int(os.getenv("HEALTH_SYNC_LOOKBACK_HOURS", "24"))  # Late-uploaded data
+    HEALTH_SYNC_MAX_STALENESS_SECONDS: int = int(os.getenv("HEALTH_SYNC_MAX_STALENESS_SECONDS", "900"))
+    # Long ranges are fetched from Google Fit in windows of this many days, in parallel
+    HEALTH_FETCH_WINDOW_DAYS: int = int(os.getenv("HEALTH_FETCH_WINDOW_DAYS", "30"))
+    HEALTH_FETCH_CONCURRENCY: int = int(os.getenv("HEALTH_FETCH_CONCURRENCY", "4"))
+    HEALTH_DASHBOARD_MAX_DAYS: int = int(os.getenv("HEALTH_DASHBOARD_MAX_DAYS", "730"))
+    # Background sync of all active connections (0 disables the scheduler)
+    HEALTH_SYNC_INTERVAL_SECONDS: int = int(os.getenv("HEALTH_SYNC_INTERVAL_SECONDS", "900"))
+    HEALTH_SYNC_TICK_SECONDS: int = int(os.getenv("HEALTH_SYNC_TICK_SECONDS", "30"))
+    HEALTH_SYNC_CONCURRENCY: int = int(os.getenv("HEALTH_SYNC_CONCURRENCY", "4"))
+    HEALTH_SYNC_JITTER: float = float(os.getenv("HEALTH_SYNC_JITTER", "0.2"))  # +/- fraction of the interval
+    HEALTH_SYNC_MAX_BACKOFF_SECONDS: int = int(os.getenv("HEALTH_SYNC_MAX_BACKOFF_SECONDS", str(6 * 3600)))
+
+    # Dashboard response cache: "memory" (per process), "redis" (shared) or "none"
+    DASHBOARD_CACHE_BACKEND: str = os.getenv("DASHBOARD_CACHE_BACKEND", "memory")
+    DASHBOARD_CACHE_TTL_SECONDS: int = int(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "300"))
+    DASHBOARD_CACHE_MAX_ENTRIES: int = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "10000"))
+    DASHBOARD_CACHE_REDIS_URL: str = os.getenv("DASHBOARD_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+    # Materialised views for Grafana (0 disables the refresh task)
+    GRAFANA_VIEWS_REFRESH_SECONDS: int = int(os.getenv("GRAFANA_VIEWS_REFRESH_SECONDS", "300"))
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -7,6 +7,14 @@ from app.api.api_connections import router as api_connections_router
 from app.api.auth import router as auth_router
 from app.api.finance import router as finance_router  # New import
 from database.db_setup import engine, Base  # Modified import
+from database.grafana_views import create_views, refresh_views_periodically
+from database.migrations import run_migrations
+from app.services.health import close_http_client
+from app.services.ocr_client import close_http_client as close_ocr_client
+from app.services.google_tokens import token_manager
+from app.services.sync_scheduler import start_sync_scheduler
+from app.config import get_settings
+import asyncio
 import app.models  # New import (registers all models)
 import os
 
@@ -20,6 +28,10 @@ os.makedirs("static", exist_ok=True)
 # Create database tables
 # This one line will now create ALL tables (User, Health, ApiConnection, Transaction)
 app.models.Base.metadata.create_all(bind=engine)
+# create_all never alters existing tables: bring older databases up to date
+run_migrations(engine)
+# Pre-aggregated views queried by Grafana panels
+create_views(engine)
 
 app = FastAPI(title="Personal Health & Finance Dashboard",
               description="API to track health and financial data",
@@ -30,6 +42,26 @@ app.add_middleware(PrometheusMiddleware)
 app.add_route("/metrics", handle_metrics)
 # ------------------------------------------------
 
+@app.on_event("startup")
+async def start_background_tasks():
+    """
+    Start periodic background jobs
+    """
+    refresh_seconds = get_settings().GRAFANA_VIEWS_REFRESH_SECONDS
+    if refresh_seconds > 0:
+        app.state.grafana_views_task = asyncio.create_task(refresh_views_periodically(engine, refresh_seconds))
+    if get_settings().HEALTH_SYNC_INTERVAL_SECONDS > 0:
+        app.state.health_sync_task = start_sync_scheduler()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """
+    Close the shared Google Fit and OCR worker connection pools and stop token refreshes
+    """
+    token_manager.close()
+    await close_http_client()
+    await close_ocr_client()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
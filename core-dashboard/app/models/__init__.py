@@ -1,6 +1,9 @@
 from database.db_setup import Base
 
 from .user import User
-from .health import HeartRate, Sleep, Activity
+from .health import HeartRate, Sleep, Activity, BodyMeasurement, HealthSyncState, HealthSyncSchedule
 from .transaction import Transaction
-from .api_connections import ApiConnection
\ No newline at end of file
+from .api_connections import ApiConnection
+from .spending import SpendingRollup
+from .product import CanonicalProduct, ProductAlias
+from .reconciliation import ReceiptTransactionLink
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
+from datetime import datetime
 from database.db_setup import Base
 
 class HeartRate(Base):
     __tablename__ = 'heart_rate'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'timestamp', name='uq_heart_rate_user_timestamp'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     timestamp = Column(DateTime, nullable=False)
@@ -14,22 +18,67 @@ class HeartRate(Base):
 
 class Sleep(Base):
     __tablename__ = 'sleep'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'start_time', name='uq_sleep_user_start_time'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
-    sleep_value = Column(Integer, nullable=False)
+    sleep_value = Column(Integer, nullable=False)  # Google Fit activity type of the session (72 = sleep)
 
     user = relationship('User', back_populates='sleep')
 
 
 class Activity(Base):
     __tablename__ = 'activity'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'timestamp', 'activity_type', name='uq_activity_user_timestamp_type'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     timestamp = Column(DateTime, nullable=False)
-    activity_type = Column(String, nullable=False)
-    duration = Column(Float, nullable=False)
+    activity_type = Column(String, nullable=False)  # 'daily_summary' for synced Google Fit days
+    duration = Column(Float, nullable=False)  # Active minutes
     calories = Column(Integer, nullable=False)
+    steps = Column(Integer, nullable=True)
+    distance = Column(Float, nullable=True)  # Meters
 
     user = relationship('User', back_populates='activity')
+
+
+class BodyMeasurement(Base):
+    __tablename__ = 'body_measurements'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'measurement_type', 'timestamp', name='uq_body_measurement_user_type_timestamp'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    measurement_type = Column(String(20), nullable=False)  # 'weight' (kg) or 'height' (m)
+    timestamp = Column(DateTime, nullable=False)
+    value = Column(Float, nullable=False)
+
+
+class HealthSyncState(Base):
+    """
+    Per-user, per-data-type coverage of the Google Fit sync: everything
+    between `synced_from` and `synced_until` has been stored locally.
+    """
+    __tablename__ = 'health_sync_state'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    data_type = Column(String(20), primary_key=True)  # 'heart_rate', 'sleep', 'activity' or 'body'
+    synced_from = Column(DateTime, nullable=True)  # Unknown for rows from before backfills
+    synced_until = Column(DateTime, nullable=False)
+    points = Column(Integer, nullable=False, default=0)  # Points inserted or changed by all syncs so far
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class HealthSyncSchedule(Base):
+    """
+    When the background scheduler syncs a user next, shared by all workers
+    and kept across restarts. `failures` counts consecutive failed syncs.
+    """
+    __tablename__ = 'health_sync_schedule'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    next_sync_at = Column(DateTime, nullable=False)
+    failures = Column(Integer, nullable=False, default=0)
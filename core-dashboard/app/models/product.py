@@ -0,0 +1,32 @@
+# app/models/product.py
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from database.db_setup import Base
+from datetime import datetime
+
+
+class CanonicalProduct(Base):
+    """
+    One real-world product, whatever spelling OCR produced for it.
+    """
+    __tablename__ = 'canonical_products'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)  # Normalised name of the first alias seen
+    display_name = Column(String(255), nullable=False)  # Spelling as printed on the first receipt
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # Candidate lookup for aliases seen for the first time
+        Index("ix_canonical_products_name_trgm", "name",
+              postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
+
+
+class ProductAlias(Base):
+    """
+    Maps a normalised OCR item name to its canonical product.
+    """
+    __tablename__ = 'product_aliases'
+    alias = Column(String(255), primary_key=True)
+    product_id = Column(Integer, ForeignKey('canonical_products.id'), nullable=False, index=True)
+    score = Column(Float, nullable=False)  # Similarity to the product when the alias was created (1.0 for new products)
+    created_at = Column(DateTime, default=datetime.now)
@@ -1,9 +1,11 @@
 # core-dashboard/app/models/receipt.py
 
-from sqlalchemy import Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Integer, BigInteger, String, Float, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from database.db_setup import Base 
+from pydantic import BaseModel
 
 
 class Receipt(Base):
@@ -15,21 +17,95 @@ class Receipt(Base):
     store_name: Mapped[str | None] = mapped_column(String(100), index=True)
     receipt_date: Mapped[DateTime | None] = mapped_column(DateTime)
     total_amount: Mapped[float] = mapped_column(Float)
+
+    # Image fingerprints: exact re-uploads skip OCR, similar images are only flagged
+    content_hash: Mapped[str | None] = mapped_column(String(64))  # SHA-256 of the uploaded bytes
+    perceptual_hash: Mapped[int | None] = mapped_column(BigInteger)  # 64-bit dHash, signed
     
     items: Mapped[List["ReceiptItem"]] = relationship(back_populates="receipt", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ux_receipts_user_content_hash", "user_id", "content_hash", unique=True),
+        # Keyset pagination on (pagination.date_sort_key(receipt_date), id), optionally filtered by store
+        Index("ix_receipts_user_sort_date_id", "user_id",
+              text("coalesce(receipt_date, '-infinity'::timestamp)"), "id"),
+        Index("ix_receipts_user_store_sort_date_id", "user_id", "store_name",
+              text("coalesce(receipt_date, '-infinity'::timestamp)"), "id"),
+    )
+
 
 class ReceiptItem(Base):
     __tablename__ = "receipt_items"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    receipt_id: Mapped[int] = mapped_column(Integer, ForeignKey("receipts.id"))
+    receipt_id: Mapped[int] = mapped_column(Integer, ForeignKey("receipts.id"), index=True)
     
 
     name: Mapped[str] = mapped_column(String(255))
+    # merging_services.normalize_text(name), searched through the trigram index
+    normalized_name: Mapped[str | None] = mapped_column(String(255))
+    product_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("canonical_products.id"), index=True)
     quantity: Mapped[float] = mapped_column(Float, default=1.0)
     price: Mapped[float] = mapped_column(Float) 
     total_price: Mapped[float] = mapped_column(Float)
     
     receipt: Mapped["Receipt"] = relationship(back_populates="items")
-    
\ No newline at end of file
+
+    __table_args__ = (
+        # Fuzzy product search (similarity / word similarity operators)
+        Index("ix_receipt_items_normalized_name_trgm", "normalized_name",
+              postgresql_using="gin", postgresql_ops={"normalized_name": "gin_trgm_ops"}),
+        # Exact lookups for a product's price history
+        Index("ix_receipt_items_normalized_name", "normalized_name", "receipt_id"),
+    )
+
+
+# Pydantic schemas for responses
+class ReceiptItemResponse(BaseModel):
+    id: int
+    name: str
+    quantity: float
+    price: float
+    total_price: float
+
+    class Config:
+        from_attributes = True
+
+
+class ReceiptResponse(BaseModel):
+    id: int
+    store_name: Optional[str]
+    receipt_date: Optional[datetime]
+    total_amount: float
+    items: Optional[List[ReceiptItemResponse]] = None  # None in the "summary" view
+
+    class Config:
+        from_attributes = True
+
+
+class ProductMatch(BaseModel):
+    name: str  # Normalised name; pass it to the price-history endpoint
+    display_name: str  # Most frequent spelling on receipts
+    score: float
+    purchases: int
+    last_purchased: Optional[datetime]
+    min_price: float
+    max_price: float
+    avg_price: float
+
+
+class PricePoint(BaseModel):
+    receipt_id: int
+    receipt_date: Optional[datetime]
+    store_name: Optional[str]
+    name: str
+    quantity: float
+    price: float
+    total_price: float
+
+
+class ReceiptPage(BaseModel):
+    items: List[ReceiptResponse]
+    count: int
+    has_more: bool
+    next_cursor: Optional[str] = None
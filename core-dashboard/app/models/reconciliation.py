@@ -0,0 +1,38 @@
+# app/models/reconciliation.py
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index
+from database.db_setup import Base
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class ReceiptTransactionLink(Base):
+    """
+    A receipt matched to the bank transaction that paid for it. Each receipt
+    and each transaction is linked at most once.
+    """
+    __tablename__ = 'receipt_transaction_links'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    receipt_id = Column(Integer, ForeignKey('receipts.id', ondelete='CASCADE'), nullable=False, unique=True)
+    transaction_id = Column(Integer, ForeignKey('transaction.id', ondelete='CASCADE'), nullable=False, unique=True)
+    confidence = Column(Float, nullable=False)  # 0..1
+    amount_difference = Column(Float, nullable=False)
+    days_apart = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_receipt_transaction_links_user_id", "user_id", "id"),
+    )
+
+
+# Pydantic schema for response
+class ReceiptTransactionLinkResponse(BaseModel):
+    receipt_id: int
+    transaction_id: int
+    confidence: float
+    amount_difference: float
+    days_apart: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,32 @@
+# app/models/spending.py
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from database.db_setup import Base
+from datetime import date
+from pydantic import BaseModel
+
+
+class SpendingRollup(Base):
+    """
+    Pre-aggregated spending per user, period and store. Maintained
+    incrementally whenever transactions or receipts are written.
+    """
+    __tablename__ = 'spending_rollups'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    period = Column(String(10), primary_key=True)  # 'day', 'week' or 'month'
+    period_start = Column(Date, primary_key=True)
+    source = Column(String(20), primary_key=True)  # 'transaction' or 'receipt'
+    dimension = Column(String(100), primary_key=True, default='')  # Store name for receipts, '' otherwise
+    total = Column(Float, nullable=False, default=0.0)
+    entries = Column(Integer, nullable=False, default=0)
+
+
+# Pydantic schema for response
+class SpendingRollupResponse(BaseModel):
+    period_start: date
+    source: str
+    dimension: str
+    total: float
+    entries: int
+
+    class Config:
+        from_attributes = True
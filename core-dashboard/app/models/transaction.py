@@ -1,10 +1,10 @@
 # app/models/transaction.py
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, func, text
 from sqlalchemy.orm import relationship
 from database.db_setup import Base
 from datetime import datetime
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 
 class Transaction(Base):
@@ -14,10 +14,25 @@ class Transaction(Base):
     description = Column(String, nullable=True)
     date = Column(DateTime, default=datetime.now)
     user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    # Content fingerprint of rows created by statement imports (duplicate detection)
+    import_fingerprint = Column(String(40), nullable=True)
+    # Client-supplied key that makes replayed batch creates idempotent
+    idempotency_key = Column(String(64), nullable=True)
 
     # Relationship
     user = relationship("User", back_populates="transactions")
 
+    __table_args__ = (
+        # Date-range filters and exports on (date, id) per user
+        Index("ix_transaction_user_date_id", "user_id", "date", "id"),
+        # Keyset pagination on (pagination.date_sort_key(date), id)
+        Index("ix_transaction_user_sort_date_id", "user_id", text("coalesce(date, '-infinity'::timestamp)"), "id"),
+        Index("ux_transaction_user_import_fingerprint", "user_id", "import_fingerprint", unique=True),
+        Index("ux_transaction_user_idempotency_key", "user_id", "idempotency_key", unique=True),
+        # Receipt reconciliation: range join on the absolute amount, then date
+        Index("ix_transaction_user_abs_amount_date", "user_id", func.abs(amount), "date"),
+    )
+
 
 # Pydantic schema for input validation
 class TransactionCreate(BaseModel):
@@ -25,13 +40,41 @@ class TransactionCreate(BaseModel):
     description: Optional[str] = None
     date: Optional[datetime] = None
 
+class TransactionBatchItem(TransactionCreate):
+    idempotency_key: Optional[str] = Field(None, max_length=64)
+
+
+class TransactionBatchCreate(BaseModel):
+    transactions: List[TransactionBatchItem] = Field(..., min_length=1, max_length=500)
+
 # Pydantic schema for response
 class TransactionResponse(BaseModel):
     id: int
     amount: float
     description: Optional[str]
-    date: datetime
+    date: Optional[datetime]
     user_id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class TransactionPage(BaseModel):
+    items: List[TransactionResponse]
+    count: int
+    has_more: bool
+    next_cursor: Optional[str] = None
+
+
+class TransactionBatchResponse(BaseModel):
+    ids: List[int]  # In request order; replayed items return the id created originally
+    created: int
+    replayed: int
+
+
+class StatementImportResult(BaseModel):
+    parsed: int
+    imported: int
+    duplicates: int
+    rejected: int
+    errors: List[dict]
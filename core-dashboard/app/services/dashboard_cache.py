@@ -0,0 +1,175 @@
+# app/services/dashboard_cache.py
+"""
+Per-user cache of the health dashboard payload, keyed by (user_id, days).
+
+Entries live for DASHBOARD_CACHE_TTL_SECONDS. Concurrent misses for the same
+key share one computation. `invalidate(user_id)` bumps the user's
+generation, so entries computed before a sync or a connection change are
+never served again. That includes entries that were still being computed.
+
+Backends: "memory" (default, per process) or "redis" (shared between
+workers, needs the redis package and DASHBOARD_CACHE_REDIS_URL). "none"
+disables caching.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import get_settings
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for the shared backend
+    redis_asyncio = None
+
+settings = get_settings()
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU with per-entry expiry.
+
+    Generations are kept in an LRU of the same size as the entries. They are
+    drawn from one counter shared by all users, so a user whose generation
+    was evicted gets a number no earlier computation can hold, and its stale
+    results are still rejected.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # (user_id, generation, days) -> (expires_at, value)
+        self._generations: OrderedDict = OrderedDict()  # user_id -> generation
+        self._counter = itertools.count()
+
+    def _set_generation(self, user_id: int) -> int:
+        generation = self._generations[user_id] = next(self._counter)
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_entries:
+            self._generations.popitem(last=False)  # Its entries become unreachable and age out of the LRU
+        return generation
+
+    async def generation(self, user_id: int) -> int:
+        generation = self._generations.get(user_id)
+        if generation is None:
+            return self._set_generation(user_id)
+        self._generations.move_to_end(user_id)
+        return generation
+
+    async def get(self, user_id: int, generation: int, days: int) -> Optional[dict]:
+        key = (user_id, generation, days)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, user_id: int, generation: int, days: int, value: dict, ttl: float) -> None:
+        if self._generations.get(user_id) != generation:
+            return  # Invalidated while computing
+        key = (user_id, generation, days)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, user_id: int) -> None:
+        self._set_generation(user_id)
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+
+class RedisCacheBackend:
+    """Shared cache; old generations are never read again and expire on their own."""
+
+    def __init__(self, url: str, prefix: str = "dashboard"):
+        if redis_asyncio is None:
+            raise RuntimeError("DASHBOARD_CACHE_BACKEND=redis requires the redis package.")
+        self.client = redis_asyncio.from_url(url)
+        self.prefix = prefix
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}:generation"
+
+    def _key(self, user_id: int, generation: int, days: int) -> str:
+        return f"{self.prefix}:{user_id}:{generation}:{days}"
+
+    async def generation(self, user_id: int) -> int:
+        return int(await self.client.get(self._generation_key(user_id)) or 0)
+
+    async def get(self, user_id: int, generation: int, days: int) -> Optional[dict]:
+        value = await self.client.get(self._key(user_id, generation, days))
+        return json.loads(value) if value is not None else None
+
+    async def set(self, user_id: int, generation: int, days: int, value: dict, ttl: float) -> None:
+        await self.client.set(self._key(user_id, generation, days), json.dumps(value), ex=max(int(ttl), 1))
+
+    async def invalidate(self, user_id: int) -> None:
+        await self.client.incr(self._generation_key(user_id))
+
+
+class DashboardCache:
+    def __init__(self, backend, ttl_seconds: float):
+        self.backend = backend
+        self.ttl = ttl_seconds
+        self._in_flight: Dict[Tuple[int, int, int], asyncio.Task] = {}
+
+    async def get_or_compute(self, user_id: int, days: int, compute: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Return the cached payload, or compute it once for all concurrent
+        callers and cache it. Errors are not cached.
+        """
+        if self.backend is None:
+            return await compute()
+        try:
+            generation = await self.backend.generation(user_id)
+            cached = await self.backend.get(user_id, generation, days)
+        except Exception as e:
+            print(f"Dashboard cache unavailable, computing directly: {e}")
+            return await compute()
+        if cached is not None:
+            return cached
+
+        key = (user_id, generation, days)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute_and_store(user_id, generation, days, compute))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded: a cancelled request must not cancel a computation other callers wait on
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, user_id: int, generation: int, days: int,
+                                 compute: Callable[[], Awaitable[dict]]) -> dict:
+        value = await compute()
+        try:
+            await self.backend.set(user_id, generation, days, value, self.ttl)
+        except Exception as e:
+            print(f"Could not store dashboard cache entry: {e}")
+        return value
+
+    async def invalidate(self, user_id: int) -> None:
+        """Drop every cached payload of the user (new data synced, connection changed)."""
+        if self.backend is None:
+            return
+        try:
+            await self.backend.invalidate(user_id)
+        except Exception as e:
+            print(f"Could not invalidate dashboard cache for user {user_id}: {e}")
+
+
+def _create_backend():
+    backend = settings.DASHBOARD_CACHE_BACKEND.lower()
+    if backend == "none" or settings.DASHBOARD_CACHE_TTL_SECONDS <= 0:
+        return None
+    if backend == "redis":
+        return RedisCacheBackend(settings.DASHBOARD_CACHE_REDIS_URL)
+    return MemoryCacheBackend(settings.DASHBOARD_CACHE_MAX_ENTRIES)
+
+
+dashboard_cache = DashboardCache(_create_backend(), settings.DASHBOARD_CACHE_TTL_SECONDS)
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time
+from typing import Iterator, Optional
+from sqlalchemy import select
+
+from app.models.receipt import Receipt, ReceiptItem
+from app.models.transaction import Transaction
+from database.db_setup import SessionLocal
+
+EXPORT_BATCH_ROWS = 1000
+
+TRANSACTION_COLUMNS = ["id", "date", "amount", "description"]
+RECEIPT_ITEM_COLUMNS = ["receipt_id", "receipt_date", "store_name", "item_id", "name", "quantity", "price", "total_price"]
+
+
+def _date_range(column, date_from: Optional[date], date_to: Optional[date]) -> list:
+    conditions = []
+    if date_from:
+        conditions.append(column >= datetime.combine(date_from, time.min))
+    if date_to:
+        conditions.append(column <= datetime.combine(date_to, time.max))
+    return conditions
+
+
+def _stream_rows(query) -> Iterator[list]:
+    """
+    Yield result rows in batches from a server-side cursor.
+
+    Uses its own session because the response body is produced after the
+    request's dependencies have been torn down.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def transaction_rows(user_id: int, date_from: Optional[date] = None, date_to: Optional[date] = None) -> Iterator[list]:
+    query = (
+        select(Transaction.id, Transaction.date, Transaction.amount, Transaction.description)
+        .where(Transaction.user_id == user_id, *_date_range(Transaction.date, date_from, date_to))
+        .order_by(Transaction.date, Transaction.id)
+    )
+    return _stream_rows(query)
+
+
+def receipt_item_rows(user_id: int, date_from: Optional[date] = None, date_to: Optional[date] = None) -> Iterator[list]:
+    query = (
+        select(Receipt.id, Receipt.receipt_date, Receipt.store_name,
+               ReceiptItem.id, ReceiptItem.name, ReceiptItem.quantity, ReceiptItem.price, ReceiptItem.total_price)
+        .join(ReceiptItem, ReceiptItem.receipt_id == Receipt.id)
+        .where(Receipt.user_id == user_id, *_date_range(Receipt.receipt_date, date_from, date_to))
+        .order_by(Receipt.receipt_date, Receipt.id, ReceiptItem.id)
+    )
+    return _stream_rows(query)
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def to_csv(batches: Iterator[list], columns: list) -> Iterator[str]:
+    """Render row batches as CSV, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(batches: Iterator[list], columns: list) -> Iterator[str]:
+    """Render row batches as newline-delimited JSON, one chunk per batch."""
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, (_plain(value) for value in row)))) + "\n"
+            for row in batch
+        )
@@ -0,0 +1,248 @@
+import hashlib
+import numpy as np
+from datetime import datetime, date
+from typing import List, Optional, Tuple
+from fastapi import UploadFile
+from sqlalchemy import cast, func, insert, select
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.config import get_settings
+from app.models.receipt import Receipt, ReceiptItem
+from app.models.transaction import Transaction, TransactionBatchItem
+from app.services.merging_services import normalize_text
+from app.services.product_catalog import assign_products
+from app.services.spending_rollups import apply_to_rollups
+
+try:
+    from PIL import Image
+except ImportError:  # Perceptual hashing is optional
+    Image = None
+
+settings = get_settings()
+
+HASH_CHUNK_BYTES = 64 * 1024
+ITEM_NAME_MAX_LENGTH = 255
+
+
+async def compute_content_hash(file: UploadFile) -> str:
+    """
+    SHA-256 of the uploaded bytes, read in chunks. Rewinds the file afterwards.
+    """
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while chunk := await file.read(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+def _dhash(file: UploadFile) -> int:
+    """
+    64-bit difference hash of the image, returned as a signed integer so it
+    fits a Postgres BIGINT. Resistant to re-compression and small rescaling.
+    """
+    file.file.seek(0)
+    image = Image.open(file.file)
+    image.draft("L", (64, 64))
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    file.file.seek(0)
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+async def compute_perceptual_hash(file: UploadFile) -> Optional[int]:
+    """
+    Perceptual hash of the upload, or None when disabled or not decodable.
+    """
+    if not settings.RECEIPT_PERCEPTUAL_DEDUP or Image is None:
+        return None
+    try:
+        return await run_in_threadpool(_dhash, file)
+    except Exception as e:
+        print(f"WARNING: Could not compute perceptual hash for '{file.filename}': {e}")
+        await file.seek(0)
+        return None
+
+
+def find_duplicate_receipt(db: Session, user_id: int, content_hash: str) -> Optional[int]:
+    """
+    Return the id of an existing receipt of this user with the same content
+    hash, i.e. the very same file uploaded again.
+    """
+    return db.execute(
+        select(Receipt.id).where(Receipt.user_id == user_id, Receipt.content_hash == content_hash)
+    ).scalar()
+
+
+def find_similar_receipts(db: Session, user_id: int, perceptual_hash: Optional[int],
+                          limit: int = 5) -> List[int]:
+    """
+    Ids of the user's receipts whose perceptual hash is within
+    RECEIPT_PHASH_MAX_DISTANCE bits. Advisory only: mostly-white receipts
+    from the same store hash alike, so a match is not proof of a duplicate.
+    Scans the user's hashed receipts (no index serves Hamming distance).
+    """
+    if perceptual_hash is None:
+        return []
+    max_distance = settings.RECEIPT_PHASH_MAX_DISTANCE
+    if max_distance <= 0:
+        condition = Receipt.perceptual_hash == perceptual_hash
+    else:
+        distance = func.bit_count(cast(Receipt.perceptual_hash.op("#")(perceptual_hash), BIT(64)))
+        condition = distance <= max_distance
+    return list(db.execute(
+        select(Receipt.id)
+        .where(Receipt.user_id == user_id, Receipt.perceptual_hash.is_not(None), condition)
+        .order_by(Receipt.id.desc())
+        .limit(limit)
+    ).scalars())
+
+
+def _to_float_array(values: list) -> np.ndarray:
+    """
+    Convert OCR strings to a float array in one pass. Entries that cannot be
+    parsed become NaN instead of failing the whole batch.
+    """
+    try:
+        return np.asarray(values, dtype=object).astype(float)
+    except (ValueError, TypeError):
+        def _convert(value):
+            try:
+                return float(value)
+            except (ValueError, TypeError):
+                return np.nan
+        return np.fromiter((_convert(v) for v in values), dtype=float, count=len(values))
+
+
+def convert_receipt_items(items_data: list) -> list:
+    """
+    Validate and convert parsed OCR items into rows for `receipt_items`.
+
+    Missing quantities default to 1, missing unit prices to the line total.
+    Lines whose numbers cannot be parsed are kept with price 0 and quantity 1.
+    """
+    if not items_data:
+        return []
+
+    names = [str(item.get("name") or "Unknown Item")[:ITEM_NAME_MAX_LENGTH] for item in items_data]
+    totals = _to_float_array([item.get("total_price", 0.0) for item in items_data])
+    quantities = _to_float_array([item.get("quantity", 1.0) for item in items_data])
+    has_unit_price = np.array([bool(item.get("unit_price")) for item in items_data])
+    unit_prices = _to_float_array([item.get("unit_price") if item.get("unit_price") else 0.0 for item in items_data])
+    unit_prices = np.where(has_unit_price, unit_prices, totals)
+
+    invalid = ~(np.isfinite(totals) & np.isfinite(quantities) & np.isfinite(unit_prices))
+    if invalid.any():
+        for index in np.flatnonzero(invalid):
+            print(f"Warning: Failed to convert price/quantity for item {names[index]}")
+        totals = np.where(invalid, 0.0, totals)
+        unit_prices = np.where(invalid, 0.0, unit_prices)
+        quantities = np.where(invalid, 1.0, quantities)
+
+    return [
+        {"name": name, "normalized_name": normalize_text(name), "quantity": quantity, "price": price, "total_price": total}
+        for name, quantity, price, total in zip(names, quantities.tolist(), unit_prices.tolist(), totals.tolist())
+    ]
+
+
+def _parse_receipt_date(date_str: Optional[str]) -> date:
+    """OCR dates are YYYY-MM-DD; anything else falls back to today."""
+    if date_str:
+        try:
+            return datetime.strptime(date_str, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    return datetime.now().date()
+
+
+def save_parsed_receipt(db: Session, user_id: int, parsed_data: dict,
+                        content_hash: Optional[str] = None, perceptual_hash: Optional[int] = None) -> int:
+    """
+    Persist a parsed receipt and all of its items, returning the receipt id.
+
+    Items are converted up front and written with a single multi-row
+    INSERT ... RETURNING, so the cost is a fixed four round-trips (receipt,
+    items, spending rollup, commit) regardless of the number of lines, plus
+    up to four more when some item names are not in the product alias cache.
+    The caller handles rollback.
+    """
+    item_rows = convert_receipt_items(parsed_data.get("items") or [])
+
+    store_name = parsed_data.get("store") or "Unknown Store"
+    total_amount = float(parsed_data.get("total") or 0.0)
+    receipt_date = _parse_receipt_date(parsed_data.get("date"))
+
+    receipt_id = db.execute(
+        insert(Receipt).values(
+            user_id=user_id,
+            store_name=store_name,
+            total_amount=total_amount,
+            receipt_date=receipt_date,
+            content_hash=content_hash,
+            perceptual_hash=perceptual_hash,
+        ).returning(Receipt.id)
+    ).scalar_one()
+
+    if item_rows:
+        assign_products(db, item_rows)
+        for row in item_rows:
+            row["receipt_id"] = receipt_id
+        db.execute(insert(ReceiptItem).returning(ReceiptItem.id), item_rows)
+
+    apply_to_rollups(db, user_id, [(receipt_date, "receipt", store_name, total_amount)])
+    db.commit()
+    return receipt_id
+
+
+def create_transactions_batch(db: Session, user_id: int, items: List[TransactionBatchItem]) -> Tuple[List[int], int]:
+    """
+    Insert a batch of transactions in one multi-row INSERT and one commit.
+
+    Items whose idempotency key already exists for the user (or appeared
+    earlier in the same batch) are not inserted again; they resolve to the
+    original id. Returns the ids in request order and the number created.
+    """
+    keys = {item.idempotency_key for item in items if item.idempotency_key}
+    ids_by_key = {}
+    if keys:
+        ids_by_key = dict(db.execute(
+            select(Transaction.idempotency_key, Transaction.id)
+            .where(Transaction.user_id == user_id, Transaction.idempotency_key.in_(keys))
+        ).all())
+
+    rows = []
+    pending_keys = set()
+    for item in items:
+        key = item.idempotency_key
+        if key and (key in ids_by_key or key in pending_keys):
+            continue
+        if key:
+            pending_keys.add(key)
+        rows.append({
+            "user_id": user_id,
+            "amount": item.amount,
+            "description": item.description,
+            "date": item.date or datetime.now(),
+            "idempotency_key": key,
+        })
+
+    new_ids = []
+    if rows:
+        new_ids = db.execute(
+            insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for row, new_id in zip(rows, new_ids):
+            if row["idempotency_key"]:
+                ids_by_key[row["idempotency_key"]] = new_id
+        apply_to_rollups(db, user_id, [(row["date"], "transaction", "", row["amount"]) for row in rows])
+    db.commit()
+
+    unkeyed_ids = iter([new_id for row, new_id in zip(rows, new_ids) if not row["idempotency_key"]])
+    ids = [ids_by_key[item.idempotency_key] if item.idempotency_key else next(unkeyed_ids) for item in items]
+    return ids, len(new_ids)
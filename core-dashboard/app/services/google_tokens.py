@@ -0,0 +1,174 @@
+# app/services/google_tokens.py
+"""
+Access tokens of Google Fit connections.
+
+Valid tokens are cached in memory per connection, so requests do not touch
+the token endpoint or the database for them. Refreshes are single-flight:
+inside a process, one asyncio lock per connection; across workers, the
+connection row is locked with SELECT ... FOR UPDATE, and a worker that
+waited finds the token already refreshed instead of posting again. Tokens
+in use are refreshed in the background GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS
+before they expire.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from app.config import get_settings
+from app.models.api_connections import ApiConnection
+from database.db_setup import SessionLocal
+
+settings = get_settings()
+
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+MIN_VALID_SECONDS = 60  # Tokens closer to expiry are refreshed before use
+
+
+class TokenManager:
+    def __init__(self, refresh_margin_seconds: float, timeout_seconds: float):
+        self.refresh_margin = refresh_margin_seconds
+        self.timeout = timeout_seconds
+        self._tokens: Dict[int, Tuple[str, Optional[datetime]]] = {}  # connection id -> (token, expires at)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._used_since_refresh: Dict[int, bool] = {}
+        self._proactive: Dict[int, asyncio.Task] = {}
+
+    @staticmethod
+    def _valid(expires_at: Optional[datetime], seconds: float) -> bool:
+        # Unknown expiry: trust the token until Google rejects it
+        return expires_at is None or expires_at > datetime.now() + timedelta(seconds=seconds)
+
+    async def get_token(self, connection: ApiConnection) -> Optional[str]:
+        """
+        A usable access token for the connection: from the cache, else from
+        the loaded row, refreshing first if it is about to expire.
+        """
+        cached = self._tokens.get(connection.id)
+        if cached is None and connection.access_token:
+            cached = self._remember(connection.id, connection.access_token, connection.token_expires_at)
+        self._used_since_refresh[connection.id] = True
+        if cached and self._valid(cached[1], MIN_VALID_SECONDS):
+            return cached[0]
+        return await self.refresh(connection.id, min_valid_seconds=MIN_VALID_SECONDS)
+
+    async def refresh(self, connection_id: int, expired_token: Optional[str] = None,
+                      min_valid_seconds: float = MIN_VALID_SECONDS) -> Optional[str]:
+        """
+        Refresh the connection's token unless someone else already did: a
+        token other than `expired_token` (the one Google rejected) that is
+        valid for `min_valid_seconds` is returned as is. Returns None when
+        the connection cannot be refreshed (it is deactivated on a rejected
+        refresh token).
+        """
+        lock = self._locks.setdefault(connection_id, asyncio.Lock())
+        async with lock:
+            cached = self._tokens.get(connection_id)
+            if cached and cached[0] != expired_token and self._valid(cached[1], min_valid_seconds):
+                return cached[0]
+            # Row lock, token request and update run together in a worker thread
+            refreshed = await asyncio.to_thread(self._refresh_locked, connection_id, expired_token, min_valid_seconds)
+            if refreshed is None:
+                self.forget(connection_id)
+                return None
+            return self._remember(connection_id, *refreshed)[0]
+
+    def _refresh_locked(self, connection_id: int, expired_token: Optional[str],
+                        min_valid_seconds: float) -> Optional[Tuple[str, Optional[datetime]]]:
+        db = SessionLocal()
+        try:
+            connection = db.query(ApiConnection).filter(ApiConnection.id == connection_id).with_for_update().first()
+            if not connection or not connection.is_active or not connection.refresh_token:
+                db.rollback()
+                return None
+            if connection.access_token and connection.access_token != expired_token and \
+                    connection.token_expires_at and self._valid(connection.token_expires_at, min_valid_seconds):
+                db.rollback()
+                return connection.access_token, connection.token_expires_at  # Refreshed by another worker
+
+            print(f"Refreshing Google Fit token of connection {connection_id}...")
+            payload = {
+                "client_id": settings.GOOGLE_CLIENT_ID,
+                "client_secret": settings.GOOGLE_CLIENT_SECRET,
+                "refresh_token": connection.refresh_token,
+                "grant_type": "refresh_token",
+            }
+            try:
+                response = httpx.post(TOKEN_URL, data=payload, timeout=self.timeout)
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                print(f"Error while refreshing Google Fit token: {e}")
+                if e.response.status_code in [400, 401]:
+                    print("Deactivating Google Fit connection due to refresh error.")
+                    connection.is_active = False
+                    connection.access_token = None
+                    connection.refresh_token = None
+                    connection.token_expires_at = None
+                    db.commit()
+                else:
+                    db.rollback()
+                return None
+            except httpx.HTTPError as e:
+                print(f"Error while refreshing Google Fit token: {e}")
+                db.rollback()
+                return None
+
+            token_data = response.json()
+            connection.access_token = token_data["access_token"]
+            if "refresh_token" in token_data:
+                connection.refresh_token = token_data["refresh_token"]
+            connection.token_expires_at = datetime.now() + timedelta(seconds=token_data.get("expires_in", 3600))
+            connection.updated_at = datetime.now()
+            db.commit()
+            print("Google Fit token refreshed successfully.")
+            return connection.access_token, connection.token_expires_at
+        except Exception as e:
+            db.rollback()
+            print(f"Unexpected error while refreshing token: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _remember(self, connection_id: int, token: str, expires_at: Optional[datetime]):
+        self._tokens[connection_id] = (token, expires_at)
+        self._used_since_refresh[connection_id] = False
+        self._schedule_proactive(connection_id, expires_at)
+        return self._tokens[connection_id]
+
+    def _schedule_proactive(self, connection_id: int, expires_at: Optional[datetime]) -> None:
+        previous = self._proactive.pop(connection_id, None)
+        if previous is not None and previous is not asyncio.current_task():
+            previous.cancel()
+        if expires_at is None:
+            return
+        delay = (expires_at - datetime.now()).total_seconds() - self.refresh_margin
+        try:
+            self._proactive[connection_id] = asyncio.get_running_loop().create_task(
+                self._refresh_later(connection_id, max(delay, 0)))
+        except RuntimeError:  # No running loop (CLI); refresh on demand instead
+            pass
+
+    async def _refresh_later(self, connection_id: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        if not self._used_since_refresh.get(connection_id):
+            # Unused since the last refresh: let it expire, the next use refreshes on demand
+            self._proactive.pop(connection_id, None)
+            return
+        await self.refresh(connection_id, min_valid_seconds=self.refresh_margin + MIN_VALID_SECONDS)
+
+    def forget(self, connection_id: int) -> None:
+        """Drop the cached token (connection re-authorised, deleted or deactivated)."""
+        self._tokens.pop(connection_id, None)
+        self._used_since_refresh.pop(connection_id, None)
+        task = self._proactive.pop(connection_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def close(self) -> None:
+        """Cancel the background refreshes (application shutdown)."""
+        for connection_id in list(self._proactive):
+            self.forget(connection_id)
+
+
+token_manager = TokenManager(settings.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS, settings.GOOGLE_FIT_TIMEOUT_SECONDS)
@@ -0,0 +1,162 @@
+# app/services/group_ledger.py
+"""
+Cross-list debt netting for groups of participants.
+
+A group is the set of users taking part in a shopping list; every open list
+with the same participants feeds the same ledger. Each list's outstanding
+balances (costs minus settlements already paid) are stored as its
+contribution, and the group balances are the running sum of contributions.
+When a list changes only that list is recomputed and the difference applied,
+so reading a group's transfers costs O(participants) however many lists it has.
+"""
+import argparse
+import hashlib
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import ShoppingList, Settlement, User
+from app.services.settlement_engine import compute_balances, net_transfers
+from app.services.list_balances import load_product_shares
+from app.services.settlements_services import check_and_update_list_settlement_status
+
+
+class GroupLedgerContribution(db.Model):
+    """Outstanding balance of one entity on one open list."""
+    __tablename__ = 'group_ledger_contributions'
+    shopping_list_id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(10), primary_key=True)  # 'user' or 'friend'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    group_key = db.Column(db.String(40), nullable=False, index=True)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+
+
+class GroupBalance(db.Model):
+    """Net balance of one entity across all open lists of a group."""
+    __tablename__ = 'group_balances'
+    group_key = db.Column(db.String(40), primary_key=True)
+    entity_type = db.Column(db.String(10), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=Decimal('0.00'))
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+def group_key_for(user_ids):
+    """Stable key of the group formed by these users."""
+    members = ",".join(str(user_id) for user_id in sorted(set(user_ids)))
+    return hashlib.sha1(members.encode()).hexdigest()
+
+
+def _outstanding_balances(shopping_list_id, participant_ids):
+    """List balances minus the settlements of the list that were already paid."""
+    balances = compute_balances(load_product_shares(shopping_list_id), participant_ids)
+    settled = Settlement.query.filter_by(shopping_list_id=shopping_list_id, is_settled=True).all()
+    for settlement in settled:
+        debtor = ('user', settlement.debtor_user_id) if settlement.debtor_user_id else ('friend', settlement.debtor_friend_id)
+        creditor = ('user', settlement.creditor_user_id) if settlement.creditor_user_id else ('friend', settlement.creditor_friend_id)
+        balances[debtor] = balances.get(debtor, Decimal('0.00')) + settlement.amount
+        balances[creditor] = balances.get(creditor, Decimal('0.00')) - settlement.amount
+    return {entity: amount for entity, amount in balances.items() if amount != Decimal('0.00')}
+
+
+def refresh_list(shopping_list_id, commit=True):
+    """
+    Recompute one list's contribution and apply the difference to its group
+    (and to its former group if its participants changed). Fully settled or
+    deleted lists contribute nothing.
+    """
+    shopping_list = ShoppingList.query.get(shopping_list_id)
+    new_rows = {}
+    if shopping_list and not shopping_list.is_fully_settled:
+        participant_ids = [user_id for (user_id,) in shopping_list.participants.with_entities(User.id).all()]
+        group_key = group_key_for(participant_ids)
+        new_rows = {(group_key,) + entity: amount
+                    for entity, amount in _outstanding_balances(shopping_list_id, participant_ids).items()}
+
+    old_contributions = GroupLedgerContribution.query.filter_by(shopping_list_id=shopping_list_id).all()
+    deltas = dict(new_rows)
+    for contribution in old_contributions:
+        key = (contribution.group_key, contribution.entity_type, contribution.entity_id)
+        deltas[key] = deltas.get(key, Decimal('0.00')) - contribution.amount
+        db.session.delete(contribution)
+    db.session.flush()
+    db.session.add_all(
+        GroupLedgerContribution(shopping_list_id=shopping_list_id, group_key=group_key, entity_type=entity_type,
+                                entity_id=entity_id, amount=amount)
+        for (group_key, entity_type, entity_id), amount in new_rows.items()
+    )
+    _apply_deltas({key: delta for key, delta in deltas.items() if delta != Decimal('0.00')})
+    if commit:
+        db.session.commit()
+
+
+def _apply_deltas(deltas):
+    """
+    Add the deltas to the group balances in SQL (balance = balance + delta),
+    so concurrent refreshes of lists in one group never overwrite each
+    other. Rows are written in key order to keep lock order consistent.
+    """
+    if not deltas:
+        return
+    table = GroupBalance.__table__
+    statement = pg_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.group_key, table.c.entity_type, table.c.entity_id],
+        set_={"balance": table.c.balance + statement.excluded.balance, "updated_at": statement.excluded.updated_at},
+    )
+    now = datetime.now()
+    db.session.execute(statement, [
+        {"group_key": group_key, "entity_type": entity_type, "entity_id": entity_id, "balance": delta,
+         "updated_at": now}
+        for (group_key, entity_type, entity_id), delta in sorted(deltas.items())
+    ])
+
+
+# Hooks for routes that change products or settlements
+
+def on_products_changed(shopping_list_id):
+    """Call after adding, editing or deleting products or friend assignments of a list."""
+    refresh_list(shopping_list_id)
+
+
+def on_settlement_changed(shopping_list_id):
+    """Call after a settlement of the list is marked (un)settled."""
+    check_and_update_list_settlement_status(shopping_list_id)
+    refresh_list(shopping_list_id)
+
+
+def group_balances(user_ids):
+    """Net balance per entity across the group's open lists."""
+    rows = GroupBalance.query.filter(GroupBalance.group_key == group_key_for(user_ids),
+                                     GroupBalance.balance != 0).all()
+    return {(row.entity_type, row.entity_id): row.balance for row in rows}
+
+
+def group_transfers(user_ids):
+    """Transfers settling everything the group owes across all of its open lists."""
+    return net_transfers(group_balances(user_ids))
+
+
+def rebuild_group_ledger():
+    """Recompute every contribution and balance from scratch."""
+    GroupLedgerContribution.query.delete()
+    GroupBalance.query.delete()
+    open_list_ids = [list_id for (list_id,) in
+                     ShoppingList.query.filter_by(is_fully_settled=False).with_entities(ShoppingList.id).all()]
+    for shopping_list_id in open_list_ids:
+        refresh_list(shopping_list_id, commit=False)
+    db.session.commit()
+    return len(open_list_ids)
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from database.migrations import SETTLEMENT_MIGRATIONS, run_migrations
+
+    parser = argparse.ArgumentParser(description="Rebuild the cross-list group ledger.")
+    parser.parse_args()
+    with create_app().app_context():
+        run_migrations(db.engine, SETTLEMENT_MIGRATIONS)
+        print(f"Rebuilt group ledger from {rebuild_group_ledger()} open lists.")
@@ -0,0 +1,108 @@
+# app/services/health_store.py
+"""
+Dashboard data read from the local health tables filled by health_sync.
+
+Returns the dashboard's `daily_stats`/`charts` payload from a handful of
+indexed queries instead of live Google Fit calls.
+"""
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, cast, func
+from sqlalchemy.orm import Session
+
+from app.models.health import Activity, BodyMeasurement, HeartRate, Sleep
+from app.services.health_sync import DAILY_SUMMARY
+
+BODY_LOOKBACK_DAYS = 90
+
+
+def _labels(days: int):
+    end_date = date.today()
+    dates = [end_date - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    return dates, [day.strftime("%d-%m") for day in dates]
+
+
+def get_dashboard_data(db: Session, user_id: int, days: int) -> dict:
+    """Build the dashboard payload for the last `days` days from the local store."""
+    dates, labels = _labels(days)
+    start = datetime.combine(dates[0], time())
+
+    activity_by_day = {
+        row.timestamp.date(): row for row in db.query(Activity.timestamp, Activity.steps, Activity.distance).filter(
+            Activity.user_id == user_id, Activity.activity_type == DAILY_SUMMARY, Activity.timestamp >= start)
+    }
+
+    day = cast(HeartRate.timestamp, Date)
+    heart_rate_by_day = {
+        row.day: row for row in db.query(
+            day.label("day"), func.avg(HeartRate.bpm_value).label("avg"),
+            func.max(HeartRate.bpm_value).label("max"), func.min(HeartRate.bpm_value).label("min"),
+        ).filter(HeartRate.user_id == user_id, HeartRate.timestamp >= start).group_by(day)
+    }
+
+    sleep_sessions = db.query(Sleep.start_time, Sleep.end_time).filter(
+        Sleep.user_id == user_id, Sleep.end_time >= start).all()
+
+    latest_body = dict(db.query(BodyMeasurement.measurement_type, BodyMeasurement.value).filter(
+        BodyMeasurement.user_id == user_id,
+        BodyMeasurement.timestamp >= datetime.now() - timedelta(days=BODY_LOOKBACK_DAYS),
+    ).distinct(BodyMeasurement.measurement_type).order_by(
+        BodyMeasurement.measurement_type, BodyMeasurement.timestamp.desc()).all())
+
+    # --- Daily stats (today) ---
+    stats = {
+        "steps": 0, "goal_steps": 10000,
+        "avg_heart_rate": 0, "resting_heart_rate": 0, "max_heart_rate": 0,
+        "sleep_hours": 0, "goal_sleep_hours": 8,
+        "distance": 0, "weight": 0, "bmi": 0, "weight_change": 0
+    }
+    today = dates[-1]
+    if today in activity_by_day:
+        stats["steps"] = activity_by_day[today].steps or 0
+        stats["distance"] = round((activity_by_day[today].distance or 0) / 1000, 2)
+    if today in heart_rate_by_day:
+        heart_rate = heart_rate_by_day[today]
+        stats["avg_heart_rate"] = round(heart_rate.avg)
+        stats["max_heart_rate"] = heart_rate.max
+        stats["min_heart_rate"] = heart_rate.min
+        stats["resting_heart_rate"] = heart_rate.min
+    if sleep_sessions:
+        latest_session = max(sleep_sessions, key=lambda session: session.end_time)
+        stats["sleep_hours"] = round((latest_session.end_time - latest_session.start_time).total_seconds() / 3600, 1)
+    weight, height = latest_body.get("weight"), latest_body.get("height")
+    if weight:
+        stats["weight"] = round(weight, 1)
+        if height and height > 0:
+            stats["bmi"] = round(weight / (height ** 2), 1)
+
+    # --- Charts ---
+    sleep_by_end_date = {}
+    for session in sleep_sessions:
+        end_date = session.end_time.date()
+        sleep_by_end_date[end_date] = sleep_by_end_date.get(end_date, 0) + \
+            (session.end_time - session.start_time).total_seconds() / 3600
+
+    def activity_value(day, column, scale=1):
+        row = activity_by_day.get(day)
+        value = getattr(row, column) if row else None
+        return round(value / scale, 2) if value and scale != 1 else (value or 0)
+
+    def heart_rate_value(day, column):
+        row = heart_rate_by_day.get(day)
+        return round(getattr(row, column)) if row else 0
+
+    return {
+        "daily_stats": stats,
+        "charts": {
+            "activity": {"labels": labels,
+                         "steps": [activity_value(day, "steps") for day in dates],
+                         "distance": [activity_value(day, "distance", 1000) for day in dates]},
+            "heart_rate": {"labels": labels,
+                           "avg": [heart_rate_value(day, "avg") for day in dates],
+                           "max": [heart_rate_value(day, "max") for day in dates]},
+            "sleep": {"labels": labels,
+                      "hours": [round(sleep_by_end_date.get(day, 0), 1) for day in dates],
+                      "quality": [85] * days},  # Mock, as in the live path
+            "weight": {"labels": [], "values": []},
+        },
+    }
@@ -0,0 +1,415 @@
+# app/services/health_sync.py
+"""
+Incremental sync of Google Fit data into the local health tables.
+
+Each data type (heart rate, sleep, daily activity, body measurements) has a
+per-user watermark in HealthSyncState. A sync fetches only what lies after
+the watermark (minus a lookback window for data the phone uploads late),
+upserts it in bulk and moves the watermark forward, so the dashboard can be
+served from the local tables. `synced_from` records how far back the store
+goes; asking for an older start backfills only the missing range. Ranges
+are fetched in windows of HEALTH_FETCH_WINDOW_DAYS days, at most
+HEALTH_FETCH_CONCURRENCY windows at a time per user, and each window is
+stored as soon as it lands, so a sync that fails halfway keeps what it got
+and the next one resumes from there.
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.health import Activity, BodyMeasurement, HealthSyncState, HeartRate, Sleep
+from app.services.dashboard_cache import dashboard_cache
+from app.services.health import GoogleFitServices
+from database.db_setup import SessionLocal
+
+settings = get_settings()
+
+FITNESS_URL = "https://www.googleapis.com/fitness/v1/users/me"
+HEART_RATE_SOURCE = "derived:com.google.heart_rate.bpm:com.google.android.gms:merge_heart_rate_bpm"
+WEIGHT_SOURCE = "derived:com.google.weight:com.google.android.gms:merge_weight"
+HEIGHT_SOURCE = "derived:com.google.height:com.google.android.gms:merge_height"
+SLEEP_ACTIVITY_TYPE = 72
+DAILY_SUMMARY = "daily_summary"
+DAY_MILLIS = 86400000
+
+DATA_TYPES = ("heart_rate", "sleep", "activity", "body")
+UPSERT_CHUNK_ROWS = 5000
+
+# data type -> (model, conflict key, columns updated on conflict)
+UPSERTS = {
+    "heart_rate": (HeartRate, ("user_id", "timestamp"), ("bpm_value",)),
+    "sleep": (Sleep, ("user_id", "start_time"), ("end_time", "sleep_value")),
+    "activity": (Activity, ("user_id", "timestamp", "activity_type"), ("duration", "calories", "steps", "distance")),
+    "body": (BodyMeasurement, ("user_id", "measurement_type", "timestamp"), ("value",)),
+}
+
+_in_flight: Dict[Tuple[int, Optional[date]], asyncio.Task] = {}  # (user_id, since day) -> sync
+
+
+class PartialSyncError(Exception):
+    """Some data types failed to sync while the others were stored."""
+
+    def __init__(self, stored: Dict[str, int], errors: Dict[str, Exception]):
+        self.stored = stored  # Rows per data type, including the partial progress of the failed ones
+        self.errors = errors
+        super().__init__("; ".join(
+            f"{data_type}: {getattr(error, 'detail', error)}" for data_type, error in errors.items()))
+
+
+def _from_nanos(nanos) -> datetime:
+    return datetime.fromtimestamp(int(nanos) / 1e9)
+
+
+def _from_millis(millis) -> datetime:
+    return datetime.fromtimestamp(int(millis) / 1000)
+
+
+# --- Fetching ---
+
+async def _dataset_points(service: GoogleFitServices, source: str, start: datetime, end: datetime) -> list:
+    """Raw points of a data source, following pagination."""
+    url = f"{FITNESS_URL}/dataSources/{source}/datasets/{int(start.timestamp() * 1e9)}-{int(end.timestamp() * 1e9)}"
+    points, params = [], {}
+    while True:
+        response = await service._make_request(url, method="GET", params=params or None)
+        points.extend(response.get("point", []))
+        if not response.get("nextPageToken"):
+            return points
+        params = {"pageToken": response["nextPageToken"]}
+
+
+async def _fetch_heart_rate(service: GoogleFitServices, start: datetime, end: datetime) -> List[dict]:
+    rows = []
+    for point in await _dataset_points(service, HEART_RATE_SOURCE, start, end):
+        value = point.get("value") or []
+        if value and value[0].get("fpVal") is not None:
+            rows.append({"timestamp": _from_nanos(point["startTimeNanos"]), "bpm_value": round(value[0]["fpVal"])})
+    return rows
+
+
+async def _fetch_sleep(service: GoogleFitServices, start: datetime, end: datetime) -> List[dict]:
+    params = {
+        "startTime": start.astimezone().isoformat(timespec="milliseconds"),
+        "endTime": end.astimezone().isoformat(timespec="milliseconds"),
+        "activityType": SLEEP_ACTIVITY_TYPE,
+    }
+    rows = []
+    while True:
+        response = await service._make_request(f"{FITNESS_URL}/sessions", method="GET", params=params)
+        for session in response.get("session", []):
+            if session.get("startTimeMillis") and session.get("endTimeMillis"):
+                rows.append({"start_time": _from_millis(session["startTimeMillis"]),
+                             "end_time": _from_millis(session["endTimeMillis"]),
+                             "sleep_value": session.get("activityType", SLEEP_ACTIVITY_TYPE)})
+        if not response.get("nextPageToken"):
+            return rows
+        params = {**params, "pageToken": response["nextPageToken"]}
+
+
+def _bucket_sum(dataset: dict, field: str) -> float:
+    return sum(value.get(field, 0) for point in dataset.get("point", []) for value in point.get("value", [])[:1])
+
+
+async def _fetch_activity(service: GoogleFitServices, start: datetime, end: datetime) -> List[dict]:
+    """Daily totals of steps, distance, active minutes and calories, one row per day."""
+    start = datetime.combine(start.date(), time())  # Whole days, so today's row is re-fetched until it ends
+    body = {
+        "aggregateBy": [
+            {"dataTypeName": "com.google.step_count.delta",
+             "dataSourceId": "derived:com.google.step_count.delta:com.google.android.gms:estimated_steps"},
+            {"dataTypeName": "com.google.distance.delta",
+             "dataSourceId": "derived:com.google.distance.delta:com.google.android.gms:merge_distance_delta"},
+            {"dataTypeName": "com.google.active_minutes"},
+            {"dataTypeName": "com.google.calories.expended"},
+        ],
+        "bucketByTime": {"durationMillis": DAY_MILLIS},
+        "startTimeMillis": int(start.timestamp() * 1000),
+        "endTimeMillis": int(end.timestamp() * 1000),
+    }
+    response = await service._make_request(f"{FITNESS_URL}/dataset:aggregate", method="POST", json_data=body)
+
+    rows = []
+    for bucket in response.get("bucket", []):
+        datasets = bucket.get("dataset", [])
+        if not any(dataset.get("point") for dataset in datasets):
+            continue
+        totals = {"steps": 0, "distance": 0.0, "duration": 0.0, "calories": 0.0}
+        for dataset in datasets:
+            data_type = dataset.get("dataSourceId", "")
+            if "step_count.delta" in data_type:
+                totals["steps"] = int(_bucket_sum(dataset, "intVal"))
+            elif "distance.delta" in data_type:
+                totals["distance"] = _bucket_sum(dataset, "fpVal")
+            elif "active_minutes" in data_type:
+                totals["duration"] = float(_bucket_sum(dataset, "intVal"))
+            elif "calories.expended" in data_type:
+                totals["calories"] = _bucket_sum(dataset, "fpVal")
+        # Buckets are 24 h long and drift by an hour across DST; the midpoint is always on the right day
+        day = (_from_millis(bucket["startTimeMillis"]) + timedelta(hours=12)).date()
+        rows.append({"timestamp": datetime.combine(day, time()), "activity_type": DAILY_SUMMARY,
+                     "duration": totals["duration"], "calories": round(totals["calories"]),
+                     "steps": totals["steps"], "distance": totals["distance"]})
+    return rows
+
+
+async def _fetch_body(service: GoogleFitServices, start: datetime, end: datetime) -> List[dict]:
+    weight_points, height_points = await asyncio.gather(
+        _dataset_points(service, WEIGHT_SOURCE, start, end),
+        _dataset_points(service, HEIGHT_SOURCE, start, end),
+    )
+    rows = []
+    for measurement_type, points in (("weight", weight_points), ("height", height_points)):
+        for point in points:
+            value = point.get("value") or []
+            if value and value[0].get("fpVal"):
+                rows.append({"measurement_type": measurement_type,
+                             "timestamp": _from_nanos(point.get("endTimeNanos") or point["startTimeNanos"]),
+                             "value": value[0]["fpVal"]})
+    return rows
+
+
+FETCHERS = {
+    "heart_rate": _fetch_heart_rate,
+    "sleep": _fetch_sleep,
+    "activity": _fetch_activity,
+    "body": _fetch_body,
+}
+
+
+# --- Storing ---
+
+def store_points(db: Session, user_id: int, data_type: str, rows: Iterable[dict], synced_until: datetime,
+                 synced_from: Optional[datetime] = None) -> int:
+    """
+    Upsert fetched rows in chunks and widen the data type's coverage to
+    [`synced_from`, `synced_until`], in one transaction. Returns the number
+    of rows inserted or changed: re-fetched rows with the same values are
+    left alone and not counted, so an idle sync reports 0.
+    """
+    model, key, updates = UPSERTS[data_type]
+    # One row per conflict key: Postgres rejects a statement updating the same row twice
+    unique = {tuple(row[column] for column in key[1:]): {"user_id": user_id, **row} for row in rows}
+    rows = list(unique.values())
+
+    statement = pg_insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key), set_={column: getattr(statement.excluded, column) for column in updates},
+        where=tuple_(*(getattr(model, column) for column in updates)).is_distinct_from(
+            tuple_(*(getattr(statement.excluded, column) for column in updates))),
+    ).returning(model.id)
+    changed = 0
+    for offset in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        changed += len(db.execute(statement, rows[offset:offset + UPSERT_CHUNK_ROWS]).all())
+
+    state = pg_insert(HealthSyncState).values(user_id=user_id, data_type=data_type, synced_from=synced_from,
+                                              synced_until=synced_until, points=changed, updated_at=datetime.now())
+    db.execute(state.on_conflict_do_update(
+        index_elements=[HealthSyncState.user_id, HealthSyncState.data_type],
+        set_={"synced_until": func.greatest(HealthSyncState.synced_until, state.excluded.synced_until),
+              # least() ignores NULLs: an incremental sync keeps the known start
+              "synced_from": func.least(HealthSyncState.synced_from, state.excluded.synced_from),
+              "points": HealthSyncState.points + state.excluded.points, "updated_at": state.excluded.updated_at},
+    ))
+    db.commit()
+    return changed
+
+
+def _store_in_new_session(user_id: int, data_type: str, rows: List[dict], synced_until: datetime,
+                          synced_from: Optional[datetime]) -> int:
+    db = SessionLocal()
+    try:
+        return store_points(db, user_id, data_type, rows, synced_until, synced_from)
+    finally:
+        db.close()
+
+
+def watermarks(db: Session, user_id: int) -> Dict[str, Tuple[Optional[datetime], datetime]]:
+    """data type -> (synced_from, synced_until) of the user."""
+    return {data_type: (synced_from, synced_until) for data_type, synced_from, synced_until in db.query(
+        HealthSyncState.data_type, HealthSyncState.synced_from, HealthSyncState.synced_until,
+    ).filter(HealthSyncState.user_id == user_id)}
+
+
+def covered_since(db: Session, user_id: int) -> Optional[datetime]:
+    """
+    Start of the range stored for every synced data type of the user, or
+    None if unknown (never synced, or synced before coverage was recorded).
+    """
+    starts = [synced_from for synced_from, _ in watermarks(db, user_id).values()]
+    if not starts or None in starts:
+        return None
+    return max(starts)
+
+
+def has_synced(db: Session, user_id: int) -> bool:
+    return db.query(HealthSyncState.user_id).filter(HealthSyncState.user_id == user_id).first() is not None
+
+
+Range = Tuple[datetime, datetime]
+
+
+def _sync_ranges(mark: Optional[Tuple[Optional[datetime], datetime]], since: Optional[datetime],
+                 now: datetime) -> Tuple[Optional[Range], Optional[Range]]:
+    """
+    Ranges to fetch for one data type, as (recent, backfill): everything
+    after the watermark (minus the lookback), and the part of
+    [since, synced_from) not stored yet. A first sync is all backfill.
+    """
+    initial_start = now - timedelta(days=settings.HEALTH_SYNC_INITIAL_DAYS)
+    if mark is None:
+        return None, (min(since or initial_start, initial_start), now)
+    synced_from, synced_until = mark
+    recent = (min(synced_until, now) - timedelta(hours=settings.HEALTH_SYNC_LOOKBACK_HOURS), now)
+    if since is None:
+        return recent, None
+    # Unknown coverage start: backfill up to the recent range
+    backfill_end = min(synced_from or recent[0], recent[0])
+    if since >= backfill_end:
+        return recent, None
+    return recent, (since, backfill_end)
+
+
+def _day_windows(start: datetime, end: datetime) -> List[Range]:
+    """
+    Split [start, end) into windows of HEALTH_FETCH_WINDOW_DAYS days. Edges
+    are local midnights, so daily activity buckets never straddle two windows.
+    """
+    window = timedelta(days=max(settings.HEALTH_FETCH_WINDOW_DAYS, 1))
+    windows = []
+    window_start = datetime.combine(start.date(), time())
+    while window_start < end:
+        window_end = min(datetime.combine((window_start + window).date(), time()), end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+# --- Sync ---
+
+async def _sync_user(user_id: int, since: Optional[datetime] = None) -> Dict[str, int]:
+    service = GoogleFitServices(user_id)  # 404 without an active connection
+    db = SessionLocal()
+    try:
+        marks = watermarks(db, user_id)
+    finally:
+        db.close()
+
+    now = datetime.now()
+    semaphore = asyncio.Semaphore(max(settings.HEALTH_FETCH_CONCURRENCY, 1))  # Shared by all data types
+
+    async def fetch_window(data_type, start, end):
+        async with semaphore:
+            return await FETCHERS[data_type](service, start, end)
+
+    stored = {}  # Rows per data type, counted as windows are stored: a failed sync keeps its progress
+
+    async def sync_one(data_type):
+        recent, backfill = _sync_ranges(marks.get(data_type), since, now)
+        # Stored in this order, which keeps the stored range contiguous: recent windows
+        # oldest first (moving synced_until forward), then backfill newest first
+        # (moving synced_from back). After a failure the older windows are dropped and
+        # the next sync resumes from synced_from.
+        plan = [(start, end, None) for start, end in (_day_windows(*recent) if recent else [])]
+        plan += [(start, end, start) for start, end in reversed(_day_windows(*backfill) if backfill else [])]
+        fetches = [asyncio.ensure_future(fetch_window(data_type, start, end)) for start, end, _ in plan]
+        stored[data_type] = 0
+        try:
+            for (start, end, synced_from), fetch in zip(plan, fetches):
+                rows = await fetch
+                # Bulk writes run in a worker thread so the event loop keeps serving requests
+                stored[data_type] += await asyncio.to_thread(
+                    _store_in_new_session, user_id, data_type, rows, min(end, now), synced_from)
+        finally:
+            for fetch in fetches:
+                fetch.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+
+    results = await asyncio.gather(*(sync_one(data_type) for data_type in DATA_TYPES), return_exceptions=True)
+    errors = {}
+    for data_type, result in zip(DATA_TYPES, results):
+        if isinstance(result, Exception):
+            detail = result.detail if isinstance(result, HTTPException) else result
+            print(f"Error while syncing {data_type} for user {user_id}: {detail}")
+            errors[data_type] = result
+    print(f"Google Fit sync for user {user_id}: {stored}")
+    if any(stored.values()):
+        await dashboard_cache.invalidate(user_id)
+    # Stored windows keep their progress; the caller learns the sync was incomplete
+    if len(errors) == len(DATA_TYPES):
+        raise errors[DATA_TYPES[0]]
+    if errors:
+        raise PartialSyncError(stored, errors)
+    return stored
+
+
+async def sync_user(user_id: int, since: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Sync one user's Google Fit data into the local store and return the
+    number of rows inserted or changed per data type. With `since`, also
+    backfill whatever the store lacks after it. Concurrent calls for the
+    same user and start day share one sync. Raises the error of the first
+    data type if all of them failed, and PartialSyncError if only some did
+    (the others are kept).
+    """
+    key = (user_id, since.date() if since else None)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_sync_user(user_id, since))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Shielded: a cancelled request must not cancel a sync other callers wait on
+    return await asyncio.shield(task)
+
+
+def _log_background_result(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background Google Fit sync failed: {task.exception()}")
+
+
+def schedule_sync_if_stale(db: Session, user_id: int) -> bool:
+    """
+    Start a background sync if the user's oldest watermark is older than
+    HEALTH_SYNC_MAX_STALENESS_SECONDS. Returns whether a sync was started.
+    """
+    if any(key[0] == user_id for key in _in_flight):
+        return False
+    oldest = db.query(func.min(HealthSyncState.synced_until)).filter(HealthSyncState.user_id == user_id).scalar()
+    if oldest and oldest > datetime.now() - timedelta(seconds=settings.HEALTH_SYNC_MAX_STALENESS_SECONDS):
+        return False
+    asyncio.ensure_future(sync_user(user_id)).add_done_callback(_log_background_result)
+    return True
+
+
+if __name__ == "__main__":
+    import app.models  # Register all models
+    from app.models.api_connections import ApiConnection
+
+    parser = argparse.ArgumentParser(description="Sync Google Fit data into the local health tables.")
+    parser.add_argument("--user-id", type=int, action="append", help="Only sync these users")
+    parser.add_argument("--days", type=int, default=None, help="Make sure at least this many days are stored (fetches only missing windows)")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        user_ids = args.user_id or [user_id for (user_id,) in session.query(ApiConnection.user_id).filter(
+            ApiConnection.provider == "google_fit", ApiConnection.is_active == True).distinct()]
+    finally:
+        session.close()
+
+    async def main():
+        since = datetime.now() - timedelta(days=args.days) if args.days else None
+        for user_id in user_ids:
+            try:
+                await sync_user(user_id, since)
+            except Exception as e:
+                print(f"User {user_id} not fully synced: {getattr(e, 'detail', e)}")
+
+    asyncio.run(main())
+    print(f"Synced {len(user_ids)} users.")
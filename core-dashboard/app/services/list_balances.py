@@ -0,0 +1,273 @@
+# app/services/list_balances.py
+"""
+Event-sourced balances per shopping list.
+
+Every product change appends BalanceEvent rows (one per entity whose balance
+moves) and adds the same deltas to ListBalance, so settling a list reads its
+participants' balance rows instead of every product. Changes made through the
+ORM are picked up by session flush hooks, whichever route makes them.
+`check_list_balances` verifies the incremental state against a full rebuild
+from the products.
+
+Only lists that already have balance state are updated incrementally; the
+others are initialised from their products when first settled. Both paths
+lock the list row, so an initialisation never misses a concurrent change.
+"""
+import argparse
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+from app import db
+from app.models import Friend, Product, ShoppingList
+from app.services.settlement_engine import ProductShare, compute_balances, product_deltas, round_balances
+
+
+class ListBalance(db.Model):
+    """Running, unrounded balance of one entity on one list."""
+    __tablename__ = 'list_balances'
+    shopping_list_id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(10), primary_key=True)  # 'user' or 'friend'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    balance = db.Column(db.Numeric(30, 12), nullable=False, default=Decimal('0'))
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class BalanceEvent(db.Model):
+    """Append-only log of balance deltas caused by product changes."""
+    __tablename__ = 'balance_events'
+    id = db.Column(db.Integer, primary_key=True)
+    shopping_list_id = db.Column(db.Integer, nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=True)  # None for rebuilds
+    entity_type = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Numeric(30, 12), nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # 'created', 'updated', 'deleted' or 'rebuild'
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+def product_share(product):
+    """Plain value of a Product model for the settlement engine."""
+    return ProductShare(product.name, product.price, product.paid_by,
+                        tuple(friend.id for friend in product.assigned_friends_for_product))
+
+
+def load_product_shares(shopping_list_id):
+    """
+    Products of the list as plain ProductShare values. Assigned friends are
+    loaded for all products in one extra query instead of one per product.
+    """
+    products = (
+        Product.query
+        .options(selectinload(Product.assigned_friends_for_product))
+        .filter_by(shopping_list_id=shopping_list_id)
+        .all()
+    )
+    return [product_share(product) for product in products]
+
+
+def _apply(session, shopping_list_id, deltas, product_id, reason):
+    """
+    Log the deltas and add them to ListBalance in SQL (balance = balance +
+    delta), so concurrent changes of one list never overwrite each other.
+    """
+    deltas = sorted((entity, delta) for entity, delta in deltas.items() if delta != 0)
+    if not deltas:
+        return
+    connection = session.connection()
+    now = datetime.now()
+    connection.execute(insert(BalanceEvent.__table__), [
+        {"shopping_list_id": shopping_list_id, "product_id": product_id, "entity_type": entity_type,
+         "entity_id": entity_id, "delta": delta, "reason": reason, "created_at": now}
+        for (entity_type, entity_id), delta in deltas
+    ])
+    table = ListBalance.__table__
+    statement = pg_insert(table)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.shopping_list_id, table.c.entity_type, table.c.entity_id],
+        set_={"balance": table.c.balance + statement.excluded.balance, "updated_at": statement.excluded.updated_at},
+    ), [
+        {"shopping_list_id": shopping_list_id, "entity_type": entity_type, "entity_id": entity_id,
+         "balance": delta, "updated_at": now}
+        for (entity_type, entity_id), delta in deltas
+    ])
+
+
+def lock_list(session, shopping_list_ids):
+    """Lock the lists' rows until the end of the transaction, in id order."""
+    session.connection().execute(
+        select(ShoppingList.id).where(ShoppingList.id.in_(shopping_list_ids))
+        .order_by(ShoppingList.id).with_for_update()
+    )
+
+
+def _apply_changes(session, changes):
+    """
+    Apply (shopping_list_id, product_id, old, new) product changes to the
+    lists that have balance state, after locking them.
+    """
+    per_list = []
+    for shopping_list_id, product_id, old, new in changes:
+        if shopping_list_id is None:
+            continue
+        reason = 'created' if old is None else 'deleted' if new is None else 'updated'
+        per_list.append((shopping_list_id, product_id, product_deltas(old, new), reason))
+    per_list = [change for change in per_list if any(delta != 0 for delta in change[2].values())]
+    if not per_list:
+        return
+    list_ids = sorted({change[0] for change in per_list})
+    lock_list(session, list_ids)
+    tracked = set(session.connection().execute(
+        select(ListBalance.shopping_list_id).where(ListBalance.shopping_list_id.in_(list_ids)).distinct()
+    ).scalars())
+    for shopping_list_id, product_id, deltas, reason in per_list:
+        if shopping_list_id in tracked:
+            _apply(session, shopping_list_id, deltas, product_id, reason)
+
+
+def record_product_change(shopping_list_id, product_id, old, new, commit=True):
+    """
+    Record a product change made outside the ORM (bulk UPDATE or DELETE
+    statements), which the flush hooks cannot see. `old` and `new` are the
+    product_share() before and after the change; pass None for `old` when
+    the product was created and None for `new` when it was deleted.
+    """
+    _apply_changes(db.session, [(shopping_list_id, product_id, old, new)])
+    if commit:
+        db.session.commit()
+
+
+# --- Flush hooks: product changes made through the ORM ---
+
+_PENDING_KEY = "list_balances_old_products"
+
+
+def _stored_shares(session, product_ids):
+    """
+    {product_id: (shopping_list_id, ProductShare)} as stored in the database.
+    Attribute history cannot tell: attributes expired by a commit are
+    overwritten without their old value being loaded.
+    """
+    if not product_ids:
+        return {}
+    connection = session.connection()
+    friend_ids = {}
+    for product_id, friend_id in connection.execute(
+            select(Product.id, Friend.id).join(Product.assigned_friends_for_product)
+            .where(Product.id.in_(product_ids)).order_by(Product.id, Friend.id)):
+        friend_ids.setdefault(product_id, []).append(friend_id)
+    return {
+        row.id: (row.shopping_list_id,
+                 ProductShare(row.name, row.price, row.paid_by, tuple(friend_ids.get(row.id, ()))))
+        for row in connection.execute(
+            select(Product.id, Product.shopping_list_id, Product.name, Product.price, Product.paid_by)
+            .where(Product.id.in_(product_ids)))
+    }
+
+
+# On db.session only: SQLAlchemy scopes the hooks to the Flask session class, not every Session
+@event.listens_for(db.session, "before_flush")
+def _capture_old_products(session, flush_context, instances):
+    # Pre-flush state of changed and deleted products; their new state is read after the flush
+    products = [product for product in list(session.dirty) + list(session.deleted)
+                if isinstance(product, Product) and (product in session.deleted or session.is_modified(product))]
+    stored = _stored_shares(session, [inspect(product).identity[0] for product in products])
+    session.info[_PENDING_KEY] = [
+        (product, *stored[inspect(product).identity[0]])
+        for product in products if inspect(product).identity[0] in stored
+    ]
+
+
+@event.listens_for(db.session, "after_flush")
+def _record_flushed_products(session, flush_context):
+    old_products = session.info.pop(_PENDING_KEY, [])
+    changes = []
+    for product, old_list_id, old in old_products:
+        if product in session.deleted:
+            changes.append((old_list_id, product.id, old, None))
+        elif product.shopping_list_id == old_list_id:
+            changes.append((old_list_id, product.id, old, product_share(product)))
+        else:  # Moved to another list
+            changes.append((old_list_id, product.id, old, None))
+            changes.append((product.shopping_list_id, product.id, None, product_share(product)))
+    for product in session.new:
+        if isinstance(product, Product):
+            changes.append((product.shopping_list_id, product.id, None, product_share(product)))
+    _apply_changes(session, changes)
+
+
+def stored_balances(shopping_list_id):
+    """
+    Balances of the list from ListBalance, rounded like compute_balances, or
+    None if the list has no balance state yet.
+    """
+    # Plain columns, not entities: the rows are updated in SQL behind the identity map
+    rows = db.session.query(ListBalance.entity_type, ListBalance.entity_id, ListBalance.balance).filter(
+        ListBalance.shopping_list_id == shopping_list_id).all()
+    if not rows:
+        return None
+    return round_balances({(entity_type, entity_id): balance for entity_type, entity_id, balance in rows})
+
+
+def rebuild_list_balances(shopping_list_id, products=None, commit=True):
+    """
+    Reset the list's balance state from its products, logging the correction
+    as 'rebuild' events. Returns the rebuilt (rounded) balances. Callers lock
+    the list first (lock_list) so no product change slips in between.
+    """
+    if products is None:
+        products = load_product_shares(shopping_list_id)
+    target = {}
+    for product in products:
+        for entity, amount in product_deltas(None, product).items():
+            target[entity] = target.get(entity, Decimal('0')) + amount
+
+    current = {(entity_type, entity_id): balance for entity_type, entity_id, balance in db.session.query(
+        ListBalance.entity_type, ListBalance.entity_id, ListBalance.balance,
+    ).filter(ListBalance.shopping_list_id == shopping_list_id)}
+    corrections = {entity: target.get(entity, Decimal('0')) - current.get(entity, Decimal('0'))
+                   for entity in set(target) | set(current)}
+    _apply(db.session, shopping_list_id, corrections, None, 'rebuild')
+    if commit:
+        db.session.commit()
+    return round_balances(target)
+
+
+def check_list_balances(shopping_list_id):
+    """
+    Compare the incremental balances with a full rebuild from the products.
+    Returns {entity: (stored, expected)} for every entity that differs.
+    """
+    stored = stored_balances(shopping_list_id) or {}
+    expected = compute_balances(load_product_shares(shopping_list_id))
+    return {
+        entity: (stored.get(entity, Decimal('0.00')), expected.get(entity, Decimal('0.00')))
+        for entity in set(stored) | set(expected)
+        if stored.get(entity, Decimal('0.00')) != expected.get(entity, Decimal('0.00'))
+    }
+
+
+if __name__ == "__main__":
+    from app import create_app
+    from database.migrations import SETTLEMENT_MIGRATIONS, run_migrations
+
+    parser = argparse.ArgumentParser(description="Check incremental list balances against a full rebuild.")
+    parser.add_argument("--list-id", type=int, action="append", help="Only check these lists")
+    parser.add_argument("--repair", action="store_true", help="Rebuild lists whose balances differ")
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        run_migrations(db.engine, SETTLEMENT_MIGRATIONS)
+        list_ids = args.list_id or [list_id for (list_id,) in ShoppingList.query.with_entities(ShoppingList.id).all()]
+        inconsistent = 0
+        for list_id in list_ids:
+            mismatches = check_list_balances(list_id)
+            if mismatches:
+                inconsistent += 1
+                print(f"List {list_id}: {mismatches}")
+                if args.repair:
+                    lock_list(db.session, [list_id])
+                    rebuild_list_balances(list_id)
+        print(f"Checked {len(list_ids)} lists, {inconsistent} inconsistent{' (repaired)' if args.repair and inconsistent else ''}.")
@@ -1,4 +1,6 @@
 import re
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 from decimal import Decimal, InvalidOperation  # Added InvalidOperation
 
 
@@ -48,7 +50,108 @@ def fuzzy_matching(item_name_list, ocr_candidate_name):
     return jaccard_similarity
 
 
-def match_ocr_to_shopping_list(shopping_list_items, parsed_ocr_items):
+def _encode_names(names):
+    """Normalize each name and build its trigram set, once per name."""
+    normalized = [normalize_text(name) for name in names]
+    trigrams = [generate_trigrams(text) if text else set() for text in normalized]
+    return normalized, trigrams
+
+
+def similarity_matrix(item_names, ocr_names):
+    """
+    Compute fuzzy_matching(item, ocr) for every pair at once, as an
+    len(item_names) x len(ocr_names) array with the same scores.
+
+    Both sides are normalized and trigram-encoded once. An inverted index
+    (trigram -> OCR items) yields the intersection sizes of each item with
+    all OCR names in one bincount, so pairs sharing no trigram cost nothing.
+    Substring matches (score 1.0) are only verified for pairs whose trigram
+    sets are nested, plus names too short to have trigrams.
+    """
+    items, item_trigrams = _encode_names(item_names)
+    ocr, ocr_trigrams = _encode_names(ocr_names)
+    n, m = len(items), len(ocr)
+    similarity = np.zeros((n, m))
+    if not n or not m:
+        return similarity
+
+    postings = {}
+    for j, trigrams in enumerate(ocr_trigrams):
+        for trigram in trigrams:
+            postings.setdefault(trigram, []).append(j)
+    postings = {trigram: np.array(indexes) for trigram, indexes in postings.items()}
+    ocr_sizes = np.array([len(trigrams) for trigrams in ocr_trigrams])
+
+    for i, trigrams in enumerate(item_trigrams):
+        shared = [postings[trigram] for trigram in trigrams if trigram in postings]
+        if not shared:
+            continue
+        intersection = np.bincount(np.concatenate(shared), minlength=m)
+        candidates = np.flatnonzero(intersection)
+        common = intersection[candidates]
+        similarity[i, candidates] = common / (len(trigrams) + ocr_sizes[candidates] - common)
+
+        # A substring's trigrams are a subset of the longer name's trigrams
+        for j in candidates[(common == len(trigrams)) | (common == ocr_sizes[candidates])]:
+            if items[i] in ocr[j] or ocr[j] in items[i]:
+                similarity[i, j] = 1.0
+
+    # Names shorter than a trigram (or empty after normalization) can only
+    # match as substrings; fuzzy_matching scores 0.0 for empty raw names
+    def is_short(text):
+        return len(text.replace(" ", "")) < 3
+
+    for i, text in enumerate(items):
+        if text and is_short(text):
+            for j in range(m):
+                if ocr_names[j] and (text in ocr[j] or ocr[j] in text):
+                    similarity[i, j] = 1.0
+    for j, text in enumerate(ocr):
+        if ocr_names[j] and is_short(text):
+            for i in range(n):
+                if items[i] and (items[i] in text or text in items[i]):
+                    similarity[i, j] = 1.0
+    return similarity
+
+
+def greedy_assignment(similarity, threshold):
+    """
+    Assign rows to columns in row order: each row takes the highest-scoring
+    column not yet taken (the first one on ties) if it reaches `threshold`.
+    Returns the column index per row, or -1.
+    """
+    n, m = similarity.shape
+    available = np.ones(m, dtype=bool)
+    assignment = [-1] * n
+    for i in range(n):
+        if not available.any():
+            break
+        row = np.where(available, similarity[i], -np.inf)
+        j = int(np.argmax(row))
+        if row[j] >= threshold:
+            assignment[i] = j
+            available[j] = False
+    return assignment
+
+
+def optimal_assignment(similarity, threshold):
+    """
+    Assign rows to columns maximising the total similarity of matched pairs
+    (Hungarian algorithm), independent of row order. Pairs below `threshold`
+    weigh nothing and are left unmatched. Returns the column index per row, or -1.
+    """
+    weights = np.where(similarity >= threshold, similarity, 0.0)
+    assignment = [-1] * similarity.shape[0]
+    for i, j in zip(*linear_sum_assignment(weights, maximize=True)):
+        if weights[i, j] > 0.0:
+            assignment[i] = int(j)
+    return assignment
+
+
+ASSIGNMENT_MODES = {"greedy": greedy_assignment, "optimal": optimal_assignment}
+
+
+def match_ocr_to_shopping_list(shopping_list_items, parsed_ocr_items, mode="greedy"):
     """
     Merge parsed OCR results with existing shopping list items
     and add new items found only in OCR.
@@ -60,6 +163,9 @@ def match_ocr_to_shopping_list(shopping_list_items, parsed_ocr_items):
         parsed_ocr_items (list): List of item dicts obtained from OCR parsing,
                                  e.g. [{'name': 'Wheat bread', 'total_price': '3.49'}, ...].
                                  'total_price' is a string.
+        mode (str): 'greedy' (default) lets each shopping list item take its best
+                    remaining OCR item in list order; 'optimal' maximises the
+                    total similarity over all matches.
 
     Returns:
         list: Updated list of items including prices from OCR
@@ -90,23 +196,17 @@ def match_ocr_to_shopping_list(shopping_list_items, parsed_ocr_items):
     final_shopping_list = []
     threshold = 0.45  # Trigram similarity threshold (adjustable)
 
-    # 1. Match shopping list items to OCR items
-    for s_item in shopping_list_items:
-        s_item_name_normalized = normalize_text(s_item['name'])
-        best_match_ocr_idx = -1
-        highest_similarity = -1.0
-
-        for i, ocr_item in enumerate(ocr_items_with_status):
-            if ocr_item['matched']:  # Skip already matched OCR items
-                continue
-
-            similarity = fuzzy_matching(s_item_name_normalized, ocr_item['name'])
+    if mode not in ASSIGNMENT_MODES:
+        raise ValueError(f"Unknown matching mode '{mode}', expected one of {sorted(ASSIGNMENT_MODES)}")
 
-            if similarity > highest_similarity:
-                highest_similarity = similarity
-                best_match_ocr_idx = i
+    # 1. Match shopping list items to OCR items: score all pairs at once, then
+    # assign them (greedily in list order, or optimally)
+    similarity = similarity_matrix([s_item['name'] for s_item in shopping_list_items],
+                                   [ocr_item['name'] for ocr_item in ocr_items_with_status])
+    assignment = ASSIGNMENT_MODES[mode](similarity, threshold)
 
-        if best_match_ocr_idx != -1 and highest_similarity >= threshold:
+    for s_item, best_match_ocr_idx in zip(shopping_list_items, assignment):
+        if best_match_ocr_idx != -1:
             # Matched shopping list item to an OCR item
             matched_ocr_item = ocr_items_with_status[best_match_ocr_idx]
 
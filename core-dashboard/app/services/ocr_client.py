@@ -1,24 +1,160 @@
-import requests
-from fastapi import UploadFile, HTTPException
+import os
+import uuid
+import tempfile
+import httpx
+from fastapi import UploadFile, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from typing import Optional
+from app.config import get_settings
 
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed when re-encoding is enabled
+    Image = None
+
+settings = get_settings()
+
+OCR_WORKER_URL = settings.OCR_WORKER_URL
+SPOOL_MAX_BYTES = 1024 * 1024  # Re-encoded images spill to disk past this size
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared client for the OCR worker: uploads reuse keep-alive connections
+    instead of opening a new client per request.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.OCR_REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=settings.OCR_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.OCR_MAX_CONNECTIONS),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared client (application shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _upload_size(file: UploadFile) -> int:
+    """
+    Return the size of the spooled upload without reading it into memory.
+    """
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+
+def _downscale_to_grayscale(file: UploadFile, max_side: int) -> UploadFile:
+    """
+    Re-encode the upload as a grayscale JPEG whose longest edge is at most
+    `max_side` pixels. Runs in a worker thread (Pillow is blocking).
+    """
+    file.file.seek(0)
+    image = Image.open(file.file)
+    image.draft("L", (max_side, max_side))  # JPEG decoder can scale down while decoding
+    image = image.convert("L")
+    image.thumbnail((max_side, max_side))
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    image.save(output, format="JPEG", quality=85, optimize=True)
+    output.seek(0)
+
+    filename = os.path.splitext(file.filename or "receipt")[0] + ".jpg"
+    return UploadFile(file=output, filename=filename, headers=Headers({"content-type": "image/jpeg"}))
+
+
+def check_upload_size(file: UploadFile) -> None:
+    """Reject uploads over OCR_MAX_UPLOAD_BYTES with a 413, before any work is done on them."""
+    max_bytes = settings.OCR_MAX_UPLOAD_BYTES
+    if _upload_size(file) > max_bytes:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Receipt image exceeds the {max_bytes} byte limit.")
+
+
+async def _prepare_upload(file: UploadFile) -> UploadFile:
+    """
+    Optionally downscale the image before forwarding it, falling back to the
+    original bytes if Pillow is missing or the image cannot be decoded.
+    """
+    max_side = settings.OCR_DOWNSCALE_MAX_SIDE
+    if max_side <= 0:
+        return file
+    if Image is None:
+        print("WARNING: OCR_DOWNSCALE_MAX_SIDE is set but Pillow is not installed. Forwarding original image.")
+        return file
+    try:
+        return await run_in_threadpool(_downscale_to_grayscale, file, max_side)
+    except Exception as e:
+        print(f"WARNING: Could not re-encode upload '{file.filename}', forwarding original: {e}")
+        await file.seek(0)
+        return file
+
+
+async def _multipart_stream(file: UploadFile, head: bytes, tail: bytes, max_bytes: int, chunk_size: int):
+    """
+    Yield a multipart/form-data body chunk by chunk, never holding more than
+    one chunk of the file in memory.
+    """
+    yield head
+    sent = 0
+    while chunk := await file.read(chunk_size):
+        sent += len(chunk)
+        if sent > max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Receipt image exceeds the {max_bytes} byte limit.")
+        yield chunk
+    yield tail
 
-OCR_WORKER_URL = "http://ocr_worker:5000/process"
 
 async def parse_receipt_via_ocr_worker(file: UploadFile):
     """
-    Sending file to ocr_worker services and return JSON
+    Stream the uploaded file to the ocr_worker service and return its JSON.
+
+    The upload is size-checked before anything is sent and forwarded in
+    fixed-size chunks, so memory per request stays bounded.
     """
-    file_contents = await file.read()
+    max_bytes = settings.OCR_MAX_UPLOAD_BYTES
+    check_upload_size(file)
+
+    upload = await _prepare_upload(file)
+    size = _upload_size(upload)
 
-    files = {'file': (file.filename, file_contents, file.content_type)}
+    boundary = uuid.uuid4().hex
+    filename = (upload.filename or "receipt").replace('"', "")
+    content_type = upload.content_type or "application/octet-stream"
+    head = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    }
 
     try:
-        response = requests.post(OCR_WORKER_URL, files=files)
+        response = await get_http_client().post(
+            OCR_WORKER_URL,
+            content=_multipart_stream(upload, head, tail, max_bytes, settings.OCR_UPLOAD_CHUNK_BYTES),
+            headers=headers,
+        )
         response.raise_for_status()
         return response.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error communicating with OCR worker: {e}")
         raise HTTPException(
-            status_code=503, 
+            status_code=503,
             detail=f"OCR services down. Error: {e}"
-        )
\ No newline at end of file
+        )
+    finally:
+        if upload is not file:
+            await upload.close()
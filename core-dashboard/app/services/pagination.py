@@ -0,0 +1,46 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import func, literal_column, tuple_
+
+# Sort value of rows without a date: after every dated row, newest first.
+# Keyset indexes are built on the same coalesce() expression, so it must be
+# rendered identically in queries (a literal, not a bound parameter).
+UNDATED = literal_column("'-infinity'::timestamp")
+
+
+def encode_cursor(sort_value: Optional[datetime], row_id: int) -> str:
+    """
+    Encode the (sort value, id) of the last row on a page into an opaque,
+    URL-safe keyset cursor.
+    """
+    payload = [sort_value.isoformat() if sort_value else None, row_id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """
+    Decode a cursor produced by `encode_cursor`. Raises 400 on malformed input.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(sort_value) if sort_value else None), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def date_sort_key(column):
+    """Nullable date column as a keyset sort key; NULL becomes UNDATED."""
+    return func.coalesce(column, UNDATED)
+
+
+def before_cursor(sort_key, id_column, cursor: str):
+    """
+    Filter for the rows after `cursor` in (sort_key DESC, id DESC) order.
+    A cursor holding no date continues among the undated rows.
+    """
+    cursor_date, cursor_id = decode_cursor(cursor)
+    return tuple_(sort_key, id_column) < tuple_(cursor_date if cursor_date is not None else UNDATED, cursor_id)
@@ -0,0 +1,240 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from sqlalchemy import bindparam, event, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.types import String
+
+from app.config import get_settings
+from app.models.product import CanonicalProduct, ProductAlias
+from app.models.receipt import ReceiptItem
+from app.services.merging_services import generate_trigrams, normalize_text
+
+settings = get_settings()
+
+CANDIDATES_PER_ALIAS = 5
+BACKFILL_BATCH_ROWS = 5000
+# One name inside another only counts as the same product when their lengths are close:
+# "chleb tostowy" is "chleb tostowy xl", but "mleko" is not "mleko czekoladowe"
+SUBSTRING_MIN_LENGTH_RATIO = 0.8
+
+# Closest existing products for each new alias, one indexed lookup per alias
+CANDIDATES_SQL = text("""
+SELECT a.alias, p.id, p.name
+FROM unnest(:aliases) AS a(alias)
+CROSS JOIN LATERAL (
+    SELECT id, name FROM canonical_products
+    WHERE name % a.alias
+    ORDER BY similarity(name, a.alias) DESC
+    LIMIT :per_alias
+) AS p
+""").bindparams(bindparam("aliases", type_=ARRAY(String)))
+
+_PENDING_KEY = "product_resolver_pending"
+
+
+def catalog_similarity(name: str, alias: str) -> float:
+    """
+    Score for merging an alias into a canonical product. Stricter than
+    merging_services.fuzzy_matching, which scores any substring 1.0: catalog
+    merges are persisted, so containment only counts between names of
+    similar length and everything else is scored by trigram Jaccard.
+    """
+    name, alias = normalize_text(name), normalize_text(alias)
+    if not name or not alias:
+        return 0.0
+    shorter, longer = sorted((name, alias), key=len)
+    if shorter in longer and len(shorter) / len(longer) >= SUBSTRING_MIN_LENGTH_RATIO:
+        return 1.0
+    name_trigrams, alias_trigrams = generate_trigrams(name), generate_trigrams(alias)
+    return len(name_trigrams & alias_trigrams) / len(name_trigrams | alias_trigrams)
+
+
+class ProductResolver:
+    """
+    Resolves normalised OCR item names to canonical product ids.
+
+    Known aliases are served from a bounded in-memory LRU cache, then from
+    `product_aliases`. Only names never seen before are fuzzy-scored, against
+    the closest canonical products found through the trigram index; they
+    become a new alias of the best match or, below the threshold, a new
+    canonical product.
+    """
+
+    def __init__(self, max_size: int, threshold: float):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, alias: str) -> Optional[int]:
+        with self._lock:
+            product_id = self._cache.get(alias)
+            if product_id is not None:
+                self._cache.move_to_end(alias)
+            return product_id
+
+    def remember(self, aliases: Dict[str, int]) -> None:
+        with self._lock:
+            for alias, product_id in aliases.items():
+                self._cache[alias] = product_id
+                self._cache.move_to_end(alias)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def resolve(self, db: Session, names: Iterable[str],
+                display_names: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+        """
+        Map every distinct non-empty normalised name to a product id.
+        `display_names` gives the printed spelling used for new products.
+
+        Runs in the caller's transaction and does not commit; aliases created
+        here enter the cache once the transaction commits.
+        """
+        resolved = {}
+        misses = []
+        for alias in dict.fromkeys(name for name in names if name):
+            product_id = self._cached(alias)
+            if product_id is None:
+                misses.append(alias)
+            else:
+                resolved[alias] = product_id
+        self.hits += len(resolved)
+        self.misses += len(misses)
+        if not misses:
+            return resolved
+
+        known = dict(db.execute(
+            select(ProductAlias.alias, ProductAlias.product_id).where(ProductAlias.alias.in_(misses))
+        ).all())
+        self.remember(known)
+        resolved.update(known)
+
+        unseen = [alias for alias in misses if alias not in known]
+        if unseen:
+            created = self._create_aliases(db, unseen, display_names or {})
+            resolved.update(created)
+            db.info.setdefault(_PENDING_KEY, {}).update(created)
+        return resolved
+
+    def _create_aliases(self, db: Session, aliases: list, display_names: Dict[str, str]) -> Dict[str, int]:
+        candidates = {}
+        for alias, product_id, name in db.execute(
+            CANDIDATES_SQL, {"aliases": aliases, "per_alias": CANDIDATES_PER_ALIAS}
+        ):
+            candidates.setdefault(alias, []).append((product_id, name))
+
+        # Score against existing products, and against products this batch
+        # creates so two new spellings of one product end up together
+        matches = {}
+        new_products = []
+        for alias in aliases:
+            best_score, best = 0.0, None
+            for product_id, name in candidates.get(alias, []):
+                score = catalog_similarity(name, alias)
+                if score > best_score:
+                    best_score, best = score, product_id
+            for name in new_products:
+                score = catalog_similarity(name, alias)
+                if score > best_score:
+                    best_score, best = score, name
+            if best is not None and best_score >= self.threshold:
+                matches[alias] = (best, best_score)
+            else:
+                new_products.append(alias)
+                matches[alias] = (alias, 1.0)
+
+        product_ids = {}
+        if new_products:
+            statement = pg_insert(CanonicalProduct).values(
+                [{"name": name, "display_name": display_names.get(name, name)[:255]} for name in sorted(new_products)]
+            )
+            # No-op update so a product inserted concurrently still returns its id
+            product_ids = dict(db.execute(
+                statement.on_conflict_do_update(index_elements=[CanonicalProduct.name],
+                                                set_={"name": statement.excluded.name})
+                .returning(CanonicalProduct.name, CanonicalProduct.id)
+            ).all())
+
+        rows = []
+        for alias, (target, score) in sorted(matches.items()):
+            rows.append({"alias": alias, "product_id": product_ids[target] if isinstance(target, str) else target,
+                         "score": score})
+        statement = pg_insert(ProductAlias).values(rows)
+        # A concurrent writer may have added the same alias; keep its mapping
+        return dict(db.execute(
+            statement.on_conflict_do_update(index_elements=[ProductAlias.alias],
+                                            set_={"alias": statement.excluded.alias})
+            .returning(ProductAlias.alias, ProductAlias.product_id)
+        ).all())
+
+
+product_resolver = ProductResolver(settings.PRODUCT_ALIAS_CACHE_SIZE, settings.PRODUCT_ALIAS_MATCH_THRESHOLD)
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_aliases(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        product_resolver.remember(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back_aliases(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def assign_products(db: Session, item_rows: list) -> None:
+    """Set `product_id` on receipt item rows from their normalised names."""
+    product_ids = product_resolver.resolve(db, [row["normalized_name"] for row in item_rows],
+                                           {row["normalized_name"]: row["name"] for row in reversed(item_rows)})
+    for row in item_rows:
+        row["product_id"] = product_ids.get(row["normalized_name"])
+
+
+def backfill_products(db: Session) -> int:
+    """
+    Resolve products for items stored before the catalog existed, in batches.
+    Returns the number of items updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(ReceiptItem.id, ReceiptItem.name, ReceiptItem.normalized_name)
+            .where(ReceiptItem.product_id.is_(None), ReceiptItem.id > last_id)
+            .order_by(ReceiptItem.id)
+            .limit(BACKFILL_BATCH_ROWS)
+        ).all()
+        if not rows:
+            return updated
+        last_id = rows[-1].id
+        item_rows = [{"id": item_id, "name": name, "normalized_name": normalized or normalize_text(name)}
+                     for item_id, name, normalized in rows]
+        item_rows = [row for row in item_rows if row["normalized_name"]]
+        if item_rows:
+            assign_products(db, item_rows)
+            db.execute(update(ReceiptItem), [
+                {"id": row["id"], "normalized_name": row["normalized_name"], "product_id": row["product_id"]}
+                for row in item_rows
+            ])
+        db.commit()
+        updated += len(item_rows)
+
+
+if __name__ == "__main__":
+    import app.models  # Register all models
+    from database.db_setup import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Linked {backfill_products(session)} receipt items to canonical products.")
+    finally:
+        session.close()
@@ -0,0 +1,90 @@
+from datetime import date, datetime, time
+from typing import List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.models.receipt import Receipt, ReceiptItem
+from app.services.merging_services import normalize_text
+
+BACKFILL_BATCH_ROWS = 5000
+
+
+def search_products(db: Session, user_id: int, query: str, limit: int = 20) -> list:
+    """
+    Fuzzy-search the user's purchased products by name, best match first.
+
+    Uses pg_trgm word similarity (`%>`), which the GIN index on
+    `normalized_name` answers without scanning every item. Each result is one
+    normalised product name with its purchase statistics.
+    """
+    normalized_query = normalize_text(query)
+    if not normalized_query:
+        return []
+
+    score = func.word_similarity(normalized_query, ReceiptItem.normalized_name)
+    return db.execute(
+        select(
+            ReceiptItem.normalized_name.label("name"),
+            func.mode().within_group(ReceiptItem.name).label("display_name"),
+            func.max(score).label("score"),
+            func.count().label("purchases"),
+            func.max(Receipt.receipt_date).label("last_purchased"),
+            func.min(ReceiptItem.price).label("min_price"),
+            func.max(ReceiptItem.price).label("max_price"),
+            func.avg(ReceiptItem.price).label("avg_price"),
+        )
+        .join(Receipt, Receipt.id == ReceiptItem.receipt_id)
+        .where(Receipt.user_id == user_id, ReceiptItem.normalized_name.op("%>")(normalized_query))
+        .group_by(ReceiptItem.normalized_name)
+        .order_by(func.max(score).desc(), func.count().desc(), ReceiptItem.normalized_name)
+        .limit(limit)
+    ).all()
+
+
+def price_history(db: Session, user_id: int, name: str, date_from: Optional[date] = None,
+                  date_to: Optional[date] = None, limit: int = 1000) -> List:
+    """
+    Every purchase of one product (exact normalised name), oldest first.
+    """
+    query = (
+        select(Receipt.id.label("receipt_id"), Receipt.receipt_date, Receipt.store_name,
+               ReceiptItem.name, ReceiptItem.quantity, ReceiptItem.price, ReceiptItem.total_price)
+        .join(Receipt, Receipt.id == ReceiptItem.receipt_id)
+        .where(Receipt.user_id == user_id, ReceiptItem.normalized_name == normalize_text(name))
+    )
+    if date_from:
+        query = query.where(Receipt.receipt_date >= datetime.combine(date_from, time.min))
+    if date_to:
+        query = query.where(Receipt.receipt_date <= datetime.combine(date_to, time.max))
+    return db.execute(query.order_by(Receipt.receipt_date, ReceiptItem.id).limit(limit)).all()
+
+
+def backfill_normalized_names(db: Session) -> int:
+    """
+    Fill `normalized_name` for items stored before it existed, in batches.
+    Returns the number of items updated.
+    """
+    updated = 0
+    while True:
+        rows = db.execute(
+            select(ReceiptItem.id, ReceiptItem.name)
+            .where(ReceiptItem.normalized_name.is_(None))
+            .limit(BACKFILL_BATCH_ROWS)
+        ).all()
+        if not rows:
+            return updated
+        db.execute(update(ReceiptItem), [{"id": item_id, "normalized_name": normalize_text(name)}
+                                         for item_id, name in rows])
+        db.commit()
+        updated += len(rows)
+
+
+if __name__ == "__main__":
+    import app.models  # Register all models
+    from database.db_setup import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Normalised {backfill_normalized_names(session)} receipt item names.")
+    finally:
+        session.close()
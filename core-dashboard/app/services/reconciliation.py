@@ -0,0 +1,166 @@
+import argparse
+from typing import List, Optional
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.reconciliation import ReceiptTransactionLink
+from app.models.receipt import Receipt
+
+settings = get_settings()
+
+HISTORY_BATCH_RECEIPTS = 5000
+
+# Unlinked receipts joined to unlinked transactions of the same user whose
+# absolute amount and date fall within the tolerance and window. Both ranges
+# are answered by indexes on "transaction" (user_id, abs(amount), date) and
+# (user_id, date, id), so no receipt is compared with every transaction.
+CANDIDATES_SQL = """
+SELECT r.id AS receipt_id, t.id AS transaction_id,
+       abs(abs(t.amount) - r.total_amount) AS amount_difference,
+       abs(t.date::date - r.receipt_date::date) AS days_apart,
+       coalesce(r.store_name <> '' AND position(lower(r.store_name) IN lower(t.description)) > 0, false) AS store_match
+FROM receipts r
+JOIN "transaction" t
+  ON t.user_id = r.user_id
+ AND abs(t.amount) BETWEEN r.total_amount - :tolerance AND r.total_amount + :tolerance
+ AND t.date >= r.receipt_date::date - :window
+ AND t.date < r.receipt_date::date + :window + 1
+WHERE r.user_id = :user_id AND r.receipt_date IS NOT NULL AND r.total_amount > 0
+  AND NOT EXISTS (SELECT 1 FROM receipt_transaction_links l WHERE l.receipt_id = r.id)
+  AND NOT EXISTS (SELECT 1 FROM receipt_transaction_links l WHERE l.transaction_id = t.id)
+  {restriction}
+"""
+
+
+def _confidence(amount_difference: float, days_apart: int, store_match: bool) -> float:
+    amount_score = 1.0 - amount_difference / (settings.RECONCILE_AMOUNT_TOLERANCE + 0.01)
+    date_score = 1.0 - days_apart / (settings.RECONCILE_DATE_WINDOW_DAYS + 1)
+    return round(0.5 * amount_score + 0.3 * date_score + 0.2 * store_match, 4)
+
+
+def reconcile(db: Session, user_id: int, receipt_ids: Optional[List[int]] = None,
+              transaction_ids: Optional[List[int]] = None) -> int:
+    """
+    Link the user's unlinked receipts to unlinked transactions, optionally
+    only those involving the given receipts or transactions.
+
+    Candidate pairs come from one indexed range join; they are then assigned
+    greedily by confidence so each receipt and transaction is used once.
+    Runs in the caller's transaction and does not commit. Returns the number
+    of links created.
+    """
+    restriction = ""
+    params = {
+        "user_id": user_id,
+        "tolerance": settings.RECONCILE_AMOUNT_TOLERANCE,
+        "window": settings.RECONCILE_DATE_WINDOW_DAYS,
+    }
+    if receipt_ids is not None:
+        if not receipt_ids:
+            return 0
+        restriction += "AND r.id = ANY(:receipt_ids) "
+        params["receipt_ids"] = list(receipt_ids)
+    if transaction_ids is not None:
+        if not transaction_ids:
+            return 0
+        restriction += "AND t.id = ANY(:transaction_ids) "
+        params["transaction_ids"] = list(transaction_ids)
+
+    candidates = sorted(
+        (
+            (_confidence(amount_difference, days_apart, store_match), days_apart, receipt_id, transaction_id,
+             amount_difference)
+            for receipt_id, transaction_id, amount_difference, days_apart, store_match
+            in db.execute(text(CANDIDATES_SQL.format(restriction=restriction)), params)
+        ),
+        key=lambda candidate: (-candidate[0], candidate[1], candidate[2], candidate[3]),
+    )
+
+    rows = []
+    linked_receipts, linked_transactions = set(), set()
+    for confidence, days_apart, receipt_id, transaction_id, amount_difference in candidates:
+        if receipt_id in linked_receipts or transaction_id in linked_transactions:
+            continue
+        linked_receipts.add(receipt_id)
+        linked_transactions.add(transaction_id)
+        rows.append({
+            "user_id": user_id, "receipt_id": receipt_id, "transaction_id": transaction_id,
+            "confidence": confidence, "amount_difference": amount_difference, "days_apart": days_apart,
+        })
+    if not rows:
+        return 0
+
+    # A concurrent run may have linked some of them already
+    inserted = db.execute(
+        pg_insert(ReceiptTransactionLink).values(rows).on_conflict_do_nothing()
+        .returning(ReceiptTransactionLink.id)
+    ).scalars().all()
+    return len(inserted)
+
+
+def reconcile_new(db: Session, user_id: int, receipt_ids: Optional[List[int]] = None,
+                  transaction_ids: Optional[List[int]] = None) -> None:
+    """
+    Incremental hook for freshly committed rows. Reconciliation is best
+    effort here: failures are logged and never affect the caller.
+    """
+    try:
+        reconcile(db, user_id, receipt_ids=receipt_ids, transaction_ids=transaction_ids)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"WARNING: Receipt reconciliation failed for user {user_id}: {e}")
+
+
+def reconcile_history(db: Session, user_id: Optional[int] = None, rebuild: bool = False) -> int:
+    """
+    Bulk job: reconcile every unlinked receipt of one user (or everyone),
+    committing after each batch of receipts. With `rebuild`, existing links
+    are dropped first. Returns the number of links created.
+    """
+    if rebuild:
+        statement = delete(ReceiptTransactionLink)
+        if user_id is not None:
+            statement = statement.where(ReceiptTransactionLink.user_id == user_id)
+        db.execute(statement)
+        db.commit()
+
+    if user_id is None:
+        user_ids = db.execute(select(Receipt.user_id).distinct()).scalars().all()
+    else:
+        user_ids = [user_id]
+
+    created = 0
+    for current_user_id in user_ids:
+        last_id = 0
+        while True:
+            receipt_ids = db.execute(
+                select(Receipt.id)
+                .where(Receipt.user_id == current_user_id, Receipt.id > last_id)
+                .order_by(Receipt.id)
+                .limit(HISTORY_BATCH_RECEIPTS)
+            ).scalars().all()
+            if not receipt_ids:
+                break
+            last_id = receipt_ids[-1]
+            created += reconcile(db, current_user_id, receipt_ids=receipt_ids)
+            db.commit()
+    return created
+
+
+if __name__ == "__main__":
+    import app.models  # Register all models
+    from database.db_setup import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Link receipts to the bank transactions that paid for them.")
+    parser.add_argument("--user-id", type=int, default=None, help="Only reconcile this user's receipts")
+    parser.add_argument("--rebuild", action="store_true", help="Drop existing links first")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        print(f"Created {reconcile_history(session, args.user_id, args.rebuild)} receipt-transaction links.")
+    finally:
+        session.close()
@@ -0,0 +1,217 @@
+"""
+Settlement arithmetic for shopping lists, free of any database access.
+
+Callers load products once and pass plain values in; the functions here
+compute who owes what and the transfers that settle it.
+"""
+import heapq
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+Entity = Tuple[str, int]  # ('user', user_id) or ('friend', friend_id)
+
+CENT = Decimal('0.01')
+# Balances are snapped to this before rounding to cents, so sums of split
+# shares taken in a different order (or stored at a finite scale) round alike
+SNAP = Decimal('0.000001')
+# net_transfers searches all 2^k subsets up to this many entities; larger groups are settled greedily
+EXACT_NETTING_MAX_ENTITIES = 12
+
+
+class ProductShare(NamedTuple):
+    name: str
+    price: Decimal
+    paid_by: Optional[int]  # User id of the payer
+    friend_ids: Tuple[int, ...]  # Friends sharing the cost; empty means the payer bears it
+
+
+class Transfer(NamedTuple):
+    debtor: Entity
+    creditor: Entity
+    amount: Decimal
+
+
+def involved_entities(products: Iterable[ProductShare], participant_ids: Iterable[int] = ()) -> set:
+    """Every user and friend taking part in the list: participants, payers and assigned friends."""
+    entities = {('user', user_id) for user_id in participant_ids}
+    for product in products:
+        if product.paid_by:
+            entities.add(('user', product.paid_by))
+        entities.update(('friend', friend_id) for friend_id in product.friend_ids)
+    return entities
+
+
+def compute_balances(products: Iterable[ProductShare], participant_ids: Iterable[int] = ()) -> Dict[Entity, Decimal]:
+    """
+    Net balance per entity (positive: is owed money), rounded to cents, with
+    zero balances left out.
+
+    Payers are credited with the price; the cost is split evenly between the
+    assigned friends, or borne by the payer when nobody is assigned.
+    """
+    products = list(products)
+    balances = {entity: Decimal('0.00') for entity in involved_entities(products, participant_ids)}
+
+    for product in products:
+        if product.paid_by:
+            balances[('user', product.paid_by)] += product.price
+
+    for product in products:
+        if product.friend_ids:
+            share_per_friend = product.price / Decimal(len(product.friend_ids))
+            for friend_id in product.friend_ids:
+                balances[('friend', friend_id)] -= share_per_friend
+        elif product.paid_by:
+            balances[('user', product.paid_by)] -= product.price
+        else:
+            print(f"DEBUG: compute_balances: WARNING: Product {product.name} is unassigned and has no payer. "
+                  f"Cost will not be settled.")
+
+    return round_balances(balances)
+
+
+def product_contribution(product: Optional[ProductShare]) -> Dict[Entity, Decimal]:
+    """What one product adds to each entity's balance (unrounded)."""
+    contribution = {}
+    if product is None:
+        return contribution
+    if product.paid_by:
+        contribution[('user', product.paid_by)] = product.price
+    if product.friend_ids:
+        share_per_friend = product.price / Decimal(len(product.friend_ids))
+        for friend_id in product.friend_ids:
+            contribution[('friend', friend_id)] = contribution.get(('friend', friend_id), Decimal('0.00')) - share_per_friend
+    elif product.paid_by:
+        contribution[('user', product.paid_by)] -= product.price
+    return contribution
+
+
+def product_deltas(old: Optional[ProductShare], new: Optional[ProductShare]) -> Dict[Entity, Decimal]:
+    """
+    Balance changes caused by creating (old is None), editing or deleting
+    (new is None) a product. Entities whose balance does not move are omitted.
+    """
+    deltas = product_contribution(new)
+    for entity, amount in product_contribution(old).items():
+        deltas[entity] = deltas.get(entity, Decimal('0.00')) - amount
+    return {entity: delta for entity, delta in deltas.items() if delta != 0}
+
+
+def round_balances(balances: Dict[Entity, Decimal]) -> Dict[Entity, Decimal]:
+    """Round to cents and drop zero balances, as compute_balances does."""
+    rounded = {entity: balance.quantize(SNAP, rounding=ROUND_HALF_UP).quantize(CENT, rounding=ROUND_HALF_UP)
+               for entity, balance in balances.items()}
+    return {entity: balance for entity, balance in rounded.items() if balance != Decimal('0.00')}
+
+
+def minimize_transfers(balances: Dict[Entity, Decimal]) -> List[Transfer]:
+    """
+    Settle the balances greedily: the largest debtor pays the largest
+    creditor as much as possible, until one side is exhausted. Produces at
+    most (number of debtors + number of creditors - 1) transfers.
+    """
+    debtors = sorted(([entity, -balance] for entity, balance in balances.items() if balance < 0),
+                     key=lambda item: item[1], reverse=True)
+    creditors = sorted(([entity, balance] for entity, balance in balances.items() if balance > 0),
+                       key=lambda item: item[1], reverse=True)
+
+    transfers = []
+    d = c = 0
+    while d < len(debtors) and c < len(creditors):
+        debtor, creditor = debtors[d], creditors[c]
+        amount = min(debtor[1], creditor[1])
+        transfers.append(Transfer(debtor[0], creditor[0], amount))
+        debtor[1] -= amount
+        creditor[1] -= amount
+        if debtor[1] == Decimal('0.00'):
+            d += 1
+        if creditor[1] == Decimal('0.00'):
+            c += 1
+    return transfers
+
+
+def net_transfers(balances: Dict[Entity, Decimal]) -> List[Transfer]:
+    """
+    Settle balances pooled from many lists with the fewest transfers.
+
+    A group of g entities whose balances sum to zero settles in g - 1
+    transfers, so the minimum comes from splitting the entities into as many
+    zero-sum groups as possible. That search is exponential (the problem is
+    NP-hard) and only runs up to EXACT_NETTING_MAX_ENTITIES entities with a
+    non-zero balance. Larger groups use _greedy_transfers, a heuristic that
+    is not guaranteed minimal.
+    """
+    balances = {entity: balance for entity, balance in balances.items() if balance != 0}
+    if len(balances) > EXACT_NETTING_MAX_ENTITIES:
+        return _greedy_transfers(balances)
+    transfers = []
+    for group in _zero_sum_groups(balances):
+        transfers.extend(_greedy_transfers({entity: balances[entity] for entity in group}))
+    return transfers
+
+
+def _zero_sum_groups(balances: Dict[Entity, Decimal]) -> List[List[Entity]]:
+    """
+    Partition the entities into the largest number of zero-sum groups by
+    dynamic programming over subsets, O(2^k * k). If the balances do not sum
+    to zero, one group keeps the remainder.
+    """
+    entities = sorted(balances)
+    full = (1 << len(entities)) - 1
+    sums = [Decimal('0')] * (full + 1)
+    groups = [0] * (full + 1)  # Most zero-sum groups a removal order of the subset closes
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + balances[entities[low.bit_length() - 1]]
+        groups[mask] = max(groups[mask ^ (1 << i)] for i in range(len(entities)) if mask >> i & 1) \
+            + (sums[mask] == 0)
+
+    # Remove entities from the full set along an optimal order; each zero-sum subset reached closes a group
+    result, group, mask = [], [], full
+    while mask:
+        if sums[mask] == 0 and group:
+            result.append(group)
+            group = []
+        target = groups[mask] - (sums[mask] == 0)
+        index = next(i for i in range(len(entities)) if mask >> i & 1 and groups[mask ^ (1 << i)] == target)
+        group.append(entities[index])
+        mask ^= 1 << index
+    if group:
+        result.append(group)
+    return result
+
+
+def _greedy_transfers(balances: Dict[Entity, Decimal]) -> List[Transfer]:
+    """
+    Greedy netting: debtors and creditors owing exactly the same amount are
+    paired first (one transfer settles both); the rest is settled
+    largest-first through two heaps, re-ranking any remainder. O(k log k)
+    for k entities, at most k - 1 transfers.
+    """
+    transfers = []
+    debts = [(entity, -balance) for entity, balance in sorted(balances.items()) if balance < 0]
+    credits = {}
+    for entity, balance in sorted(balances.items()):
+        if balance > 0:
+            credits.setdefault(balance, []).append(entity)
+
+    debtors = []
+    for entity, amount in debts:
+        if credits.get(amount):
+            transfers.append(Transfer(entity, credits[amount].pop(), amount))
+        else:
+            debtors.append((-amount, entity))
+    creditors = [(-amount, entity) for amount, entities in credits.items() for entity in entities]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append(Transfer(debtor, creditor, amount))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+    return transfers
@@ -1,8 +1,34 @@
 # app/services/settlement_service.py
 
-from decimal import Decimal, ROUND_HALF_UP
 from app import db
 from app.models import Product, ShoppingList, Settlement, User  # Ensure User and Friend are imported
+from app.services.list_balances import load_product_shares, lock_list, rebuild_list_balances, stored_balances
+from app.services.settlement_engine import involved_entities, minimize_transfers
+from database.db_setup import QueryCounter
+
+# Round-trips of calculate_settlements: list, product check, balance rows,
+# unsettled check, settlement insert, list status update and commit
+SETTLEMENT_QUERY_BUDGET = 7
+# The first call on a list without balance state also locks the list, reads
+# the balance rows again, loads its products, friends and participants and
+# writes the initial balances
+SETTLEMENT_INITIAL_QUERY_BUDGET = 15
+
+
+def _has_unsettled_settlements(shopping_list_id):
+    return db.session.query(
+        Settlement.query.filter_by(shopping_list_id=shopping_list_id, is_settled=False).exists()
+    ).scalar()
+
+
+def _apply_settlement_status(shopping_list, all_settled):
+    if all_settled and not shopping_list.is_fully_settled:
+        shopping_list.is_fully_settled = True
+        print(f"DEBUG: settlement status: List '{shopping_list.name}' (ID: {shopping_list.id}) has been fully settled.")
+    elif not all_settled and shopping_list.is_fully_settled:
+        shopping_list.is_fully_settled = False
+        print(
+            f"DEBUG: settlement status: List '{shopping_list.name}' (ID: {shopping_list.id}) is NOT fully settled. Status changed.")
 
 
 def check_and_update_list_settlement_status(shopping_list_id):
@@ -16,18 +42,7 @@ def check_and_update_list_settlement_status(shopping_list_id):
             f"DEBUG: _check_and_update_list_settlement_status: Error: Shopping list with ID {shopping_list_id} does not exist.")
         return
 
-    all_list_settlements = Settlement.query.filter_by(shopping_list_id=shopping_list_id).all()
-    all_settled = all(s.is_settled for s in all_list_settlements) if all_list_settlements else True
-
-    if all_settled and not shopping_list.is_fully_settled:
-        shopping_list.is_fully_settled = True
-        print(
-            f"DEBUG: _check_and_update_list_settlement_status: List '{shopping_list.name}' (ID: {shopping_list_id}) has been fully settled.")
-    elif not all_settled and shopping_list.is_fully_settled:
-        shopping_list.is_fully_settled = False
-        print(
-            f"DEBUG: _check_and_update_list_settlement_status: List '{shopping_list.name}' (ID: {shopping_list_id}) is NOT fully settled. Status changed.")
-
+    _apply_settlement_status(shopping_list, not _has_unsettled_settlements(shopping_list_id))
     db.session.commit()
     print(f"DEBUG: _check_and_update_list_settlement_status: Committed status changes for list {shopping_list_id}.")
 
@@ -36,135 +51,82 @@ def calculate_settlements(shopping_list_id):
     """
     Calculate and persist settlements for a given shopping list, minimizing the
     number of transactions. Settlements can be between Users and Friends.
+
+    Issues a fixed number of queries (SETTLEMENT_QUERY_BUDGET) whatever the
+    number of products: balances are read from the list's ListBalance rows,
+    maintained incrementally as products change, and the settlements and
+    list status are written in one flush and one commit. Lists without
+    balance state are initialised from their products first.
     """
+    with QueryCounter(db.session) as counter:
+        settlements = _calculate_settlements(shopping_list_id)
+    print(f"DEBUG: calculate_settlements: List {shopping_list_id} took {counter.count} queries.")
+    return settlements
+
+
+def _calculate_settlements(shopping_list_id):
     shopping_list = ShoppingList.query.get(shopping_list_id)
     if not shopping_list:
         print(f"DEBUG: calculate_settlements: ERROR: Shopping list with ID {shopping_list_id} not found.")
         return []
 
-    products = Product.query.filter_by(shopping_list_id=shopping_list_id).all()
-    print(f"DEBUG: calculate_settlements: Products for list {shopping_list_id}: {[p.name for p in products]}")
-
-    participants = shopping_list.participants.all()
-    print(f"DEBUG: calculate_settlements: Participants for list {shopping_list_id}: {[p.username for p in participants]}")
-
-    all_entities = set()
-    for participant in participants:
-        all_entities.add(('user', participant.id))
-
-    for product in products:
-        if product.paid_by:
-            all_entities.add(('user', product.paid_by))
-        for friend in product.assigned_friends_for_product:
-            all_entities.add(('friend', friend.id))
-
-    print(f"DEBUG: calculate_settlements: All involved entities: {all_entities}")
-
-    if not products or not all_entities:
-        print(
-            f"DEBUG: calculate_settlements: No products or entities to settle for list {shopping_list_id}. No settlements generated.")
+    if not db.session.query(Product.query.filter_by(shopping_list_id=shopping_list_id).exists()).scalar():
+        print(f"DEBUG: calculate_settlements: No products for list {shopping_list_id}. No settlements generated.")
         shopping_list.is_fully_settled = True
         db.session.commit()
         return []
 
-    balances = {entity: Decimal('0.00') for entity in all_entities}
-    print(f"DEBUG: calculate_settlements: Initial balances: {balances}")
-
-    # Sum payments (who paid for each product)
-    for product in products:
-        if product.paid_by:
-            balances[('user', product.paid_by)] += product.price
+    balances = stored_balances(shopping_list_id)
+    if balances is None:
+        # Product changes skip lists without balance state: lock the list so
+        # none lands between loading the products and writing the balances
+        lock_list(db.session, [shopping_list_id])
+        balances = stored_balances(shopping_list_id)
+    if balances is None:
+        products = load_product_shares(shopping_list_id)
+        participant_ids = [user_id for (user_id,) in shopping_list.participants.with_entities(User.id).all()]
+        print(f"DEBUG: calculate_settlements: Initialising balances of list {shopping_list_id} from "
+              f"{len(products)} products and {len(participant_ids)} participants")
+
+        if not involved_entities(products, participant_ids):
             print(
-                f"DEBUG: calculate_settlements: User {User.query.get(product.paid_by).username if User.query.get(product.paid_by) else product.paid_by} paid {product.price} for {product.name}. New balance: {balances[('user', product.paid_by)]}")
-    print(f"DEBUG: calculate_settlements: Balances after summing payments: {balances}")
-
-    # Settle product costs
-    for product in products:
-        item_price = product.price
-        assigned_friends = product.assigned_friends_for_product
-
-        if assigned_friends:
-            share_per_friend = item_price / Decimal(len(assigned_friends))
-            for friend in assigned_friends:
-                if ('friend', friend.id) in balances:
-                    balances[('friend', friend.id)] -= share_per_friend
-                    print(
-                        f"DEBUG: calculate_settlements: Friend {friend.name} assigned to {product.name}. Balance: {balances[('friend', friend.id)]}")
-                else:
-                    print(
-                        f"DEBUG: calculate_settlements: WARNING: Friend {friend.name} (ID {friend.id}) not present in balances. Logic error.")
-        else:
-            if product.paid_by:
-                if ('user', product.paid_by) in balances:
-                    balances[('user', product.paid_by)] -= item_price
-                    print(
-                        f"DEBUG: calculate_settlements: User {User.query.get(product.paid_by).username if User.query.get(product.paid_by) else product.paid_by} bears cost {item_price} for {product.name}. Balance: {balances[('user', product.paid_by)]}")
-                else:
-                    print(
-                        f"DEBUG: calculate_settlements: WARNING: Product {product.name} (ID {product.id}) is unassigned and was paid by user {product.paid_by}, who is not in balances. Cost will not be settled.")
-            else:
-                print(
-                    f"DEBUG: calculate_settlements: WARNING: Product {product.name} (ID {product.id}) is unassigned and has no payer. Cost will not be settled.")
-
-    print(f"DEBUG: calculate_settlements: Balances after settling costs: {balances}")
-
-    balances = {entity: balance.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                for entity, balance in balances.items() if balance != Decimal('0.00')}
-    print(f"DEBUG: calculate_settlements: Balances after rounding and filtering zeros: {balances}")
-
-    debtors = {entity: abs(balance) for entity, balance in balances.items() if balance < 0}
-    creditors = {entity: balance for entity, balance in balances.items() if balance > 0}
-
-    debtors_list = sorted([{'entity': entity, 'amount': amount} for entity, amount in debtors.items()],
-                          key=lambda x: x['amount'], reverse=True)
-    creditors_list = sorted([{'entity': entity, 'amount': amount} for entity, amount in creditors.items()],
-                            key=lambda x: x['amount'], reverse=True)
+                f"DEBUG: calculate_settlements: No entities to settle for list {shopping_list_id}. No settlements generated.")
+            shopping_list.is_fully_settled = True
+            db.session.commit()
+            return []
 
-    print(f"DEBUG: calculate_settlements: Debtors list: {debtors_list}")
-    print(f"DEBUG: calculate_settlements: Creditors list: {creditors_list}")
+        balances = rebuild_list_balances(shopping_list_id, products, commit=False)
+    print(f"DEBUG: calculate_settlements: Balances after rounding and filtering zeros: {balances}")
 
     generated_settlements = []
-
-    while debtors_list and creditors_list:
-        debtor_item = debtors_list[0]
-        creditor_item = creditors_list[0]
-
-        amount_to_settle = min(debtor_item['amount'], creditor_item['amount'])
-
+    for transfer in minimize_transfers(balances):
         new_settlement = Settlement(
             shopping_list_id=shopping_list_id,
-            amount=amount_to_settle,
+            amount=transfer.amount,
             is_settled=False
         )
 
-        if debtor_item['entity'][0] == 'user':
-            new_settlement.debtor_user_id = debtor_item['entity'][1]
+        if transfer.debtor[0] == 'user':
+            new_settlement.debtor_user_id = transfer.debtor[1]
         else:  # 'friend'
-            new_settlement.debtor_friend_id = debtor_item['entity'][1]
+            new_settlement.debtor_friend_id = transfer.debtor[1]
 
-        if creditor_item['entity'][0] == 'user':
-            new_settlement.creditor_user_id = creditor_item['entity'][1]
+        if transfer.creditor[0] == 'user':
+            new_settlement.creditor_user_id = transfer.creditor[1]
         else:  # 'friend'
-            new_settlement.creditor_friend_id = creditor_item['entity'][1]
+            new_settlement.creditor_friend_id = transfer.creditor[1]
 
         generated_settlements.append(new_settlement)
-        db.session.add(new_settlement)
-
-        print(f"DEBUG: calculate_settlements: Added settlement: {new_settlement}")
-
-        debtor_item['amount'] -= amount_to_settle
-        creditor_item['amount'] -= amount_to_settle
 
-        if debtor_item['amount'] == Decimal('0.00'):
-            debtors_list.pop(0)
-        if creditor_item['amount'] == Decimal('0.00'):
-            creditors_list.pop(0)
+    # New settlements are unsettled; without any, the status depends on earlier ones
+    all_settled = not generated_settlements and not _has_unsettled_settlements(shopping_list_id)
+    _apply_settlement_status(shopping_list, all_settled)
 
     try:
+        db.session.add_all(generated_settlements)
         db.session.commit()
         print(
             f"DEBUG: calculate_settlements: Generated {len(generated_settlements)} settlements for list {shopping_list_id}.")
-        check_and_update_list_settlement_status(shopping_list_id)
         return generated_settlements
     except Exception as e:
         db.session.rollback()
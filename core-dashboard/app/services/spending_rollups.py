@@ -0,0 +1,126 @@
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import delete, func, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.spending import SpendingRollup
+
+PERIODS = ("day", "week", "month")
+
+# (when, source, dimension, amount)
+SpendingEntry = Tuple[datetime, str, str, float]
+
+# Aggregates any relation exposing (user_id, date, dimension, amount) into
+# every period; weeks start on Monday, matching period_start() below.
+ROLLUP_UPSERT_SQL = """
+INSERT INTO spending_rollups (user_id, period, period_start, source, dimension, total, entries)
+SELECT s.user_id, p.period, date_trunc(p.period, s.date)::date, :source, s.dimension, sum(s.amount), count(*)
+FROM {source} AS s CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS p(period)
+WHERE s.date IS NOT NULL
+GROUP BY s.user_id, p.period, date_trunc(p.period, s.date)::date, s.dimension
+ON CONFLICT (user_id, period, period_start, source, dimension) DO UPDATE
+SET total = spending_rollups.total + EXCLUDED.total, entries = spending_rollups.entries + EXCLUDED.entries
+"""
+
+
+def period_start(period: str, when: date) -> date:
+    day = when.date() if isinstance(when, datetime) else when
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def apply_to_rollups(db: Session, user_id: int, entries: Iterable[SpendingEntry]) -> None:
+    """
+    Add newly written transactions/receipts to the rollups in one upsert.
+    Runs inside the caller's transaction and does not commit.
+    """
+    deltas = {}
+    for when, source, dimension, amount in entries:
+        for period in PERIODS:
+            key = (period, period_start(period, when), source, (dimension or "")[:100])
+            total, count = deltas.get(key, (0.0, 0))
+            deltas[key] = (total + amount, count + 1)
+    if not deltas:
+        return
+
+    # Sorted so concurrent writers lock rollup rows in the same order
+    rows = [
+        {"user_id": user_id, "period": period, "period_start": start, "source": source,
+         "dimension": dimension, "total": total, "entries": count}
+        for (period, start, source, dimension), (total, count) in sorted(deltas.items())
+    ]
+    statement = pg_insert(SpendingRollup).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[SpendingRollup.user_id, SpendingRollup.period, SpendingRollup.period_start,
+                        SpendingRollup.source, SpendingRollup.dimension],
+        set_={
+            "total": SpendingRollup.total + statement.excluded.total,
+            "entries": SpendingRollup.entries + statement.excluded.entries,
+        },
+    ))
+
+
+def get_rollups(db: Session, user_id: int, period: str, source: Optional[str] = None, by_store: bool = False,
+                date_from: Optional[date] = None, date_to: Optional[date] = None) -> list:
+    """
+    Read aggregated spending, one row per period and source (and store when
+    `by_store`). Cost depends on the number of periods, not of transactions.
+    """
+    group = [SpendingRollup.period_start, SpendingRollup.source] + ([SpendingRollup.dimension] if by_store else [])
+    dimension = SpendingRollup.dimension if by_store else literal_column("''")
+    query = (
+        select(SpendingRollup.period_start, SpendingRollup.source, dimension.label("dimension"),
+               func.sum(SpendingRollup.total).label("total"), func.sum(SpendingRollup.entries).label("entries"))
+        .where(SpendingRollup.user_id == user_id, SpendingRollup.period == period)
+        .group_by(*group)
+        .order_by(*group)
+    )
+    if source:
+        query = query.where(SpendingRollup.source == source)
+    if date_from:
+        query = query.where(SpendingRollup.period_start >= period_start(period, date_from))
+    if date_to:
+        query = query.where(SpendingRollup.period_start <= date_to)
+    return db.execute(query).all()
+
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> None:
+    """
+    Recompute rollups from scratch for one user (or everyone) and commit.
+    Use after bulk edits that bypass the application, or to backfill.
+    """
+    user_filter = "" if user_id is None else "WHERE user_id = :user_id"
+    params = {"user_id": user_id}
+
+    statement = delete(SpendingRollup)
+    if user_id is not None:
+        statement = statement.where(SpendingRollup.user_id == user_id)
+    db.execute(statement)
+
+    transactions = f"(SELECT user_id, date, '' AS dimension, amount FROM \"transaction\" {user_filter})"
+    receipts = (f"(SELECT user_id, receipt_date AS date, coalesce(left(store_name, 100), '') AS dimension, "
+                f"total_amount AS amount FROM receipts {user_filter})")
+    db.execute(text(ROLLUP_UPSERT_SQL.format(source=transactions)), {**params, "source": "transaction"})
+    db.execute(text(ROLLUP_UPSERT_SQL.format(source=receipts)), {**params, "source": "receipt"})
+    db.commit()
+
+
+if __name__ == "__main__":
+    import app.models  # Register all models
+    from database.db_setup import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild spending rollups from transactions and receipts.")
+    parser.add_argument("--user-id", type=int, default=None, help="Only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        rebuild_rollups(session, args.user_id)
+        print("Spending rollups rebuilt.")
+    finally:
+        session.close()
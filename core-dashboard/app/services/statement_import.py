@@ -0,0 +1,255 @@
+import csv
+import hashlib
+import io
+import re
+from datetime import datetime
+from typing import IO, Iterator, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.spending_rollups import ROLLUP_UPSERT_SQL
+
+IMPORT_BATCH_ROWS = 5000
+MAX_REPORTED_ERRORS = 20
+DESCRIPTION_MAX_LENGTH = 1000
+
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d", "%Y%m%d")
+CSV_DATE_HEADERS = {"date", "data", "booking date", "transaction date", "data operacji", "data księgowania"}
+CSV_AMOUNT_HEADERS = {"amount", "kwota", "value", "kwota operacji"}
+CSV_DESCRIPTION_HEADERS = {"description", "opis", "title", "tytuł", "details", "opis operacji", "name", "payee"}
+
+ParsedRow = Tuple[int, Optional[datetime], Optional[float], Optional[str], Optional[str]]  # line, date, amount, description, error
+
+
+class StatementFormatError(ValueError):
+    """The uploaded file is not a statement in the requested format."""
+
+
+class _DateParser:
+    """
+    Parse dates in any of DATE_FORMATS, trying the last successful format
+    first since a statement uses one format throughout. Statements repeat
+    the same few hundred dates, so results are memoised per import.
+    """
+
+    def __init__(self):
+        self.formats = list(DATE_FORMATS)
+        self.parsed = {}
+
+    def __call__(self, value: str) -> datetime:
+        day = re.split(r"[ T]", value.strip(), maxsplit=1)[0]  # Ignore any time part
+        if day in self.parsed:
+            return self.parsed[day]
+        for index, date_format in enumerate(self.formats):
+            try:
+                parsed = datetime.strptime(day, date_format)
+            except ValueError:
+                continue
+            if index:
+                self.formats.insert(0, self.formats.pop(index))
+            self.parsed[day] = parsed
+            return parsed
+        raise ValueError(f"unrecognised date '{value}'")
+
+
+def _parse_amount(value: str) -> float:
+    cleaned = value.strip().replace("\xa0", "").replace(" ", "")
+    if "," in cleaned and "." in cleaned:
+        cleaned = cleaned.replace(".", "").replace(",", ".") if cleaned.rfind(",") > cleaned.rfind(".") else cleaned.replace(",", "")
+    else:
+        cleaned = cleaned.replace(",", ".")
+    return float(cleaned)
+
+
+# --- Parsers: each yields (line number, date, amount, description, error) ---
+
+def parse_csv(stream: IO[str]) -> Iterator[ParsedRow]:
+    """
+    Bank CSV export with a header row. Column names are matched against common
+    English and Polish headers; the delimiter is sniffed from the first lines.
+    """
+    sample = stream.read(8192)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(stream, dialect)
+    header = [column.strip().lower() for column in next(reader, [])]
+    try:
+        date_index = next(i for i, column in enumerate(header) if column in CSV_DATE_HEADERS)
+        amount_index = next(i for i, column in enumerate(header) if column in CSV_AMOUNT_HEADERS)
+    except StopIteration:
+        raise StatementFormatError("CSV header must contain a date and an amount column")
+    description_index = next((i for i, column in enumerate(header) if column in CSV_DESCRIPTION_HEADERS), None)
+    parse_date = _DateParser()
+
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        try:
+            description = row[description_index].strip() if description_index is not None and description_index < len(row) else None
+            yield reader.line_num, parse_date(row[date_index]), _parse_amount(row[amount_index]), description, None
+        except (ValueError, IndexError) as e:
+            yield reader.line_num, None, None, None, str(e) or "malformed row"
+
+
+MT940_STATEMENT_LINE = re.compile(r"^:61:(\d{6})(\d{4})?(R?[CD])[A-Z]?([\d,]+)")
+
+
+def parse_mt940(stream: IO[str]) -> Iterator[ParsedRow]:
+    """
+    SWIFT MT940: each `:61:` statement line carries date, debit/credit mark and
+    amount; the following `:86:` field (possibly multi-line) is the description.
+    """
+    pending = None
+    description_lines = []
+    in_description = False
+
+    def flush():
+        line_number, booked, amount = pending
+        return line_number, booked, amount, " ".join(description_lines).strip() or None, None
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.rstrip("\r\n")
+        if line.startswith(":61:"):
+            if pending:
+                yield flush()
+            description_lines, in_description = [], False
+            match = MT940_STATEMENT_LINE.match(line)
+            if not match:
+                pending = None
+                yield line_number, None, None, None, "malformed :61: line"
+                continue
+            try:
+                booked = datetime.strptime(match.group(1), "%y%m%d")
+                amount = _parse_amount(match.group(4))
+            except ValueError as e:
+                pending = None
+                yield line_number, None, None, None, str(e)
+                continue
+            pending = (line_number, booked, -amount if match.group(3) in ("D", "RC") else amount)
+        elif line.startswith(":86:") and pending:
+            description_lines.append(line[4:])
+            in_description = True
+        elif line.startswith(":") or line.startswith("-"):
+            in_description = False
+        elif in_description:
+            description_lines.append(line)
+    if pending:
+        yield flush()
+
+
+OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+
+def parse_ofx(stream: IO[str]) -> Iterator[ParsedRow]:
+    """
+    OFX/QFX (SGML or XML): one transaction per <STMTTRN> block, using
+    DTPOSTED, TRNAMT and NAME/MEMO.
+    """
+    fields = None
+    start_line = 0
+    parse_date = _DateParser()
+    for line_number, line in enumerate(stream, start=1):
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN" and not closing:
+                fields, start_line = {}, line_number
+            elif tag == "STMTTRN" and closing and fields is not None:
+                try:
+                    description = " ".join(filter(None, (fields.get("NAME"), fields.get("MEMO")))) or None
+                    yield start_line, parse_date(fields["DTPOSTED"][:8]), _parse_amount(fields["TRNAMT"]), description, None
+                except (KeyError, ValueError) as e:
+                    yield start_line, None, None, None, f"invalid transaction: {e}"
+                fields = None
+            elif fields is not None and not closing and value.strip():
+                fields[tag] = value.strip()
+
+
+PARSERS = {"csv": parse_csv, "mt940": parse_mt940, "ofx": parse_ofx}
+EXTENSION_FORMATS = {".csv": "csv", ".sta": "mt940", ".mt940": "mt940", ".940": "mt940", ".ofx": "ofx", ".qfx": "ofx"}
+
+
+def detect_format(filename: Optional[str]) -> str:
+    for extension, statement_format in EXTENSION_FORMATS.items():
+        if filename and filename.lower().endswith(extension):
+            return statement_format
+    return "csv"
+
+
+def _validated_batches(rows: Iterator[ParsedRow], report: dict) -> Iterator[list]:
+    """
+    Group parsed rows into batches of staging tuples, recording rejected rows
+    in `report`. Each row gets a fingerprint of its content plus its
+    occurrence number, so genuinely repeated transactions survive while a
+    re-imported statement matches the rows it created the first time.
+    """
+    occurrences = {}
+    batch = []
+    for line_number, booked, amount, description, error in rows:
+        if error is None and (amount != amount or amount in (float("inf"), float("-inf"))):
+            error = "amount is not a finite number"
+        if error:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_number, "error": error})
+            continue
+
+        description = description[:DESCRIPTION_MAX_LENGTH] if description else None
+        key = f"{booked.isoformat()}|{amount:.2f}|{description or ''}"
+        occurrences[key] = occurrences.get(key, 0) + 1
+        fingerprint = hashlib.sha1(f"{key}|{occurrences[key]}".encode()).hexdigest()
+
+        batch.append((booked, amount, description, fingerprint))
+        if len(batch) >= IMPORT_BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_statement(db: Session, user_id: int, binary_stream: IO[bytes], statement_format: str,
+                     encoding: str = "utf-8-sig") -> dict:
+    """
+    Import a bank statement into `transaction`.
+
+    Rows are parsed as a stream, validated in batches and COPY'd into a
+    temporary staging table, then merged in one INSERT ... SELECT that skips
+    rows already imported (unique user_id + import_fingerprint) and adds the
+    new rows to the spending rollups.
+    """
+    report = {"parsed": 0, "imported": 0, "duplicates": 0, "rejected": 0, "errors": []}
+    stream = io.TextIOWrapper(binary_stream, encoding=encoding, errors="replace", newline="")
+    try:
+        raw_connection = db.connection().connection.driver_connection
+        with raw_connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE transaction_import_staging ("
+                " date timestamp NOT NULL, amount double precision NOT NULL,"
+                " description text, fingerprint varchar(40) NOT NULL"
+                ") ON COMMIT DROP"
+            )
+            with cursor.copy("COPY transaction_import_staging (date, amount, description, fingerprint) FROM STDIN") as copy:
+                for batch in _validated_batches(PARSERS[statement_format](stream), report):
+                    for row in batch:
+                        copy.write_row(row)
+                    report["parsed"] += len(batch)
+
+        # Merge and fold the rows actually inserted into the spending rollups in one statement
+        inserted = db.execute(text(
+            'WITH inserted AS (INSERT INTO "transaction" (user_id, date, amount, description, import_fingerprint) '
+            "SELECT :user_id, date, amount, description, fingerprint FROM transaction_import_staging "
+            "ON CONFLICT (user_id, import_fingerprint) DO NOTHING "
+            "RETURNING user_id, date, '' AS dimension, amount), "
+            f"rolled_up AS ({ROLLUP_UPSERT_SQL.format(source='inserted')}) "
+            "SELECT count(*) FROM inserted"
+        ), {"user_id": user_id, "source": "transaction"}).scalar_one()
+        db.commit()
+    finally:
+        stream.detach()
+
+    report["imported"] = inserted
+    report["duplicates"] = report["parsed"] - inserted
+    return report
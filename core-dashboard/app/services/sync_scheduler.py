@@ -0,0 +1,192 @@
+# app/services/sync_scheduler.py
+"""
+Background Google Fit sync for every active connection.
+
+Every tick the scheduler lists active google_fit connections and syncs the
+users that are due, at most HEALTH_SYNC_CONCURRENCY at a time. Each user is
+due again after HEALTH_SYNC_INTERVAL_SECONDS with random jitter, so users do
+not stay synchronised into bursts. A failing user backs off exponentially up
+to HEALTH_SYNC_MAX_BACKOFF_SECONDS.
+
+The schedule lives in health_sync_schedule, not in process memory, so it is
+shared by all workers and survives restarts. A pg advisory lock lets one
+worker at a time claim the due users: each run moves their next sync one
+interval ahead before syncing, so a run on another worker skips them.
+All database work runs in worker threads, off the event loop that serves
+requests.
+
+Backoff is for users whose whole sync fails (a revoked token, Google Fit
+down). When only some data types fail, the others were stored, so the user
+keeps its regular interval and the failure is only logged and counted.
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.config import get_settings
+from app.models.api_connections import ApiConnection
+from app.models.health import HealthSyncSchedule, HealthSyncState
+from app.services.health_sync import PartialSyncError, sync_user
+from database.db_setup import SessionLocal, engine
+
+settings = get_settings()
+
+SCHEDULER_LOCK_ID = 7310352  # pg advisory lock: one scheduler across all workers
+
+SYNC_USERS = Counter("health_sync_users_total", "Users synced by the background scheduler (ok, partial, error)",
+                     ["result"])
+SYNC_POINTS = Counter("health_sync_points_total", "Points stored by the background scheduler", ["data_type"])
+SYNC_RUN_SECONDS = Histogram("health_sync_run_seconds", "Duration of one scheduler run")
+SYNC_LAG = Gauge("health_sync_lag_seconds", "Age of the oldest sync watermark among active connections")
+SYNC_BACKING_OFF = Gauge("health_sync_backing_off_users", "Users waiting out an error backoff")
+
+
+def _advisory_lock(connection, function: str) -> bool:
+    """Call a pg advisory lock function on the scheduler lock."""
+    result = connection.execute(text(f"SELECT {function}(:id)"), {"id": SCHEDULER_LOCK_ID}).scalar()
+    connection.commit()
+    return result
+
+
+class SyncScheduler:
+    def __init__(self, interval_seconds: float, concurrency: int, jitter: float, max_backoff_seconds: float):
+        self.interval = interval_seconds
+        self.jitter = jitter
+        self.max_backoff = max_backoff_seconds
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def _jittered(self, seconds: float) -> timedelta:
+        return timedelta(seconds=seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    @staticmethod
+    def _active_user_ids() -> List[int]:
+        db = SessionLocal()
+        try:
+            return [user_id for (user_id,) in db.query(ApiConnection.user_id).filter(
+                ApiConnection.provider == "google_fit", ApiConnection.is_active == True,
+                ApiConnection.access_token.isnot(None)).distinct()]
+        finally:
+            db.close()
+
+    def _claim_due_users(self, user_ids: List[int], now: datetime) -> Dict[int, int]:
+        """
+        Due users with their count of consecutive failures. Their next sync is
+        moved one interval ahead before they are synced, so that no other run
+        picks them up while the sync is in flight.
+        """
+        db = SessionLocal()
+        try:
+            # Disconnected users start over if they reconnect
+            db.query(HealthSyncSchedule).filter(
+                HealthSyncSchedule.user_id.notin_(user_ids)).delete(synchronize_session=False)
+            if user_ids:
+                # Spread newly seen users over one interval instead of syncing them all at once
+                db.execute(pg_insert(HealthSyncSchedule).values([
+                    {"user_id": user_id, "next_sync_at": now + timedelta(seconds=random.uniform(0, self.interval)),
+                     "failures": 0}
+                    for user_id in user_ids
+                ]).on_conflict_do_nothing(index_elements=[HealthSyncSchedule.user_id]))
+            due = db.query(HealthSyncSchedule).filter(
+                HealthSyncSchedule.next_sync_at <= now).with_for_update().all()
+            claimed = {row.user_id: row.failures for row in due}
+            for row in due:
+                row.next_sync_at = now + self._jittered(self.interval)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _reschedule(self, user_id: int, failures: int, delay: timedelta) -> None:
+        db = SessionLocal()
+        try:
+            db.query(HealthSyncSchedule).filter(HealthSyncSchedule.user_id == user_id).update(
+                {"next_sync_at": datetime.now() + delay, "failures": failures}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _sync(self, user_id: int, failures: int) -> None:
+        async with self.semaphore:
+            result = "ok"
+            try:
+                stored = await sync_user(user_id)
+            except PartialSyncError as e:
+                # A permanently broken data type must not hold back the others
+                result, stored = "partial", e.stored
+                print(f"Scheduled Google Fit sync incomplete for user {user_id}: {e}")
+            except Exception as e:
+                failures += 1
+                backoff = min(self.interval * 2 ** failures, self.max_backoff)
+                await asyncio.to_thread(self._reschedule, user_id, failures, self._jittered(backoff))
+                SYNC_USERS.labels("error").inc()
+                print(f"Scheduled Google Fit sync failed for user {user_id} "
+                      f"(attempt {failures}, retry in {backoff:.0f}s): {getattr(e, 'detail', e)}")
+                return
+        if failures:
+            await asyncio.to_thread(self._reschedule, user_id, 0, self._jittered(self.interval))
+        SYNC_USERS.labels(result).inc()
+        for data_type, points in stored.items():
+            SYNC_POINTS.labels(data_type).inc(points)
+
+    async def run_once(self) -> int:
+        """Sync every due user. Returns how many syncs were attempted."""
+        user_ids = await asyncio.to_thread(self._active_user_ids)
+        due = await asyncio.to_thread(self._claim_due_users, user_ids, datetime.now())
+        if due:
+            with SYNC_RUN_SECONDS.time():
+                await asyncio.gather(*(self._sync(user_id, failures) for user_id, failures in due.items()))
+        await asyncio.to_thread(self._update_gauges, user_ids)
+        return len(due)
+
+    def _update_gauges(self, user_ids: List[int]) -> None:
+        if not user_ids:
+            SYNC_LAG.set(0)
+            SYNC_BACKING_OFF.set(0)
+            return
+        db = SessionLocal()
+        try:
+            SYNC_BACKING_OFF.set(db.query(func.count()).select_from(HealthSyncSchedule).filter(
+                HealthSyncSchedule.failures > 0).scalar())
+            oldest = db.query(func.min(HealthSyncState.synced_until)).filter(
+                HealthSyncState.user_id.in_(user_ids)).scalar()
+            synced_users = db.query(func.count(func.distinct(HealthSyncState.user_id))).filter(
+                HealthSyncState.user_id.in_(user_ids)).scalar()
+        finally:
+            db.close()
+        if oldest is None or synced_users < len(user_ids):
+            # Some users were never synced: report the whole initial window as lag
+            SYNC_LAG.set(settings.HEALTH_SYNC_INITIAL_DAYS * 86400)
+        else:
+            SYNC_LAG.set((datetime.now() - oldest).total_seconds())
+
+    async def run_forever(self, tick_seconds: float) -> None:
+        """Background task: run the scheduler every `tick_seconds` while holding the lock."""
+        while True:
+            await asyncio.sleep(tick_seconds)
+            try:
+                # The lock belongs to the pg session, so lock and unlock go through the same connection
+                connection = await asyncio.to_thread(engine.connect)
+                try:
+                    if not await asyncio.to_thread(_advisory_lock, connection, "pg_try_advisory_lock"):
+                        continue  # Another worker runs the scheduler
+                    try:
+                        await self.run_once()
+                    finally:
+                        await asyncio.to_thread(_advisory_lock, connection, "pg_advisory_unlock")
+                finally:
+                    await asyncio.to_thread(connection.close)
+            except Exception as e:
+                print(f"Unexpected error in Google Fit sync scheduler: {e}")
+
+
+def start_sync_scheduler() -> asyncio.Task:
+    """Create the scheduler from settings and start it as a background task."""
+    interval = settings.HEALTH_SYNC_INTERVAL_SECONDS
+    scheduler = SyncScheduler(interval, settings.HEALTH_SYNC_CONCURRENCY, settings.HEALTH_SYNC_JITTER,
+                              settings.HEALTH_SYNC_MAX_BACKOFF_SECONDS)
+    return asyncio.create_task(scheduler.run_forever(min(interval, settings.HEALTH_SYNC_TICK_SECONDS)))
@@ -0,0 +1,121 @@
+"""
+Benchmark of OCR-to-shopping-list matching on synthetic 200 x 200 lists.
+
+Compares the vectorised matcher in merging_services with the original
+pairwise loop (kept below as the reference) and checks both produce the
+same matches, then compares greedy and optimal assignment on receipt-sized
+lists. Run from core-dashboard/:
+
+    python -m benchmarks.bench_merging [--size 200] [--receipt-size 30] [--repeat 5]
+"""
+import argparse
+import copy
+import random
+import time
+from decimal import Decimal
+
+from app.services.merging_services import (
+    fuzzy_matching, greedy_assignment, match_ocr_to_shopping_list, normalize_text, optimal_assignment,
+    similarity_matrix,
+)
+
+WORDS = ["mleko", "chleb", "maslo", "jogurt", "ser", "szynka", "jajka", "woda", "sok", "kawa", "herbata",
+         "makaron", "ryz", "cukier", "maka", "pomidor", "ogorek", "jablko", "banan", "kurczak"]
+SUFFIXES = ["", " 1l", " 2%", " 500g", " naturalny", " extra", " bio", " xl"]
+OCR_NOISE = {"o": "0", "l": "1", "e": "c", "a": "4"}
+THRESHOLD = 0.45
+
+
+def reference_assignment(shopping_list_items, parsed_ocr_items):
+    """The original O(n*m) loop: indexes of the OCR item matched per list item, or -1."""
+    ocr_names = [item["name"] for item in parsed_ocr_items]
+    matched = [False] * len(ocr_names)
+    assignment = []
+    for s_item in shopping_list_items:
+        s_item_name_normalized = normalize_text(s_item["name"])
+        best_match_ocr_idx, highest_similarity = -1, -1.0
+        for i, name in enumerate(ocr_names):
+            if matched[i]:
+                continue
+            similarity = fuzzy_matching(s_item_name_normalized, name)
+            if similarity > highest_similarity:
+                highest_similarity, best_match_ocr_idx = similarity, i
+        if best_match_ocr_idx != -1 and highest_similarity >= THRESHOLD:
+            matched[best_match_ocr_idx] = True
+            assignment.append(best_match_ocr_idx)
+        else:
+            assignment.append(-1)
+    return assignment
+
+
+def _noisy(name, rng):
+    chars = [OCR_NOISE.get(char, char) if rng.random() < 0.15 else char for char in name]
+    return "".join(chars).upper() if rng.random() < 0.5 else "".join(chars)
+
+
+def generate_lists(size, rng):
+    products = [f"{rng.choice(WORDS)}{rng.choice(SUFFIXES)} {rng.choice(WORDS)}" for _ in range(size)]
+    shopping_list = [{"name": name, "price": Decimal("0.00"), "assigned_friends": [], "paid_by": 1, "db_id": i}
+                     for i, name in enumerate(products)]
+    ocr = [{"name": _noisy(name, rng), "total_price": f"{rng.uniform(1, 50):.2f}"} for name in products]
+    rng.shuffle(ocr)
+    # Edge cases: short and empty names
+    shopping_list += [{"name": "ab", "price": Decimal("0.00"), "assigned_friends": [], "paid_by": 1, "db_id": -1},
+                      {"name": "%%", "price": Decimal("0.00"), "assigned_friends": [], "paid_by": 1, "db_id": -2}]
+    ocr += [{"name": "AB", "total_price": "1.00"}, {"name": "", "total_price": "2.00"}]
+    return shopping_list, ocr
+
+
+def _timed(function, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--receipt-size", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    shopping_list, ocr = generate_lists(args.size, random.Random(args.seed))
+    reference_seconds, expected = _timed(lambda: reference_assignment(shopping_list, ocr), args.repeat)
+    vectorised_seconds, merged = _timed(
+        lambda: match_ocr_to_shopping_list(copy.deepcopy(shopping_list), ocr), args.repeat)
+
+    # Same scores for every pair, and the same prices taken as the reference
+    similarity = similarity_matrix([item["name"] for item in shopping_list], [item["name"] for item in ocr])
+    for i, s_item in enumerate(shopping_list):
+        for j, ocr_item in enumerate(ocr):
+            assert similarity[i, j] == fuzzy_matching(normalize_text(s_item["name"]), ocr_item["name"]), (i, j)
+    expected_prices = [Decimal(ocr[j]["total_price"]) if j != -1 else Decimal("0.00") for j in expected]
+    actual_prices = [item["price"] for item in merged[:len(shopping_list)]]
+    assert actual_prices == expected_prices, "vectorised matcher differs from the reference loop"
+
+    matches = sum(j != -1 for j in expected)
+    print(f"{len(shopping_list)} x {len(ocr)} items, {matches} matches")
+    print(f"reference loop: {reference_seconds * 1000:8.2f} ms")
+    print(f"vectorised:     {vectorised_seconds * 1000:8.2f} ms  ({reference_seconds / vectorised_seconds:.1f}x)")
+
+    # Greedy vs optimal assignment over the same similarity matrix
+    for size in (args.receipt_size, args.size):
+        shopping_list, ocr = generate_lists(size, random.Random(args.seed + size))
+        similarity = similarity_matrix([item["name"] for item in shopping_list], [item["name"] for item in ocr])
+        print(f"\nassignment on {similarity.shape[0]} x {similarity.shape[1]}:")
+        for name, assign in (("greedy", greedy_assignment), ("optimal", optimal_assignment)):
+            seconds, assignment = _timed(lambda: assign(similarity, THRESHOLD), args.repeat)
+            pairs = [(i, j) for i, j in enumerate(assignment) if j != -1]
+            assert all(similarity[i, j] >= THRESHOLD for i, j in pairs)
+            assert len({j for _, j in pairs}) == len(pairs)
+            total = sum(similarity[i, j] for i, j in pairs)
+            print(f"{name:8} {seconds * 1000:8.3f} ms  {len(pairs)} matches, total similarity {total:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark and property checks of the settlement engine on synthetic lists.
+
+Generates shopping lists of increasing size (participants, friends and
+products with random payers and friend assignments), then measures runtime,
+peak allocations and number of transfers of compute_balances,
+minimize_transfers and net_transfers. Every generated list is also checked
+against invariants:
+
+- balances match an exact (Fraction) computation rounded half-up to cents
+- balances replayed from product_deltas match compute_balances
+- rounded balances sum to zero within half a cent per entity, apart from
+  products nobody paid for, whose cost is owed to nobody
+- transfers are positive, go from debtors to creditors, never exceed the
+  remaining debt or credit, and leave only the rounding residue
+- minimize_transfers matches the original pop(0) loop and uses at most
+  (entities - 1) transfers
+
+No database is needed. Run from core-dashboard/:
+
+    python -m benchmarks.bench_settlement_engine [--repeat 3] [--cases 200]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+from fractions import Fraction
+
+from app.services.settlement_engine import (
+    CENT, ProductShare, compute_balances, minimize_transfers, net_transfers, product_deltas, round_balances,
+)
+
+# (participants, friends, products)
+SIZES = [(3, 5, 20), (10, 30, 200), (50, 150, 2000), (200, 600, 20000), (500, 2000, 50000)]
+
+
+def generate_products(participants, friends, products, rng):
+    """Products with a random payer (sometimes none) and 0-5 assigned friends."""
+    generated = []
+    for i in range(products):
+        paid_by = rng.randint(1, participants) if rng.random() < 0.9 else None
+        friend_count = rng.choice([0, 1, 1, 2, 2, 3, 5]) if paid_by else rng.randint(1, 5)
+        friend_ids = tuple(rng.sample(range(1, friends + 1), min(friend_count, friends)))
+        price = Decimal(rng.randint(1, 50000)) / 100
+        generated.append(ProductShare(f"product {i}", price, paid_by, friend_ids))
+    return generated
+
+
+def exact_balances(products):
+    """Balances with exact fractions, rounded half-up (away from zero) to cents."""
+    balances = {}
+    for product in products:
+        price = Fraction(product.price)
+        if product.paid_by:
+            balances[('user', product.paid_by)] = balances.get(('user', product.paid_by), 0) + price
+        if product.friend_ids:
+            for friend_id in product.friend_ids:
+                key = ('friend', friend_id)
+                balances[key] = balances.get(key, 0) - price / len(product.friend_ids)
+        elif product.paid_by:
+            balances[('user', product.paid_by)] -= price
+    rounded = {}
+    for entity, balance in balances.items():
+        cents = abs(balance) * 100
+        whole = int(cents) + (1 if cents - int(cents) >= Fraction(1, 2) else 0)
+        if whole:
+            rounded[entity] = Decimal(whole if balance > 0 else -whole) / 100
+    return rounded
+
+
+def reference_transfers(balances):
+    """The original calculate_settlements loop with sorted lists and pop(0)."""
+    debtors_list = sorted([{'entity': entity, 'amount': abs(balance)} for entity, balance in balances.items()
+                           if balance < 0], key=lambda x: x['amount'], reverse=True)
+    creditors_list = sorted([{'entity': entity, 'amount': balance} for entity, balance in balances.items()
+                             if balance > 0], key=lambda x: x['amount'], reverse=True)
+    transfers = []
+    while debtors_list and creditors_list:
+        debtor_item, creditor_item = debtors_list[0], creditors_list[0]
+        amount = min(debtor_item['amount'], creditor_item['amount'])
+        transfers.append((debtor_item['entity'], creditor_item['entity'], amount))
+        debtor_item['amount'] -= amount
+        creditor_item['amount'] -= amount
+        if debtor_item['amount'] == Decimal('0.00'):
+            debtors_list.pop(0)
+        if creditor_item['amount'] == Decimal('0.00'):
+            creditors_list.pop(0)
+    return transfers
+
+
+def check_transfers(balances, transfers):
+    """Assert the transfers settle the balances without overpaying anyone."""
+    remaining = dict(balances)
+    for debtor, creditor, amount in transfers:
+        assert amount > 0, f"non-positive transfer {amount}"
+        assert remaining.get(debtor, 0) < 0 and remaining.get(creditor, 0) > 0, "transfer direction"
+        assert amount <= -remaining[debtor], f"transfer {amount} exceeds debt {-remaining[debtor]}"
+        assert amount <= remaining[creditor], f"transfer {amount} exceeds credit {remaining[creditor]}"
+        remaining[debtor] += amount
+        remaining[creditor] -= amount
+    left = [balance for balance in remaining.values() if balance != 0]
+    # Only one side can be left over: the rounding residue of the whole list
+    assert all(balance > 0 for balance in left) or all(balance < 0 for balance in left), "both sides left over"
+    assert abs(sum(left)) == abs(sum(balances.values())), "residue differs from the rounding error"
+    assert len(transfers) <= max(len(balances) - 1, 0), f"{len(transfers)} transfers for {len(balances)} entities"
+
+
+def check_invariants(products):
+    balances = compute_balances(products)
+    assert balances == exact_balances(products), "compute_balances differs from the exact computation"
+
+    replayed = {}
+    for product in products:
+        for entity, delta in product_deltas(None, product).items():
+            replayed[entity] = replayed.get(entity, Decimal('0')) + delta
+    assert round_balances(replayed) == balances, "replayed product deltas differ from compute_balances"
+
+    unpaid = sum((product.price for product in products if not product.paid_by), Decimal('0.00'))
+    assert abs(sum(balances.values()) + unpaid) <= CENT / 2 * len(balances), "balances do not sum to zero"
+
+    minimized = minimize_transfers(balances)
+    assert [tuple(transfer) for transfer in minimized] == reference_transfers(balances), \
+        "minimize_transfers differs from the original loop"
+    check_transfers(balances, minimized)
+    check_transfers(balances, net_transfers(balances))
+
+
+def _timed(function, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _peak_kib(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", type=int, default=200, help="Random small lists checked against the invariants")
+    parser.add_argument("--max-products", type=int, default=None, help="Skip sizes with more products")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    for _ in range(args.cases):
+        check_invariants(generate_products(rng.randint(1, 8), rng.randint(1, 12), rng.randint(0, 60), rng))
+    print(f"invariants hold on {args.cases} random lists")
+
+    print(f"\n{'participants':>12} {'friends':>8} {'products':>9} {'entities':>9} | "
+          f"{'balances ms':>11} {'KiB':>8} | {'minimize ms':>11} {'transfers':>9} | {'net ms':>8} {'transfers':>9}")
+    for participants, friends, product_count in SIZES:
+        if args.max_products and product_count > args.max_products:
+            continue
+        products = generate_products(participants, friends, product_count, rng)
+        check_invariants(products)
+
+        balances_seconds, balances = _timed(lambda: compute_balances(products), args.repeat)
+        balances_kib = _peak_kib(lambda: compute_balances(products))
+        minimize_seconds, minimized = _timed(lambda: minimize_transfers(balances), args.repeat)
+        net_seconds, netted = _timed(lambda: net_transfers(balances), args.repeat)
+        print(f"{participants:>12} {friends:>8} {product_count:>9} {len(balances):>9} | "
+              f"{balances_seconds * 1000:>11.2f} {balances_kib:>8.1f} | "
+              f"{minimize_seconds * 1000:>11.3f} {len(minimized):>9} | {net_seconds * 1000:>8.3f} {len(netted):>9}")
+
+
+if __name__ == "__main__":
+    main()
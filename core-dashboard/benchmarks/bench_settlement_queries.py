@@ -0,0 +1,49 @@
+"""
+Query-count benchmark of calculate_settlements.
+
+Runs calculate_settlements on the given shopping lists inside the Flask app
+context, reports round-trips and wall time per list, and asserts the number
+of round-trips stays within SETTLEMENT_QUERY_BUDGET (or the initial budget
+for lists without balance state yet) whatever the number of products. It
+writes settlements, so run it against a disposable copy of the shopping-list
+database:
+
+    python -m benchmarks.bench_settlement_queries --list-id 1 --list-id 2
+"""
+import argparse
+import time
+
+from app import create_app, db
+from app.models import Product
+from app.services.list_balances import stored_balances
+from app.services.settlements_services import (
+    SETTLEMENT_INITIAL_QUERY_BUDGET, SETTLEMENT_QUERY_BUDGET, calculate_settlements,
+)
+from database.db_setup import QueryCounter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query-count benchmark of calculate_settlements.")
+    parser.add_argument("--list-id", type=int, action="append", required=True, help="Shopping list to settle")
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        for shopping_list_id in args.list_id:
+            products = Product.query.filter_by(shopping_list_id=shopping_list_id).count()
+            budget = SETTLEMENT_QUERY_BUDGET if stored_balances(shopping_list_id) is not None \
+                else SETTLEMENT_INITIAL_QUERY_BUDGET
+            db.session.commit()
+
+            started = time.perf_counter()
+            with QueryCounter(db.session) as counter:
+                settlements = calculate_settlements(shopping_list_id)
+            elapsed = time.perf_counter() - started
+
+            print(f"list {shopping_list_id}: {products} products, {len(settlements)} settlements, "
+                  f"{counter.count} queries, {elapsed * 1000:.1f} ms")
+            assert counter.count <= budget, (
+                f"list {shopping_list_id} took {counter.count} queries, budget is {budget}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import DDL, create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base 
 from app.config import get_settings
@@ -8,6 +8,9 @@ DATABASE_URL = settings.DATABASE_URL
 
 Base = declarative_base()
 
+# Trigram indexes (gin_trgm_ops) on product names need pg_trgm
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 
 engine = create_engine(DATABASE_URL, connect_args={}) 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -20,4 +23,36 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+class QueryCounter:
+    """
+    Context manager counting database round-trips issued on a session's
+    connection (statements plus the final COMMIT, if any).
+
+        with QueryCounter(db) as counter:
+            ...
+        print(counter.count)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.count = 0
+
+    def _before_cursor_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def _commit(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        self.connection = self.db.connection()
+        event.listen(self.connection, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(self.connection, "commit", self._commit)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.connection, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(self.connection, "commit", self._commit)
+        return False
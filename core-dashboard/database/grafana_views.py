@@ -0,0 +1,151 @@
+"""
+Materialised views backing the Grafana dashboards.
+
+Grafana panels query these pre-aggregated views instead of scanning the
+application tables. A background task refreshes them concurrently (readers
+are never blocked) and exports how stale each view is.
+"""
+import asyncio
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+REFRESH_LOCK_ID = 7310351  # pg advisory lock: one refresher across all workers
+
+# name -> (query, index statements). Each view needs a unique index on plain
+# columns for REFRESH ... CONCURRENTLY; INCLUDE makes it covering for panels.
+VIEWS = {
+    "grafana_daily_spending": (
+        """
+        SELECT user_id, date_trunc('day', date)::date AS day, 'transaction' AS source,
+               sum(amount) AS total, count(*) AS entries
+        FROM "transaction" WHERE date IS NOT NULL
+        GROUP BY user_id, date_trunc('day', date)::date
+        UNION ALL
+        SELECT user_id, date_trunc('day', receipt_date)::date, 'receipt',
+               sum(total_amount), count(*)
+        FROM receipts WHERE receipt_date IS NOT NULL
+        GROUP BY user_id, date_trunc('day', receipt_date)::date
+        """,
+        ["CREATE UNIQUE INDEX IF NOT EXISTS ux_grafana_daily_spending "
+         "ON grafana_daily_spending (user_id, day, source) INCLUDE (total, entries)"],
+    ),
+    "grafana_monthly_store_spending": (
+        """
+        SELECT r.user_id, date_trunc('month', r.receipt_date)::date AS month,
+               coalesce(r.store_name, '') AS store_name,
+               sum(r.total_amount) AS total, count(*) AS receipts,
+               coalesce(sum(i.items), 0) AS items
+        FROM receipts r
+        LEFT JOIN (SELECT receipt_id, count(*) AS items FROM receipt_items GROUP BY receipt_id) i
+               ON i.receipt_id = r.id
+        WHERE r.receipt_date IS NOT NULL
+        GROUP BY r.user_id, date_trunc('month', r.receipt_date)::date, coalesce(r.store_name, '')
+        """,
+        ["CREATE UNIQUE INDEX IF NOT EXISTS ux_grafana_monthly_store_spending "
+         "ON grafana_monthly_store_spending (user_id, month, store_name) INCLUDE (total, receipts, items)"],
+    ),
+    "grafana_daily_health": (
+        """
+        WITH hr AS (
+            SELECT user_id, timestamp::date AS day, round(avg(bpm_value))::int AS avg_bpm,
+                   max(bpm_value) AS max_bpm, min(bpm_value) AS min_bpm
+            FROM heart_rate GROUP BY user_id, timestamp::date
+        ), sl AS (
+            SELECT user_id, end_time::date AS day,
+                   round((sum(extract(epoch FROM end_time - start_time)) / 3600)::numeric, 2) AS sleep_hours
+            FROM sleep GROUP BY user_id, end_time::date
+        ), ac AS (
+            SELECT user_id, timestamp::date AS day, sum(duration) AS activity_minutes, sum(calories) AS calories
+            FROM activity GROUP BY user_id, timestamp::date
+        )
+        SELECT coalesce(hr.user_id, sl.user_id, ac.user_id) AS user_id,
+               coalesce(hr.day, sl.day, ac.day) AS day,
+               hr.avg_bpm, hr.max_bpm, hr.min_bpm, sl.sleep_hours, ac.activity_minutes, ac.calories
+        FROM hr
+        FULL JOIN sl ON sl.user_id = hr.user_id AND sl.day = hr.day
+        FULL JOIN ac ON ac.user_id = coalesce(hr.user_id, sl.user_id) AND ac.day = coalesce(hr.day, sl.day)
+        """,
+        ["CREATE UNIQUE INDEX IF NOT EXISTS ux_grafana_daily_health ON grafana_daily_health (user_id, day) "
+         "INCLUDE (avg_bpm, max_bpm, min_bpm, sleep_hours, activity_minutes, calories)"],
+    ),
+}
+
+VIEW_STALENESS = Gauge("grafana_view_staleness_seconds", "Seconds since the view was last refreshed", ["view"])
+VIEW_REFRESH_SECONDS = Histogram("grafana_view_refresh_seconds", "Duration of a concurrent view refresh", ["view"])
+VIEW_REFRESH_FAILURES = Counter("grafana_view_refresh_failures_total", "Failed view refreshes", ["view"])
+
+_last_refreshed = {}
+
+
+def create_views(engine: Engine) -> None:
+    """
+    Create the views (populated) and their indexes if they do not exist yet,
+    plus the table recording refresh times so Grafana can show freshness.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS grafana_view_refreshes ("
+            " view_name varchar(100) PRIMARY KEY, refreshed_at timestamptz NOT NULL,"
+            " duration_seconds double precision NOT NULL)"
+        ))
+        for name, (query, indexes) in VIEWS.items():
+            connection.execute(text(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}"))
+            for index in indexes:
+                connection.execute(text(index))
+
+    for name in VIEWS:
+        _last_refreshed.setdefault(name, time.time())
+        VIEW_STALENESS.labels(name).set_function(lambda name=name: time.time() - _last_refreshed[name])
+
+
+def refresh_views(engine: Engine) -> bool:
+    """
+    Refresh every view concurrently. Returns False without refreshing if
+    another worker holds the refresh lock.
+    """
+    with engine.connect() as connection:
+        locked = connection.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": REFRESH_LOCK_ID}).scalar()
+        if not locked:
+            # Another worker is refreshing; report its last refresh times instead
+            for name, refreshed_at in connection.execute(text(
+                "SELECT view_name, extract(epoch FROM refreshed_at) FROM grafana_view_refreshes"
+            )):
+                if name in _last_refreshed:
+                    _last_refreshed[name] = float(refreshed_at)
+            connection.commit()
+            return False
+        connection.commit()
+        try:
+            for name in VIEWS:
+                started = time.time()
+                try:
+                    with connection.begin():
+                        connection.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+                        duration = time.time() - started
+                        connection.execute(text(
+                            "INSERT INTO grafana_view_refreshes (view_name, refreshed_at, duration_seconds) "
+                            "VALUES (:name, now(), :duration) ON CONFLICT (view_name) DO UPDATE "
+                            "SET refreshed_at = EXCLUDED.refreshed_at, duration_seconds = EXCLUDED.duration_seconds"
+                        ), {"name": name, "duration": duration})
+                except Exception as e:
+                    VIEW_REFRESH_FAILURES.labels(name).inc()
+                    print(f"Error refreshing materialized view {name}: {e}")
+                    continue
+                _last_refreshed[name] = time.time()
+                VIEW_REFRESH_SECONDS.labels(name).observe(duration)
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": REFRESH_LOCK_ID})
+            connection.commit()
+    return True
+
+
+async def refresh_views_periodically(engine: Engine, interval_seconds: float) -> None:
+    """Background task: refresh the views every `interval_seconds`."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(refresh_views, engine)
+        except Exception as e:
+            print(f"Unexpected error in Grafana view refresh task: {e}")
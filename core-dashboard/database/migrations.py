@@ -0,0 +1,153 @@
+"""
+Schema changes for databases created before a model changed.
+
+`Base.metadata.create_all` only creates missing tables; it never adds
+columns, constraints or indexes to a table that already exists. Those
+changes are listed here and applied once, in order, at startup. Applied
+migrations are recorded in `schema_migrations`, and a pg advisory lock
+keeps several workers from applying them at the same time.
+
+Every statement is idempotent (IF NOT EXISTS, or a data fix that is a
+no-op on clean data), because on a fresh database create_all has already
+built the current schema. Indexes are built without CONCURRENTLY (it cannot
+run inside the migration's transaction), so the table is write-locked while
+each index builds.
+
+SETTLEMENT_MIGRATIONS hold the balance tables of the shopping-list
+settlement services (app.services.list_balances and group_ledger). Those
+live in the Flask shopping-list database, not in this service's, so they are
+applied with that app's engine: `run_migrations(db.engine,
+SETTLEMENT_MIGRATIONS)`, which the settlement CLIs do on every run.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+MIGRATIONS_LOCK_ID = 7310353  # pg advisory lock: one migrating worker at a time
+
+# (name, statements), applied in list order. Never edit an applied entry; add a new one.
+MIGRATIONS = [
+    ("0001_receipt_image_hashes", [
+        "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS content_hash varchar(64)",
+        "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS perceptual_hash bigint",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_receipts_user_content_hash ON receipts (user_id, content_hash)",
+        # A btree cannot serve Hamming-distance lookups
+        "DROP INDEX IF EXISTS ix_receipts_user_perceptual_hash",
+    ]),
+    ("0002_receipt_keyset_indexes", [
+        # Replaced by indexes on the NULL-safe sort key
+        "DROP INDEX IF EXISTS ix_receipts_user_date_id",
+        "DROP INDEX IF EXISTS ix_receipts_user_store_date_id",
+        "CREATE INDEX IF NOT EXISTS ix_receipts_user_sort_date_id "
+        "ON receipts (user_id, coalesce(receipt_date, '-infinity'::timestamp), id)",
+        "CREATE INDEX IF NOT EXISTS ix_receipts_user_store_sort_date_id "
+        "ON receipts (user_id, store_name, coalesce(receipt_date, '-infinity'::timestamp), id)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_items_receipt_id ON receipt_items (receipt_id)",
+    ]),
+    ("0003_transaction_keyset_indexes", [
+        'CREATE INDEX IF NOT EXISTS ix_transaction_user_date_id ON "transaction" (user_id, date, id)',
+        "CREATE INDEX IF NOT EXISTS ix_transaction_user_sort_date_id "
+        "ON \"transaction\" (user_id, coalesce(date, '-infinity'::timestamp), id)",
+    ]),
+    ("0004_transaction_import_fingerprint", [
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS import_fingerprint varchar(40)',
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_transaction_user_import_fingerprint "
+        'ON "transaction" (user_id, import_fingerprint)',
+    ]),
+    ("0005_transaction_idempotency_key", [
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS idempotency_key varchar(64)',
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_transaction_user_idempotency_key "
+        'ON "transaction" (user_id, idempotency_key)',
+    ]),
+    # Then fill names of existing items with `python -m app.services.product_search`
+    ("0006_receipt_item_normalized_name", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "ALTER TABLE receipt_items ADD COLUMN IF NOT EXISTS normalized_name varchar(255)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_items_normalized_name_trgm "
+        "ON receipt_items USING gin (normalized_name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_items_normalized_name ON receipt_items (normalized_name, receipt_id)",
+    ]),
+    # Then link existing items with `python -m app.services.product_catalog`
+    ("0007_receipt_item_product_id", [
+        "ALTER TABLE receipt_items ADD COLUMN IF NOT EXISTS product_id integer REFERENCES canonical_products (id)",
+        "CREATE INDEX IF NOT EXISTS ix_receipt_items_product_id ON receipt_items (product_id)",
+    ]),
+    ("0008_transaction_abs_amount_index", [
+        "CREATE INDEX IF NOT EXISTS ix_transaction_user_abs_amount_date "
+        'ON "transaction" (user_id, abs(amount), date)',
+    ]),
+    # The health sync upserts on these keys; duplicates from the old live path keep their latest row
+    ("0009_health_store_keys", [
+        "DELETE FROM heart_rate a USING heart_rate b "
+        "WHERE a.user_id = b.user_id AND a.timestamp = b.timestamp AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_heart_rate_user_timestamp ON heart_rate (user_id, timestamp)",
+        "DELETE FROM sleep a USING sleep b "
+        "WHERE a.user_id = b.user_id AND a.start_time = b.start_time AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_sleep_user_start_time ON sleep (user_id, start_time)",
+        "DELETE FROM activity a USING activity b "
+        "WHERE a.user_id = b.user_id AND a.timestamp = b.timestamp AND a.activity_type = b.activity_type "
+        "AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_activity_user_timestamp_type "
+        "ON activity (user_id, timestamp, activity_type)",
+        "ALTER TABLE activity ADD COLUMN IF NOT EXISTS steps integer",
+        "ALTER TABLE activity ADD COLUMN IF NOT EXISTS distance double precision",
+    ]),
+    # NULL for existing rows: their coverage start is unknown until a backfill
+    ("0010_health_sync_state_synced_from", [
+        "ALTER TABLE health_sync_state ADD COLUMN IF NOT EXISTS synced_from timestamp without time zone",
+    ]),
+]
+
+
+# Flask shopping-list database, see the module docstring
+SETTLEMENT_MIGRATIONS = [
+    ("s0001_list_balances", [
+        "CREATE TABLE IF NOT EXISTS list_balances ("
+        " shopping_list_id integer NOT NULL, entity_type varchar(10) NOT NULL, entity_id integer NOT NULL,"
+        " balance numeric(30, 12) NOT NULL DEFAULT 0, updated_at timestamp without time zone,"
+        " PRIMARY KEY (shopping_list_id, entity_type, entity_id))",
+        "CREATE TABLE IF NOT EXISTS balance_events ("
+        " id serial PRIMARY KEY, shopping_list_id integer NOT NULL, product_id integer,"
+        " entity_type varchar(10) NOT NULL, entity_id integer NOT NULL, delta numeric(30, 12) NOT NULL,"
+        " reason varchar(20) NOT NULL, created_at timestamp without time zone)",
+        "CREATE INDEX IF NOT EXISTS ix_balance_events_shopping_list_id ON balance_events (shopping_list_id)",
+    ]),
+    ("s0002_group_ledger", [
+        "CREATE TABLE IF NOT EXISTS group_ledger_contributions ("
+        " shopping_list_id integer NOT NULL, entity_type varchar(10) NOT NULL, entity_id integer NOT NULL,"
+        " group_key varchar(40) NOT NULL, amount numeric(12, 2) NOT NULL,"
+        " PRIMARY KEY (shopping_list_id, entity_type, entity_id))",
+        "CREATE INDEX IF NOT EXISTS ix_group_ledger_contributions_group_key ON group_ledger_contributions (group_key)",
+        "CREATE TABLE IF NOT EXISTS group_balances ("
+        " group_key varchar(40) NOT NULL, entity_type varchar(10) NOT NULL, entity_id integer NOT NULL,"
+        " balance numeric(12, 2) NOT NULL DEFAULT 0, updated_at timestamp without time zone,"
+        " PRIMARY KEY (group_key, entity_type, entity_id))",
+    ]),
+]
+
+
+def run_migrations(engine: Engine, migrations: list = MIGRATIONS) -> None:
+    """Apply every migration not recorded in `schema_migrations` yet."""
+    with engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        try:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                " name varchar(100) PRIMARY KEY, applied_at timestamptz NOT NULL DEFAULT now())"
+            ))
+            connection.commit()
+            applied = set(connection.execute(text("SELECT name FROM schema_migrations")).scalars())
+            for name, statements in migrations:
+                if name in applied:
+                    continue
+                print(f"Applying migration {name}...")
+                try:
+                    for statement in statements:
+                        connection.execute(text(statement))
+                    connection.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            connection.commit()